@@ -12,6 +12,12 @@ from numpy import array_equal
 from src import local_facial_recognition as lfr
 from src import entity_search as es
 from src import conversions
+from src import gallery
+from src import knowledge_store
+from src import migrate_db
+from src import multi_face
+from src import rekognition_cache
+from src import tree_rendering
 
 from src import aws_rekognition
 from src import user_contribution
@@ -36,6 +42,8 @@ def local_search(search_file_location, debug=False):
 def aws_search(search_file_location, debug=False):
     """
     Search for a person using AWS Rekognition.
+    The image is downscaled and sent inline, re-encoded smaller if needed to fit Rekognition's inline size limit.
+    Images looked up recently are answered from the Rekognition cache without calling AWS.
 
     :param search_file_location: Local location of the file to search for using AWS
     :type search_file_location: str
@@ -44,17 +52,23 @@ def aws_search(search_file_location, debug=False):
     :return: AWS-detected person name or False if no person was detected
     :rtype: AWSPersonTup or bool
     """
-    s3_file_name = s3_operations.upload_process(search_file_location, debug=debug)
-
-    if s3_file_name:
-        detected_celebrity = aws_rekognition.detect_labels(s3_file_name, debug=debug)
+    # Decoded once, at the size sent to Rekognition: the same pixels are hashed for the cache and encoded
+    image = aws_rekognition.decode_image(search_file_location)
+    image_hash = rekognition_cache.hash_pixels(image.array)
+    detected_celebrity = aws_rekognition.get_cached_detection(image_hash, debug=debug)
+    if debug:
+        rekognition_cache.print_rekognition_cache_stats()
+    if detected_celebrity is not None:
         if detected_celebrity:
-            s3_operations.cleanup(s3_file_name, debug=debug)
             return detected_celebrity
         print("No celebrity detected by AWS.")
-        s3_operations.cleanup(s3_file_name, debug=debug)
         return False
-    print("Unable to upload file to AWS S3.")
+
+    image_bytes = aws_rekognition.encode_pixels(image.array)
+    detected_celebrity = aws_rekognition.detect_labels_from_bytes(image_bytes, debug=debug, image_hash=image_hash)
+    if detected_celebrity:
+        return detected_celebrity
+    print("No celebrity detected by AWS.")
     return False
 
 
@@ -95,7 +109,7 @@ def random_person_image(directory):
 def main():
     """
     Main method for the R-IBES client.
-    `python3 main.py [--offline] [--debug]`
+    `python3 main.py [--offline] [--debug] [--memmap] [--ann] [--render=none|json|dot|svg|png] [--stream] [--multi]`
     """
     # Determine if we are running in offline mode or debug mode from the command line
     offline = False
@@ -103,17 +117,49 @@ def main():
     if '--offline' in sys.argv:
         print('Running in offline mode.')
         offline = True
+        if os.path.exists(knowledge_store.KNOWLEDGE_STORE_PATH):
+            print('Answering questions from the local DBpedia knowledge store.')
+            knowledge_store.enable_knowledge_store()
+        else:
+            print('No local DBpedia knowledge store found, questions are still answered by DBpedia.')
     elif any(var == '' for var in s3_operations.get_env_vars()):
         print('Running in offline mode because at least one S3 environment variable is missing in the .env file.')
         offline = True
     if '--debug' in sys.argv:
         print('Running in debug mode.')
         debug = True
+    if '--memmap' in sys.argv:
+        print('Using the memory-mapped encoding gallery.')
+        gallery.set_gallery_backend('memmap')
+    if '--ann' in sys.argv:
+        print('Using the approximate nearest-neighbour index for local face matching.')
+        gallery.set_ann_search()
+    output_format = tree_rendering.DEFAULT_FORMAT
+    for arg in sys.argv:
+        if arg.startswith('--render='):
+            output_format = arg.split('=', 1)[1]
+            if output_format not in tree_rendering.RENDER_FORMATS:
+                print(f'Unknown output format <{output_format}>. '
+                      f'Expected one of {", ".join(tree_rendering.RENDER_FORMATS)}.')
+                return
+            print(f'Rendering results as {output_format}.')
+
+    # Bring DB files created by older versions up to the current schema
+    migrate_db.migrate(debug)
 
     # Gather the image and the query from the user
     search_file_location = s3_operations.get_file_from_user()
     queries = user_query()
 
+    if '--multi' in sys.argv:
+        # Group photo: identify every face at once and answer the queries about each identified person
+        identities = multi_face.identify_faces(search_file_location, online=not offline, debug=debug)
+        multi_face.print_identities(identities)
+        for name in dict.fromkeys(identity.name for identity in identities if identity.name is not None):
+            es.run_queries(queries, name, debug, output_format)
+        print('Thank you for using R-IBES. Goodbye!')
+        return
+
     # First attempt to query the local DB, reducing our reliance on AWS
     most_likely_person, search_encoding = local_search(search_file_location, debug)
     normalized_name = ''
@@ -128,12 +174,13 @@ def main():
         # Collect all encodings of the person in the DB
         existing_encodings = lfr.get_person_db_encodings(most_likely_person, debug)
 
-        # Compare the search encoding to each encoding of the person in the DB
+        # Compare the search encoding to each encoding of the person in the DB (at the precision the DB stores them at)
+        stored_search_encoding = gallery.get_gallery(debug).round_trip(search_encoding)
         for existing_encoding in existing_encodings:
             # Compare the search encoding to the existing encoding
             # If the search encoding is a match, we have a duplicate image
             # If the search encoding is not a match, we have a new image of the same person
-            if array_equal(search_encoding, existing_encoding):
+            if array_equal(stored_search_encoding, existing_encoding):
                 # The image the user provided already exists in the DB
                 print('Duplicate image detected in local DB! Continuing without adding to DB.')
                 duplicate_image = True
@@ -197,9 +244,12 @@ def main():
                 print('Successfully added to local DB!')
                 normalized_name = conversions.get_normalized_name(name)
 
-    for query in queries:
-        # Handle multiple queries
-        es.main(query, normalized_name, debug)
+    if '--stream' in sys.argv:
+        # Print each answer as soon as DBpedia returns it
+        es.stream_queries(queries, normalized_name, debug, output_format)
+    else:
+        # Handle multiple queries at once, sharing the hops they have in common
+        es.run_queries(queries, normalized_name, debug, output_format)
 
     print('Thank you for using R-IBES. Goodbye!')
 
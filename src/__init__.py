@@ -1,9 +1,23 @@
+from .ann_index import *
+from .aws_clients import *
 from .aws_rekognition import *
 from .benchmark_local_facial_recognition import *
+from .bulk_ingest import *
 from .clear_db import *
 from .conversions import *
 from .create_db import *
+from .database import *
+from .encoding_precision import *
 from .entity_search import *
+from .gallery import *
+from .image_preprocessing import *
+from .knowledge_store import *
 from .local_facial_recognition import *
+from .migrate_db import *
+from .multi_face import *
+from .rekognition_cache import *
 from .s3_operations import *
+from .sparql_cache import *
+from .sparql_client import *
+from .tree_rendering import *
 from .user_contribution import *
@@ -0,0 +1,199 @@
+"""
+Approximate nearest-neighbour index (inverted file) over the local face gallery.
+A coarse k-means quantizer splits the gallery into lists of encodings; a search only scans the lists whose centroids are
+closest to the searched encoding.
+"""
+
+import os
+
+import numpy as np
+
+from src import conversions
+
+__all__ = ['IVFIndex', 'DEFAULT_N_PROBE', 'DEFAULT_TOP_K']
+
+
+DEFAULT_N_PROBE = 8  # Number of lists scanned per search: higher is slower but finds more true neighbours
+DEFAULT_TOP_K = 10  # Number of candidate people handed to the exact voting
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_SIZE = 65536  # Maximum number of encodings used to train the quantizer
+ASSIGN_CHUNK_SIZE = 65536  # Encodings assigned to lists at once, bounds the size of the distance matrix
+
+
+def _nearest_centroids(encodings, centroids):
+    """
+    Find the closest centroid of every encoding.
+
+    :param encodings: Encodings to assign
+    :type encodings: ndarray(N, 128)
+    :param centroids: Centroids of the lists
+    :type centroids: ndarray(L, 128)
+    :return: Index of the closest centroid of every encoding
+    :rtype: ndarray(N,)
+    """
+    centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+    assignments = np.empty(encodings.shape[0], dtype=np.intp)
+    for start in range(0, encodings.shape[0], ASSIGN_CHUNK_SIZE):
+        chunk = np.asarray(encodings[start:start + ASSIGN_CHUNK_SIZE], dtype=centroids.dtype)
+        # |x - c|^2 = |x|^2 - 2x.c + |c|^2, and |x|^2 does not change which centroid is the closest
+        assignments[start:start + chunk.shape[0]] = np.argmin(centroid_norms - 2 * chunk @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFIndex:
+    """
+    Inverted-file index mapping every gallery row to the list of its closest centroid.
+    Rows are identified by their position in the gallery's encoding matrix.
+    """
+    def __init__(self, centroids, assignments, last_rowid, built_rows, n_probe=DEFAULT_N_PROBE, top_k=DEFAULT_TOP_K,
+                 identity=None):
+        """
+        Create an index from trained centroids and row assignments.
+
+        :param centroids: Centroids of the lists
+        :type centroids: ndarray(L, 128)
+        :param assignments: List of every indexed row
+        :type assignments: ndarray(N,)
+        :param last_rowid: Highest FACE_ENCODING rowid covered by the index
+        :type last_rowid: int
+        :param built_rows: Number of rows the centroids were trained on
+        :type built_rows: int
+        :param n_probe: Number of lists scanned per search
+        :type n_probe: int
+        :param top_k: Number of candidate people returned by a search
+        :type top_k: int
+        :param identity: Identity of the gallery the index was built over (DB, DB state and precision), saved with the
+                         index so it is never reused for another gallery
+        :type identity: str or None
+        """
+        self.centroids = centroids
+        self.last_rowid = last_rowid
+        self.built_rows = built_rows
+        self.n_probe = n_probe
+        self.top_k = top_k
+        self.identity = identity
+        self.dirty = True  # Whether the index changed since it was last saved
+        self.unsaved_rows = 0  # Rows added since the index was last saved
+        self._assignments = np.asarray(assignments, dtype=np.intp)
+        order = np.argsort(self._assignments, kind='stable')
+        boundaries = np.cumsum(np.bincount(self._assignments, minlength=centroids.shape[0]))[:-1]
+        self._lists = np.split(order, boundaries) if centroids.shape[0] > 0 else []
+
+    @classmethod
+    def build(cls, encodings, last_rowid, n_lists=None, seed=0, identity=None):
+        """
+        Train the coarse quantizer with k-means and assign every encoding to a list.
+
+        :param encodings: Encodings of the gallery
+        :type encodings: ndarray(N, 128)
+        :param last_rowid: Highest FACE_ENCODING rowid contained in `encodings`
+        :type last_rowid: int
+        :param n_lists: Number of lists. Default is sqrt(N).
+        :type n_lists: int or None
+        :param seed: Seed of the centroid initialization
+        :type seed: int
+        :param identity: Identity of the gallery `encodings` belong to
+        :type identity: str or None
+        :return: Index over `encodings`
+        :rtype: IVFIndex
+        """
+        n_rows = encodings.shape[0]
+        if n_rows == 0:
+            return cls(np.empty((0,) + conversions.ndarray_shape), np.empty(0, dtype=np.intp), last_rowid, 0,
+                       identity=identity)
+
+        n_lists = min(n_rows, n_lists or max(1, int(np.sqrt(n_rows))))
+        rng = np.random.default_rng(seed)
+        sample = encodings
+        if n_rows > KMEANS_SAMPLE_SIZE:
+            sample = encodings[np.sort(rng.choice(n_rows, KMEANS_SAMPLE_SIZE, replace=False))]
+        sample = np.asarray(sample, dtype=np.float64)
+        centroids = sample[rng.choice(sample.shape[0], n_lists, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            sample_assignments = _nearest_centroids(sample, centroids)
+            counts = np.bincount(sample_assignments, minlength=n_lists)
+            order = np.argsort(sample_assignments, kind='stable')
+            non_empty = counts > 0
+            # Sum the members of every non-empty list; empty lists keep their previous centroid
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[non_empty]
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids[non_empty] = sums / counts[non_empty, None]
+
+        return cls(centroids, _nearest_centroids(encodings, centroids), last_rowid, n_rows, identity=identity)
+
+    def __len__(self):
+        return self._assignments.shape[0]
+
+    def add(self, encodings, last_rowid):
+        """
+        Assign encodings appended to the gallery to their lists. The centroids are not retrained.
+
+        :param encodings: Encodings appended to the gallery, in gallery order
+        :type encodings: ndarray(M, 128)
+        :param last_rowid: Highest FACE_ENCODING rowid contained in `encodings`
+        :type last_rowid: int
+        """
+        if encodings.shape[0] == 0 or self.centroids.shape[0] == 0:
+            return
+        assignments = _nearest_centroids(encodings, self.centroids)
+        rows = np.arange(len(self), len(self) + encodings.shape[0])
+        for list_id in np.unique(assignments):
+            self._lists[list_id] = np.concatenate((self._lists[list_id], rows[assignments == list_id]))
+        self._assignments = np.concatenate((self._assignments, assignments))
+        self.last_rowid = max(self.last_rowid, last_rowid)
+        self.dirty = True
+        self.unsaved_rows += encodings.shape[0]
+
+    def search(self, encoding):
+        """
+        Get the rows stored in the `n_probe` lists closest to an encoding.
+
+        :param encoding: Encoding to search for
+        :type encoding: ndarray(128,)
+        :return: Gallery rows that are candidate neighbours of `encoding`
+        :rtype: ndarray(R,)
+        """
+        if self.centroids.shape[0] == 0:
+            return np.empty(0, dtype=np.intp)
+        distances = np.linalg.norm(self.centroids - encoding, axis=1)
+        n_probe = min(self.n_probe, distances.shape[0])
+        probed = np.argpartition(distances, n_probe - 1)[:n_probe]
+        return np.concatenate([self._lists[list_id] for list_id in probed])
+
+    def save(self, file_path):
+        """
+        Save the index. The file is replaced atomically.
+
+        :param file_path: Path of the .npz file to write
+        :type file_path: str
+        """
+        with open(f'{file_path}.tmp', 'wb') as index_file:
+            np.savez(index_file, centroids=self.centroids, assignments=self._assignments,
+                     last_rowid=self.last_rowid, built_rows=self.built_rows, identity=self.identity or '')
+        os.replace(f'{file_path}.tmp', file_path)
+        self.dirty = False
+        self.unsaved_rows = 0
+
+    @classmethod
+    def load(cls, file_path, n_probe=DEFAULT_N_PROBE, top_k=DEFAULT_TOP_K):
+        """
+        Load an index saved by `save`.
+
+        :param file_path: Path of the .npz file
+        :type file_path: str
+        :param n_probe: Number of lists scanned per search
+        :type n_probe: int
+        :param top_k: Number of candidate people returned by a search
+        :type top_k: int
+        :return: Loaded index or None if the file does not exist
+        :rtype: IVFIndex or None
+        """
+        if not os.path.exists(file_path):
+            return None
+        with np.load(file_path) as index_file:
+            # Indexes saved before identities were recorded have none and are never reused
+            identity = str(index_file['identity']) if 'identity' in index_file.files else ''
+            index = cls(index_file['centroids'], index_file['assignments'], int(index_file['last_rowid']),
+                        int(index_file['built_rows']), n_probe, top_k, identity or None)
+        index.dirty = False
+        return index
@@ -0,0 +1,101 @@
+"""
+Process-wide AWS clients. The .env file is parsed once and a client is created once per service and region, so
+successive S3 and Rekognition calls reuse the same connection pools. boto3 clients are safe to share between threads.
+"""
+
+import threading
+
+import boto3
+from botocore.config import Config
+from dotenv import dotenv_values
+
+__all__ = ['get_env_vars', 'get_client', 'configure_clients', 'clear_clients', 'REKOGNITION_REGION']
+
+
+REKOGNITION_REGION = 'us-east-2'
+MAX_POOL_CONNECTIONS = 10  # Connections kept open per client, also the concurrency of S3 transfers
+MAX_ATTEMPTS = 3  # Retries of a call failing with a transient error, not counting the first attempt
+RETRY_MODE = 'standard'  # botocore retry mode: 'legacy', 'standard' or 'adaptive'
+CONNECT_TIMEOUT = 5  # Seconds to open a connection
+READ_TIMEOUT = 60  # Seconds to wait for a response
+
+_options = {'max_pool_connections': MAX_POOL_CONNECTIONS, 'max_attempts': MAX_ATTEMPTS, 'retry_mode': RETRY_MODE,
+            'connect_timeout': CONNECT_TIMEOUT, 'read_timeout': READ_TIMEOUT}
+_env_vars = None  # (access key, secret key, bucket name) parsed from .env by get_env_vars()
+_session = None  # Session creating the clients, boto3 sessions are not safe to share between threads
+_clients = {}  # Clients by (service, region)
+_lock = threading.Lock()
+
+
+def get_env_vars():
+    """
+    Get the environment variables for the AWS S3 bucket, parsing the .env file on first use.
+
+    :return: S3 access key, S3 secret key, and S3 bucket name
+    :rtype: str, str, str
+    """
+    global _env_vars
+    with _lock:
+        if _env_vars is None:
+            config = dotenv_values(".env")
+            _env_vars = config['S3_ACCESS_KEY'], config['S3_SECRET_KEY'], config['S3_BUCKET']
+        return _env_vars
+
+
+def get_client(service, region=None):
+    """
+    Get the process-wide client of an AWS service, creating it on first use.
+
+    :param service: Name of the AWS service, e.g. 's3' or 'rekognition'
+    :type service: str
+    :param region: AWS region of the client. Default is the region of the AWS configuration.
+    :type region: str or None
+    :return: Client of the service
+    :rtype: botocore.client.BaseClient
+    """
+    access_key, secret_key, _ = get_env_vars()
+    global _session
+    with _lock:
+        client = _clients.get((service, region))
+        if client is None:
+            if _session is None:
+                _session = boto3.session.Session()
+            config = Config(max_pool_connections=_options['max_pool_connections'],
+                            retries={'max_attempts': _options['max_attempts'], 'mode': _options['retry_mode']},
+                            connect_timeout=_options['connect_timeout'], read_timeout=_options['read_timeout'])
+            client = _session.client(service, aws_access_key_id=access_key, aws_secret_access_key=secret_key,
+                                     region_name=region, config=config)
+            _clients[(service, region)] = client
+        return client
+
+
+def configure_clients(max_pool_connections=MAX_POOL_CONNECTIONS, max_attempts=MAX_ATTEMPTS, retry_mode=RETRY_MODE,
+                      connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+    """
+    Configure the AWS clients. Clients created before are replaced on their next use.
+
+    :param max_pool_connections: Connections kept open per client
+    :type max_pool_connections: int
+    :param max_attempts: Retries of a call failing with a transient error, not counting the first attempt
+    :type max_attempts: int
+    :param retry_mode: botocore retry mode: 'legacy', 'standard' or 'adaptive'
+    :type retry_mode: str
+    :param connect_timeout: Seconds to open a connection
+    :type connect_timeout: float
+    :param read_timeout: Seconds to wait for a response
+    :type read_timeout: float
+    """
+    with _lock:
+        _options.update(max_pool_connections=max_pool_connections, max_attempts=max_attempts, retry_mode=retry_mode,
+                        connect_timeout=connect_timeout, read_timeout=read_timeout)
+        _clients.clear()
+
+
+def clear_clients():
+    """
+    Forget the parsed .env file and every client, e.g. after the AWS keys changed.
+    """
+    global _env_vars
+    with _lock:
+        _env_vars = None
+        _clients.clear()
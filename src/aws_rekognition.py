@@ -2,17 +2,110 @@
 Module to handle AWS Rekognition API calls for facial recognition.
 """
 
+import io
 from collections import namedtuple
 
-import boto3
 from botocore.exceptions import NoCredentialsError
+import numpy
+from PIL import Image
 
+from src import aws_clients
+from src import image_preprocessing
+from src import rekognition_cache
 from src import s3_operations
 
 AWSPersonTup = namedtuple('AWSPersonTup', ['name', 'match_confidence'])
+# Celebrity recognized in a group photo, bounding_box is Rekognition's {'Width', 'Height', 'Left', 'Top'} ratios
+AWSFaceTup = namedtuple('AWSFaceTup', ['name', 'match_confidence', 'bounding_box'])
 
+MAX_IMAGE_BYTES = 5 * 1024 * 1024  # Largest image Rekognition accepts inline
+MAX_IMAGE_DIMENSION = 1920  # Longest side of the images sent inline, in pixels
+JPEG_QUALITY = 90
+FALLBACK_JPEG_QUALITIES = (75, 60)  # Qualities tried in turn when an encoded image is too large, before downscaling
 
-def detect_labels(file_name, debug=False):
+
+def decode_image(file_path, max_dimension=MAX_IMAGE_DIMENSION):
+    """
+    Decode an image once, directly at the size it is sent to Rekognition at, so the same pixels can be hashed for the
+    Rekognition cache (rekognition_cache.hash_pixels) and encoded (encode_pixels).
+
+    :param file_path: Path to the image
+    :type file_path: str
+    :param max_dimension: Longest side of the decoded image, in pixels
+    :type max_dimension: int
+    :return: Grayscale pre-processed image
+    :rtype: image_preprocessing.PreprocessedImage
+    """
+    return image_preprocessing.load_image(file_path, max_dimension=max_dimension, grayscale=True)
+
+
+def encode_image(file_path, max_dimension=MAX_IMAGE_DIMENSION, quality=JPEG_QUALITY, max_bytes=MAX_IMAGE_BYTES):
+    """
+    Downscale an image so its longest side is at most `max_dimension` pixels and re-encode it as a grayscale JPEG, to
+    send it inline to Rekognition (see encode_pixels).
+
+    :param file_path: Path to the image
+    :type file_path: str
+    :param max_dimension: Longest side of the encoded image, in pixels
+    :type max_dimension: int
+    :param quality: JPEG quality of the encoded image
+    :type quality: int
+    :param max_bytes: Largest size of the encoded image
+    :type max_bytes: int
+    :return: JPEG bytes of the image, at most `max_bytes` long
+    :rtype: bytes
+    """
+    return encode_pixels(decode_image(file_path, max_dimension).array, quality, max_bytes)
+
+
+def encode_pixels(pixels, quality=JPEG_QUALITY, max_bytes=MAX_IMAGE_BYTES):
+    """
+    Encode the grayscale pixels of an already decoded image as a JPEG, to send it inline to Rekognition. An image
+    larger than `max_bytes` is encoded again at the lower FALLBACK_JPEG_QUALITIES, then at half the size, until it fits.
+
+    :param pixels: Grayscale pixels, as a (height, width) array or the (height, width, 3) array of decode_image
+    :type pixels: ndarray
+    :param quality: JPEG quality of the encoded image
+    :type quality: int
+    :param max_bytes: Largest size of the encoded image
+    :type max_bytes: int
+    :return: JPEG bytes of the image, at most `max_bytes` long
+    :rtype: bytes
+    """
+    if pixels.ndim == 3:
+        pixels = pixels[:, :, 0]  # The three channels of a grayscale image are identical
+    img = Image.fromarray(numpy.ascontiguousarray(pixels, dtype=numpy.uint8))
+    qualities = [quality] + [fallback for fallback in FALLBACK_JPEG_QUALITIES if fallback < quality]
+    while True:
+        for attempt_quality in qualities:
+            buffer = io.BytesIO()
+            img.save(buffer, format='JPEG', quality=attempt_quality)
+            if buffer.tell() <= max_bytes or max(img.size) == 1:
+                return buffer.getvalue()
+        img = img.reduce(2)
+
+
+def get_cached_detection(image_hash, debug=False):
+    """
+    Get the result of a previous Rekognition lookup of the same image.
+
+    :param image_hash: Hash of the image from rekognition_cache.hash_pixels
+    :type image_hash: str
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Cached tuple containing (Person's name, Match confidence), False if Rekognition did not recognize the
+             image, or None if the image was not looked up recently
+    :rtype: AWSPersonTup or bool or None
+    """
+    cached = rekognition_cache.get_cached_result(image_hash)
+    if debug and cached is not None:
+        print(f'Using the cached Rekognition result of image {image_hash[:12]}.')
+    if not cached:
+        return cached
+    return AWSPersonTup(*cached)
+
+
+def detect_labels(file_name, debug=False, image_hash=None):
     """
     Method to take a file stored in S3 bucket `BUCKET_NAME` and send it through AWS Rekognition,
     returning facial recognition data from its celebrity database.
@@ -21,30 +114,108 @@ def detect_labels(file_name, debug=False):
     :type file_name: str
     :param debug: Enable debug mode
     :type debug: bool
+    :param image_hash: Hash of the image to cache the result under (see rekognition_cache.hash_pixels)
+    :type image_hash: str or None
     :return: Tuple containing (Person's name, Match confidence, Facial feature mapping data)
              or False if an error occurred
     :rtype: AWSPersonTup or bool
     """
-    access_key, secret_key, bucket_name = s3_operations.get_env_vars()
-    client = boto3.client('rekognition', aws_access_key_id=access_key, aws_secret_access_key=secret_key,
-                          region_name='us-east-2')
+    _, _, bucket_name = s3_operations.get_env_vars()
+    return _recognize_celebrity({'S3Object': {'Bucket': bucket_name, 'Name': file_name}},
+                                f'"{file_name}" in S3 bucket "{bucket_name}"', image_hash, debug)
+
+
+def detect_labels_from_bytes(image_bytes, debug=False, image_hash=None):
+    """
+    Send an image directly to AWS Rekognition, without storing it in S3 first,
+    returning facial recognition data from its celebrity database.
+
+    :param image_bytes: JPEG or PNG bytes of the image, at most MAX_IMAGE_BYTES (see encode_image)
+    :type image_bytes: bytes
+    :param debug: Enable debug mode
+    :type debug: bool
+    :param image_hash: Hash of the image to cache the result under (see rekognition_cache.hash_pixels)
+    :type image_hash: str or None
+    :return: Tuple containing (Person's name, Match confidence) or False if an error occurred
+    :rtype: AWSPersonTup or bool
+    """
+    return _recognize_celebrity({'Bytes': image_bytes}, f'image of {len(image_bytes)} bytes', image_hash, debug)
+
+
+def detect_celebrities_from_bytes(image_bytes, debug=False):
+    """
+    Send an image directly to AWS Rekognition and return every celebrity recognized in it, e.g. in a group photo.
+
+    :param image_bytes: JPEG or PNG bytes of the image, at most MAX_IMAGE_BYTES (see encode_image)
+    :type image_bytes: bytes
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Name, match confidence and bounding box of every recognized celebrity, or False if an error occurred
+    :rtype: list(AWSFaceTup) or bool
+    """
+    response = _call_recognize_celebrities({'Bytes': image_bytes}, f'image of {len(image_bytes)} bytes', debug)
+    if response is None:
+        return False
+    faces = [AWSFaceTup(face['Name'], face['MatchConfidence'], face['Face']['BoundingBox'])
+             for face in response['CelebrityFaces']
+             if 'Name' in face and 'MatchConfidence' in face and 'BoundingBox' in face.get('Face', {})]
+    if debug:
+        for face in faces:
+            print(face.name, face.match_confidence)
+    return faces
+
+
+def _call_recognize_celebrities(image, description, debug=False):
+    """
+    Call AWS Rekognition's celebrity recognition.
+
+    :param image: Image parameter of recognize_celebrities, either S3Object or Bytes
+    :type image: dict
+    :param description: Description of the image for error messages
+    :type description: str
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Response of recognize_celebrities or None if an error occurred
+    :rtype: dict or None
+    """
+    client = aws_clients.get_client('rekognition', aws_clients.REKOGNITION_REGION)
 
     try:
-        response = client.recognize_celebrities(Image={'S3Object': {'Bucket': bucket_name, 'Name': file_name}})
+        return client.recognize_celebrities(Image=image)
     except FileNotFoundError:
         if debug:
-            print(f"The requested file \"{file_name}\" was not found in S3 bucket \"{bucket_name}\". "
+            print(f"The requested image {description} was not found. "
                   f"Unable to perform facial recognition procedure!")
-        return False
+        return None
     except NoCredentialsError:
         if debug:
             print("Unable to authenticate this session with AWS S3."
                   "Unable to perform facial recognition procedure!")
-        return False
+        return None
     except Exception as unknown_exception:
         if debug:
             print(f"Unknown exception occurred while attempting to perform facial recognition procedure : "
                   f"{unknown_exception}")
+        return None
+
+
+def _recognize_celebrity(image, description, image_hash=None, debug=False):
+    """
+    Send an image through AWS Rekognition's celebrity recognition.
+
+    :param image: Image parameter of recognize_celebrities, either S3Object or Bytes
+    :type image: dict
+    :param description: Description of the image for error messages
+    :type description: str
+    :param image_hash: Hash of the image to cache the result under, None to skip the cache
+    :type image_hash: str or None
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Tuple containing (Person's name, Match confidence) or False if an error occurred
+    :rtype: AWSPersonTup or bool
+    """
+    response = _call_recognize_celebrities(image, description, debug)
+    if response is None:
         return False
 
     if len(response['CelebrityFaces']) > 0:
@@ -55,6 +226,10 @@ def detect_labels(file_name, debug=False):
             tup = AWSPersonTup(name, match_confidence)
             if debug:
                 print(tup.name, tup.match_confidence)
+            if image_hash is not None:
+                rekognition_cache.store_result(image_hash, tup.name, tup.match_confidence)
             return tup
     # AWS Rekognize was unable to match the image to a known celebrity
+    if image_hash is not None:
+        rekognition_cache.store_result(image_hash)
     return False
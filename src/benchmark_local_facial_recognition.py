@@ -2,18 +2,25 @@
 R-IBES facial recognition benchmarking script
 """
 
-import sqlite3
+import sys
 import time
 import statistics
 from collections import namedtuple
 from alive_progress import alive_bar
+import numpy as np
 
 from src import local_facial_recognition as lfr
 from src import conversions
+from src import database
+from src import encoding_precision
+from src.gallery import EncodingGallery
 
 BenchmarkResult = namedtuple('BenchmarkResult',
                              ['match_count', 'fail_count', 'success_rate', 'compare_time'])
 
+BASELINE_RESULTS_PATH = './benchmarks/local_facial_recognition_benchmark_results.tsv'
+BENCHMARK_BATCH_SIZE = 1024  # Encodings identified per batched call
+
 
 def get_encodings():
     """
@@ -22,26 +29,92 @@ def get_encodings():
     :return: All encodings from the database in form {name: [encoding1, encoding2, ...]}
     :rtype: dict{str, list(ndarray(128,))}
     """
-    conn = sqlite3.connect('./hw2.db')
-    cursor = conn.cursor()
-    if conn:
-        # Get all encodings from the database
-        query = "SELECT NAME, ENCODING FROM NAME_ENCODING"
-        cursor.execute(query)
-        conn.commit()
-        rows = cursor.fetchall()
-        conn.close()
-
-        encodings = {}
-        for row in rows:
-            this_name = row[0]
-            this_encoding = conversions.decode_memoryview_to_ndarray(row[1])
-            if this_name in encodings:
-                encodings[this_name].append(this_encoding)
-            else:
-                encodings[this_name] = [this_encoding]
-        return encodings
-    return None
+    conn = database.get_connection()
+    # Get all encodings from the database
+    rows = conn.execute("SELECT NAME, ENCODING FROM FACE_ENCODING JOIN PERSON USING (PERSON_ID)").fetchall()
+    _, scale = encoding_precision.get_encoding_precision(conn)
+
+    encodings = {}
+    for row in rows:
+        this_name = row[0]
+        this_encoding = conversions.decode_memoryview_to_ndarray(row[1], scale=scale)
+        if this_name in encodings:
+            encodings[this_name].append(this_encoding)
+        else:
+            encodings[this_name] = [this_encoding]
+    return encodings
+
+
+def get_precision_gallery(precision):
+    """
+    Build a gallery of all encodings in the database converted to another precision. The database is not modified.
+
+    :param precision: Precision to convert the encodings to, one of conversions.ENCODING_PRECISIONS
+    :type precision: str
+    :return: Gallery holding the converted encodings
+    :rtype: EncodingGallery
+    """
+    conn = database.get_connection()
+    rows = conn.execute("SELECT ENCODING_ID, NAME, ENCODING FROM FACE_ENCODING JOIN PERSON USING (PERSON_ID) "
+                        "ORDER BY ENCODING_ID").fetchall()
+    _, db_scale = encoding_precision.get_encoding_precision(conn)
+
+    decoded = np.array([conversions.decode_memoryview_to_ndarray(row[2], scale=db_scale) for row in rows],
+                       dtype=np.float64).reshape((-1,) + conversions.ndarray_shape)
+    scale = conversions.compute_quantization_scale(decoded) if precision == 'int8' else None
+    converted_rows = [(row[0], row[1], conversions.encode_ndarray_to_memoryview(encoding, precision, scale))
+                      for row, encoding in zip(rows, decoded)]
+    return EncodingGallery(converted_rows, precision, scale)
+
+
+def read_benchmark_results(file_path=BASELINE_RESULTS_PATH):
+    """
+    Read the per-person success rates of a benchmark results file.
+
+    :param file_path: Path of a TSV file written by benchmark()
+    :type file_path: str
+    :return: Success rate of every person in the file
+    :rtype: dict{str, float}
+    """
+    success_rates = {}
+    with open(file_path, 'r') as infile:
+        next(infile)  # Header
+        for line in infile:
+            if line.startswith('-'):
+                # End of the per-person rows, general statistics follow
+                break
+            name, _, _, success_rate, _ = line.rstrip('\n').split('\t', 4)
+            success_rates[name] = float(success_rate)
+    return success_rates
+
+
+def report_accuracy_change(all_results, baseline_path=BASELINE_RESULTS_PATH):
+    """
+    Report how the success rates of a benchmark run differ from a baseline benchmark run.
+
+    :param all_results: Results of the benchmark run, {name: BenchmarkResult}
+    :type all_results: dict{str, BenchmarkResult}
+    :param baseline_path: Path of the baseline results file
+    :type baseline_path: str
+    """
+    baseline = read_benchmark_results(baseline_path)
+    common_names = [name for name in all_results if name in baseline]
+    if len(common_names) == 0:
+        print(f'No people in common with the baseline "{baseline_path}".')
+        return
+
+    improved = [name for name in common_names if all_results[name].success_rate > baseline[name]]
+    regressed = [name for name in common_names if all_results[name].success_rate < baseline[name]]
+    baseline_average = sum(baseline[name] for name in common_names) / len(common_names)
+    average = sum(all_results[name].success_rate for name in common_names) / len(common_names)
+
+    print(f'Compared {len(common_names)} people against the baseline "{baseline_path}".')
+    print(f'Average success rate: {baseline_average*100:.3f}% (baseline) -> {average*100:.3f}% '
+          f'({(average - baseline_average)*100:+.3f}%)')
+    print(f'People with a higher success rate: {len(improved)}')
+    print(f'People with a lower success rate: {len(regressed)}')
+    for name in regressed:
+        print(f'\t{name}: {baseline[name]*100:.1f}% -> {all_results[name].success_rate*100:.1f}%')
 
 
 def stats(success_rates, avg_times, num_zero_success_rates, number_of_people, avg_non_zero_success_rates):
@@ -70,13 +143,24 @@ def stats(success_rates, avg_times, num_zero_success_rates, number_of_people, av
     return average_success_rate, average_time, percent_zero_success_rates, average_non_zero_success_rate
 
 
-def benchmark():
+def benchmark(precision=None):
     """
     Benchmark the local facial recognition system.
+
+    :param precision: If provided, match against the database's encodings converted to this precision (one of
+                      conversions.ENCODING_PRECISIONS) and report the accuracy change against the baseline results
+                      instead of overwriting them.
+    :type precision: str or None
     """
     # For person in the database, attempt to match that encoding to the correct person
     # Measure the time it takes to match each encoding and the success rate
     encodings = get_encodings()
+    if precision is None:
+        identify_many = lfr.identify_people_from_encodings
+        results_path = BASELINE_RESULTS_PATH
+    else:
+        identify_many = get_precision_gallery(precision).identify_many
+        results_path = f'./benchmarks/local_facial_recognition_benchmark_results_{precision}.tsv'
     all_results = {}  # Name : CompareResult
 
     avg_times = []
@@ -85,46 +169,49 @@ def benchmark():
     number_of_people = len(encodings)
     avg_non_zero_success_rates = []
 
+    # Identify every encoding of the database in batches; each encoding is charged an equal share of its batch's time.
+    # These amortized times are not per-image lookup times and are written under their own column.
+    all_encodings = [encoding for name in encodings for encoding in encodings[name]]
+    determined_people = []
+    compare_times = []
     all_start = time.time()
-    current_num = 1
-    # total number of elements from all encodings
-    with alive_bar(len(encodings), force_tty=True) as bar:  # Progress bar, force_tty=True for PyCharm
-        for name in encodings:
-            match_count = 0
-            fail_count = 0
-            person_encodings = encodings[name]
-            times = []
-            for encoding in person_encodings:
-                # For each encoding, compare it to every other encoding in the database
-                start_time = time.time()
-                determined_person = lfr.identify_person_from_encoding(encoding)
-                if determined_person == name:
-                    match_count += 1
-                else:
-                    fail_count += 1
-                comparison_time = time.time() - start_time
-                times.append(comparison_time)
-            avg_times.append(sum(times) / len(times))  # Average time to compare all encodings for this person
-            success_rate = match_count / (match_count + fail_count)
-            success_rates.append(success_rate)
-            if success_rate == 0:
-                num_zero_success_rates += 1
-            else:
-                avg_non_zero_success_rates.append(success_rate)
-
-
-            all_results[name] = BenchmarkResult(match_count, fail_count, success_rate, times)
-            current_num += 1
-            bar()  # Update progress bar
+    with alive_bar(len(all_encodings), force_tty=True) as bar:  # Progress bar, force_tty=True for PyCharm
+        for start in range(0, len(all_encodings), BENCHMARK_BATCH_SIZE):
+            batch = np.array(all_encodings[start:start + BENCHMARK_BATCH_SIZE])
+            start_time = time.time()
+            batch_people, _ = identify_many(batch)
+            comparison_time = (time.time() - start_time) / len(batch)
+            determined_people.extend(batch_people)
+            compare_times.extend([comparison_time] * len(batch))
+            bar(len(batch))  # Update progress bar
     total_time = time.time() - all_start
 
+    position = 0
+    for name in encodings:
+        count = len(encodings[name])
+        person_people = determined_people[position:position + count]
+        times = compare_times[position:position + count]
+        position += count
+
+        match_count = sum(determined_person == name for determined_person in person_people)
+        fail_count = count - match_count
+        avg_times.append(sum(times) / len(times))  # Average time to compare all encodings for this person
+        success_rate = match_count / (match_count + fail_count)
+        success_rates.append(success_rate)
+        if success_rate == 0:
+            num_zero_success_rates += 1
+        else:
+            avg_non_zero_success_rates.append(success_rate)
+
+        all_results[name] = BenchmarkResult(match_count, fail_count, success_rate, times)
+
     average_success_rate, average_time, percent_zero_success_rates, average_non_zero_success_rate = (
         stats(success_rates, avg_times, num_zero_success_rates,
               number_of_people, avg_non_zero_success_rates))
 
 
-    with open('./benchmarks/local_facial_recognition_benchmark_results.tsv', 'w') as outfile:
-        outfile.write('Name\tMatch_Count\tFail_Count\tSuccess_Rate\tCompare_Times\n')  # Header
+    with open(results_path, 'w') as outfile:
+        outfile.write('Name\tMatch_Count\tFail_Count\tSuccess_Rate\tAmortized_Compare_Times\n')  # Header
         for name, result in all_results.items():
             outfile.write(f'{name}\t{result.match_count}\t{result.fail_count}\t{result.success_rate}\t'
                           f'{result.compare_time}\n')  # Data / rows
@@ -141,7 +228,8 @@ def benchmark():
         outfile.write(f'\tStandard deviation: '
                       f'{statistics.stdev(avg_non_zero_success_rates, xbar=percent_zero_success_rates)*100:.3f}%')
 
-        outfile.write(f'Average time per image search: {average_time:.3f} seconds')
+        outfile.write(f'Average amortized time per image search (batches of {BENCHMARK_BATCH_SIZE}): '
+                      f'{average_time:.6f} seconds')
         outfile.write(f'\tStandard deviation: {statistics.stdev(avg_times, xbar=average_time):.3f}')
         outfile.write(f'Total time to compare all encodings: {total_time:.0f} seconds')
 
@@ -154,10 +242,14 @@ def benchmark():
     print(f'\tStandard deviation: '
           f'{statistics.stdev(avg_non_zero_success_rates, xbar=percent_zero_success_rates)*100:.3f}%')
 
-    print(f'Average time per image search: {average_time:.3f} seconds')
+    print(f'Average amortized time per image search (batches of {BENCHMARK_BATCH_SIZE}): {average_time:.6f} seconds')
     print(f'\tStandard deviation: {statistics.stdev(avg_times, xbar=average_time):.3f}')
     print(f'Total time to compare all encodings: {total_time:.0f} seconds')
 
+    if precision is not None:
+        report_accuracy_change(all_results)
+
 
 if __name__ == '__main__':
-    benchmark()
+    # `python3 -m src.benchmark_local_facial_recognition [float64|float32|float16|int8]`
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else None)
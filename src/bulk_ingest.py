@@ -0,0 +1,164 @@
+"""
+Bulk ingestion of a directory of labeled face images into the local facial recognition database.
+The directory must be laid out as `<Person_Name>/<image>.jpg` (the layout of Labeled Faces in the Wild).
+Face detection and encoding run in a pool of worker processes while a single writer batch-inserts the results.
+Every processed file is logged in the DB, so an interrupted ingestion resumes where it stopped when run again:
+`python3 -m src.bulk_ingest <directory> [source] [workers]`
+"""
+
+import os
+import sys
+from collections import Counter
+from multiprocessing import Pool
+from shutil import copyfile
+
+from alive_progress import alive_bar
+
+from src import conversions
+from src import database
+from src import encoding_precision
+from src import local_facial_recognition as lfr
+
+__all__ = ['find_images', 'ingest_directory']
+
+
+IMAGE_FORMATS = ('.jpg', '.jpeg', '.png')
+WRITE_BATCH_SIZE = 256  # Encodings inserted per transaction
+
+
+def find_images(directory):
+    """
+    Find every image of a `<Person_Name>/<image>` directory tree.
+
+    :param directory: Root of the directory tree
+    :type directory: str
+    :return: (person name, absolute image path) pairs sorted by person and file name
+    :rtype: list(tuple(str, str))
+    """
+    images = []
+    for person_name in sorted(os.listdir(directory)):
+        person_directory = os.path.join(directory, person_name)
+        if not os.path.isdir(person_directory):
+            continue
+        for file_name in sorted(os.listdir(person_directory)):
+            if file_name.lower().endswith(IMAGE_FORMATS):
+                images.append((person_name, os.path.abspath(os.path.join(person_directory, file_name))))
+    return images
+
+
+def _encode_image(image):
+    """
+    Generate the face encoding of an image. Runs in a worker process.
+
+    :param image: (person name, image path) pair
+    :type image: tuple(str, str)
+    :return: Person name, image path and the encoding of the first face (None if no face was found)
+    :rtype: tuple(str, str, ndarray(128,) or None)
+    """
+    person_name, file_location = image
+    try:
+        _, encodings = lfr.locate_and_encode_faces(file_location, grayscale=False)
+    except (OSError, ValueError):
+        # Unreadable or corrupted image
+        return person_name, file_location, None
+    if len(encodings) == 0:
+        return person_name, file_location, None
+    return person_name, file_location, encodings[0]
+
+
+def _get_ingested_files(conn):
+    """
+    Get every file already processed by a previous ingestion.
+
+    :param conn: Open connection to the DB
+    :type conn: sqlite3.Connection
+    :return: Absolute paths of the processed files
+    :rtype: set(str)
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS INGEST_LOG (FILE_PATH TEXT PRIMARY KEY, ENCODED INT NOT NULL)")
+    return {row[0] for row in conn.execute("SELECT FILE_PATH FROM INGEST_LOG")}
+
+
+def _write_batch(conn, results, source):
+    """
+    Copy the images of a batch of results into `./images/<name>` and insert their encodings in a single transaction.
+
+    :param conn: Open connection to the DB
+    :type conn: sqlite3.Connection
+    :param results: (person name, image path, encoding or None) tuples returned by the workers
+    :type results: list(tuple(str, str, ndarray(128,) or None))
+    :param source: Source of the images (e.g. 'lfw')
+    :type source: str
+    :return: Number of inserted encodings
+    :rtype: int
+    """
+    precision, scale = encoding_precision.get_encoding_precision(conn)
+    encoding_rows = []
+    new_encoding_counts = Counter()
+    with database.transaction():
+        for person_name, file_location, encoding in results:
+            if encoding is None:
+                continue
+            normalized_name = conversions.get_normalized_name(person_name)
+            person_id = lfr.get_or_add_person_id(conn, normalized_name)
+
+            file_name, _ = lfr.generate_file_name_strenc(file_location, encoding)
+            copyfile(file_location, f'./images/{normalized_name}/{file_name}')
+            encoding = conversions.encode_ndarray_to_memoryview(encoding, precision, scale).tobytes()
+            encoding_rows.append((person_id, encoding, file_name, source))
+            new_encoding_counts[person_id] += 1
+
+        conn.executemany("INSERT INTO FACE_ENCODING (PERSON_ID, ENCODING, FILE_NAME, SOURCE) VALUES (?, ?, ?, ?)",
+                         encoding_rows)
+        conn.executemany("UPDATE PERSON SET ENCODING_COUNT = ENCODING_COUNT + ? WHERE PERSON_ID = ?",
+                         [(count, person_id) for person_id, count in new_encoding_counts.items()])
+        # Files without a face are logged too so a resumed ingestion does not try them again
+        conn.executemany("INSERT OR REPLACE INTO INGEST_LOG (FILE_PATH, ENCODED) VALUES (?, ?)",
+                         [(file_location, int(encoding is not None)) for _, file_location, encoding in results])
+    return len(encoding_rows)
+
+
+def ingest_directory(directory, source='lfw', workers=None, debug=False):
+    """
+    Encode every image of a `<Person_Name>/<image>` directory tree and add it to the local DB.
+    Files processed by a previous (possibly interrupted) run are skipped.
+
+    :param directory: Root of the directory tree
+    :type directory: str
+    :param source: Source of the images. Default is 'lfw' (Labeled Faces in the Wild).
+    :type source: str
+    :param workers: Number of worker processes. Default is the number of CPUs.
+    :type workers: int or None
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Number of inserted encodings
+    :rtype: int
+    """
+    conn = database.get_connection()
+    ingested_files = _get_ingested_files(conn)
+    images = [image for image in find_images(directory) if image[1] not in ingested_files]
+    if debug:
+        print(f'Skipping {len(ingested_files)} files ingested by a previous run.')
+
+    inserted = 0
+    batch = []
+    with Pool(processes=workers) as pool, alive_bar(len(images), force_tty=True) as bar:
+        for result in pool.imap_unordered(_encode_image, images, chunksize=8):
+            batch.append(result)
+            if len(batch) >= WRITE_BATCH_SIZE:
+                inserted += _write_batch(conn, batch, source)
+                batch = []
+            bar()  # Update progress bar
+        if batch:
+            inserted += _write_batch(conn, batch, source)
+
+    print(f'Added {inserted} encodings from {len(images)} images in "{directory}".')
+    return inserted
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python3 -m src.bulk_ingest <directory> [source] [workers]')
+        sys.exit(1)
+    ingest_directory(sys.argv[1], source=sys.argv[2] if len(sys.argv) > 2 else 'lfw',
+                     workers=int(sys.argv[3]) if len(sys.argv) > 3 else None, debug=True)
@@ -2,10 +2,13 @@
 Running this file clears the database of all images, encodings, and names.
 """
 
+import os
 import shutil
-import sqlite3
 import time
 
+from src import database
+from src import gallery
+
 
 def main(proceed=False):
     """
@@ -24,16 +27,15 @@ def main(proceed=False):
         time.sleep(1)
 
     shutil.rmtree('./images', True)
-    conn = sqlite3.connect('./hw2.db')
-    if conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM NAME_DIRECTORY")
-        cursor.execute("DELETE FROM NAME_ENCODING")
-        conn.commit()
-        conn.close()
-        print('Database cleared successfully.')
-    else:
-        print('Failed to connect to database.')
+    with database.transaction() as conn:
+        conn.execute("DELETE FROM FACE_ENCODING")
+        conn.execute("DELETE FROM PERSON")
+        conn.execute("DROP TABLE IF EXISTS INGEST_LOG")  # Images must be ingested again after the DB was cleared
+    gallery.invalidate_gallery()
+    gallery.delete_gallery_file()
+    if os.path.exists(gallery.get_ann_index_path()):
+        os.remove(gallery.get_ann_index_path())
+    print('Database cleared successfully.')
 
 
 if __name__ == '__main__':
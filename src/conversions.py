@@ -2,34 +2,144 @@
 File providing conversion methods for the R-IBES system.
 """
 
-from numpy import frombuffer, float64
+import warnings
+
+from numpy import frombuffer, asarray, rint, abs as np_abs, count_nonzero, float64, float32, float16, int8
 
 ndarray_shape = (128,)
+# Supported storage precisions of facial encodings and their on-disk dtypes
+ENCODING_PRECISIONS = {'float64': float64, 'float32': float32, 'float16': float16, 'int8': int8}
+_ITEM_SIZE_DTYPES = {8: float64, 4: float32, 2: float16, 1: int8}  # Bytes per value -> on-disk dtype
+INT8_MAX = 127
 __all__ = ['decode_memoryview_to_ndarray', 'encode_ndarray_to_memoryview', 'get_normalized_name',
-           'get_denormalized_name', 'ndarray_shape']
+           'get_denormalized_name', 'ndarray_shape', 'ENCODING_PRECISIONS', 'get_encoding_precision_dtype',
+           'get_compute_dtype', 'compute_quantization_scale', 'round_trip_encoding']
 
 
-def decode_memoryview_to_ndarray(to_convert):
+def get_encoding_precision_dtype(precision):
     """
-    Convert a hex memoryview to a numpy ndarray
+    Get the on-disk dtype of an encoding precision
 
-    :param to_convert: Memoryview to convert
-    :type to_convert: memoryview
-    :return: ndarray(128,)
+    :param precision: One of ENCODING_PRECISIONS
+    :type precision: str
+    :return: Numpy dtype used to store encodings of that precision
+    :rtype: type
+    """
+    if precision not in ENCODING_PRECISIONS:
+        raise ValueError(f'Unknown encoding precision "{precision}". '
+                         f'Supported precisions: {list(ENCODING_PRECISIONS)}')
+    return ENCODING_PRECISIONS[precision]
+
+
+def get_compute_dtype(precision):
+    """
+    Get the in-memory dtype used to compute distances for an encoding precision.
+    float64 encodings stay float64, every reduced precision is computed in float32.
+
+    :param precision: One of ENCODING_PRECISIONS
+    :type precision: str
+    :return: Numpy dtype used for distance computations
+    :rtype: type
+    """
+    return float64 if get_encoding_precision_dtype(precision) is float64 else float32
+
+
+def compute_quantization_scale(encodings):
+    """
+    Compute the per-dimension scale used to quantize encodings to int8 so that the largest magnitude of each dimension
+    maps to 127
+
+    :param encodings: Matrix of encodings the scale must cover
+    :type encodings: ndarray(N, 128)
+    :return: Per-dimension scale
+    :rtype: ndarray(128,)
     """
-    return frombuffer(to_convert, dtype=float64).reshape(ndarray_shape)
+    if len(encodings) == 0:
+        return asarray([1.0 / INT8_MAX] * ndarray_shape[0], dtype=float64)
+    scale = np_abs(asarray(encodings, dtype=float64)).max(axis=0) / INT8_MAX
+    scale[scale == 0] = 1.0 / INT8_MAX  # Dimensions that are always 0 quantize to 0 with any scale
+    return scale
 
 
-def encode_ndarray_to_memoryview(encoding):
+def decode_memoryview_to_ndarray(to_convert, count=None, scale=None):
+    """
+    Convert a hex memoryview to a numpy ndarray.
+    The storage precision is inferred from the size of the memoryview. float64 encodings are returned as float64,
+    every reduced precision is returned as float32.
+
+    :param to_convert: Memoryview to convert
+    :type to_convert: memoryview
+    :param count: If provided, `to_convert` holds `count` concatenated encodings which are decoded into a matrix
+    :type count: int or None
+    :param scale: Per-dimension scale of int8 quantized encodings (required to decode int8 encodings)
+    :type scale: ndarray(128,) or None
+    :return: ndarray(128,) or ndarray(count, 128) if `count` is provided
+    """
+    shape = ndarray_shape if count is None else (count,) + ndarray_shape
+    values = ndarray_shape[0] * (1 if count is None else count)
+    item_size = memoryview(to_convert).nbytes // values if values else 8
+    dtype = _ITEM_SIZE_DTYPES.get(item_size)
+    if dtype is None:
+        raise ValueError(f'Unable to infer the precision of an encoding stored with {item_size} bytes per value.')
+
+    decoded = frombuffer(to_convert, dtype=dtype)
+    if dtype is int8:
+        if scale is None:
+            raise ValueError('A quantization scale is required to decode int8 encodings.')
+        decoded = decoded.reshape(shape).astype(float32) * asarray(scale, dtype=float32)
+    elif dtype is float16:
+        decoded = decoded.astype(float32)
+    return decoded.reshape(shape)
+
+
+def encode_ndarray_to_memoryview(encoding, precision='float64', scale=None, warn_clipping=True):
     """
     Convert a facial encoding in numpy ndarray format to a hex memoryview
 
     :param encoding: Facial encoding in numpy ndarray format
     :type encoding: ndarray(128,)
+    :param precision: Storage precision, one of ENCODING_PRECISIONS. Default is 'float64'.
+    :type precision: str
+    :param scale: Per-dimension scale of int8 quantized encodings (required for 'int8'). Values outside the range
+                  of the scale are clipped.
+    :type scale: ndarray(128,) or None
+    :param warn_clipping: Whether a warning is issued when values are clipped
+    :type warn_clipping: bool
     :return: Memoryview of the facial encoding
     :rtype: memoryview
     """
-    return memoryview(encoding.tobytes())
+    dtype = get_encoding_precision_dtype(precision)
+    if dtype is int8:
+        if scale is None:
+            raise ValueError('A quantization scale is required to encode int8 encodings.')
+        quantized = rint(asarray(encoding, dtype=float64) / scale)
+        clipped = count_nonzero(np_abs(quantized) > INT8_MAX)
+        if clipped and warn_clipping:
+            # The scale was computed from the encodings stored when the DB was converted to int8
+            warnings.warn(f'{clipped} value(s) exceed the int8 quantization range and were clipped. Run '
+                          f'`python3 -m src.encoding_precision int8` to recompute the scale over every encoding.')
+        return memoryview(quantized.clip(-INT8_MAX, INT8_MAX).astype(int8).tobytes())
+    return memoryview(asarray(encoding, dtype=dtype).tobytes())
+
+
+def round_trip_encoding(encoding, precision='float64', scale=None):
+    """
+    Get the value an encoding takes once it is stored at a given precision and read back
+
+    :param encoding: Facial encoding (or matrix of facial encodings) in numpy ndarray format
+    :type encoding: ndarray(128,) or ndarray(M, 128)
+    :param precision: Storage precision, one of ENCODING_PRECISIONS
+    :type precision: str
+    :param scale: Per-dimension scale of int8 quantized encodings (required for 'int8')
+    :type scale: ndarray(128,) or None
+    :return: Encoding(s) as they would be decoded from storage
+    :rtype: ndarray(128,) or ndarray(M, 128)
+    """
+    encoding = asarray(encoding)
+    count = encoding.shape[0] if encoding.ndim == 2 else None
+    # Clipping is part of how a searched encoding compares against stored ones, not a storage problem
+    return decode_memoryview_to_ndarray(encode_ndarray_to_memoryview(encoding, precision, scale, warn_clipping=False),
+                                        count, scale)
 
 
 def get_normalized_name(name):
@@ -1,32 +1,93 @@
 """
-Create the database and tables.
+Create the database and tables. Existing databases are migrated to the current schema instead.
 """
 
 import sqlite3
 
+from src import database
+from src import migrate_db
+
+SCHEMA_VERSION = 3  # Version of the schema created by main(), see src/migrate_db.py
+
+CREATE_PERSON = '''CREATE TABLE PERSON
+                    (PERSON_ID        INTEGER PRIMARY KEY,
+                     NAME             TEXT    NOT NULL,
+                     DIRECTORY        TEXT    NOT NULL,
+                     ENCODING_COUNT   INT     NOT NULL);'''
+CREATE_PERSON_NAME_INDEX = 'CREATE UNIQUE INDEX PERSON_NAME ON PERSON (NAME);'
+CREATE_FACE_ENCODING = '''CREATE TABLE FACE_ENCODING
+                          (ENCODING_ID  INTEGER PRIMARY KEY,
+                           PERSON_ID    INTEGER NOT NULL REFERENCES PERSON (PERSON_ID),
+                           ENCODING     BLOB    NOT NULL,
+                           FILE_NAME    TEXT    NOT NULL,
+                           SOURCE       TEXT    NOT NULL);'''
+CREATE_FACE_ENCODING_PERSON_INDEX = 'CREATE INDEX FACE_ENCODING_PERSON ON FACE_ENCODING (PERSON_ID);'
+CREATE_SCHEMA_VERSION = '''CREATE TABLE SCHEMA_VERSION
+                           (VERSION      INT     NOT NULL);'''
+# Single row identifying the DB and counting the changes to existing encodings. Rowids are reused after deletions, so
+# files derived from the DB (gallery file, ANN index) compare this fingerprint rather than the rowids they cover.
+CREATE_GALLERY_GENERATION = '''CREATE TABLE GALLERY_GENERATION
+                               (DB_ID        TEXT    NOT NULL,
+                                GENERATION   INT     NOT NULL);'''
+INSERT_GALLERY_GENERATION = "INSERT INTO GALLERY_GENERATION (DB_ID, GENERATION) VALUES (lower(hex(randomblob(16))), 0)"
+# Appending encodings leaves the generation alone, anything that changes or removes a loaded row bumps it
+CREATE_GALLERY_GENERATION_TRIGGERS = (
+    '''CREATE TRIGGER FACE_ENCODING_DELETED AFTER DELETE ON FACE_ENCODING
+       BEGIN UPDATE GALLERY_GENERATION SET GENERATION = GENERATION + 1; END;''',
+    '''CREATE TRIGGER FACE_ENCODING_UPDATED AFTER UPDATE OF ENCODING_ID, PERSON_ID, ENCODING ON FACE_ENCODING
+       BEGIN UPDATE GALLERY_GENERATION SET GENERATION = GENERATION + 1; END;''',
+    '''CREATE TRIGGER PERSON_DELETED AFTER DELETE ON PERSON
+       BEGIN UPDATE GALLERY_GENERATION SET GENERATION = GENERATION + 1; END;''',
+    '''CREATE TRIGGER PERSON_RENAMED AFTER UPDATE OF NAME ON PERSON
+       BEGIN UPDATE GALLERY_GENERATION SET GENERATION = GENERATION + 1; END;''',
+)
+
 
 def main():
     """
-    Create the database and tables.
+    Create the database and tables. A database that already has tables (e.g. v1 NAME_DIRECTORY/NAME_ENCODING tables)
+    is migrated to SCHEMA_VERSION instead, so its data is never left behind in tables the current code does not read.
     """
-    conn = sqlite3.connect('./hw2.db')
+    conn = database.get_connection()
     print('Opened database successfully')
+    version = migrate_db.get_schema_version(conn)
+    if version > 0:
+        print(f'Database already exists at schema version {version}.')
+        migrate_db.migrate()
+        return
+    try:
+        conn.execute(CREATE_PERSON)
+        conn.execute(CREATE_PERSON_NAME_INDEX)
+    except sqlite3.OperationalError as exception:
+        print(f'Error creating PERSON:\n{exception}')
+
+    try:
+        conn.execute(CREATE_FACE_ENCODING)
+        conn.execute(CREATE_FACE_ENCODING_PERSON_INDEX)
+    except sqlite3.OperationalError as exception:
+        print(f'Error creating FACE_ENCODING:\n{exception}')
+
+    try:
+        # Single row describing how FACE_ENCODING.ENCODING is stored (float64 when empty)
+        conn.execute('''CREATE TABLE ENCODING_PRECISION
+                        (PRECISION    TEXT    NOT NULL,
+                         SCALE        BLOB);''')
+    except sqlite3.OperationalError as exception:
+        print(f'Error creating ENCODING_PRECISION:\n{exception}')
+
     try:
-        conn.execute('''CREATE TABLE NAME_DIRECTORY
-                        (NAME             TEXT    NOT NULL,
-                         DIRECTORY        TEXT    NOT NULL,
-                         ENCODING_COUNT   INT     NOT NULL);''')
+        conn.execute(CREATE_GALLERY_GENERATION)
+        conn.execute(INSERT_GALLERY_GENERATION)
+        for create_trigger in CREATE_GALLERY_GENERATION_TRIGGERS:
+            conn.execute(create_trigger)
     except sqlite3.OperationalError as exception:
-        print(f'Error creating NAME_DIRECTORY:\n{exception}')
+        print(f'Error creating GALLERY_GENERATION:\n{exception}')
 
     try:
-        conn.execute('''CREATE TABLE NAME_ENCODING
-                        (NAME         TEXT    NOT NULL,
-                         ENCODING     BLOB    NOT NULL,
-                         FILE_NAME    TEXT    NOT NULL,
-                         SOURCE       TEXT    NOT NULL);''')
+        conn.execute(CREATE_SCHEMA_VERSION)
+        conn.execute("INSERT INTO SCHEMA_VERSION (VERSION) VALUES (?)", (SCHEMA_VERSION,))
     except sqlite3.OperationalError as exception:
-        print(f'Error creating NAME_ENCODING:\n{exception}')
+        print(f'Error creating SCHEMA_VERSION:\n{exception}')
 
 
 if __name__ == '__main__':
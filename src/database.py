@@ -0,0 +1,158 @@
+"""
+Shared access layer of the local SQLite DB.
+Every thread reuses a single connection in WAL mode, so read paths no longer pay the connection setup and writes are
+grouped into explicit transactions that commit (and fsync) once.
+The DB path defaults to './hw2.db' and can be changed with `DB_PATH` in the .env file or with set_db_path().
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+import sqlite3
+
+from dotenv import dotenv_values
+
+__all__ = ['get_connection', 'transaction', 'call_after_commit', 'get_db_path', 'set_db_path', 'close_connection',
+           'get_write_generation', 'DEFAULT_DB_PATH']
+
+
+DEFAULT_DB_PATH = './hw2.db'
+BUSY_TIMEOUT = 30  # Seconds a connection waits for another writer to release the DB
+STATEMENT_CACHE_SIZE = 256  # Prepared statements kept per connection
+CACHE_SIZE_KIB = 65536  # Page cache of every connection (64 MiB)
+MMAP_SIZE = 268435456  # Bytes of the DB file read through a memory map (256 MiB)
+
+_db_path = None  # Resolved lazily by get_db_path()
+_local = threading.local()  # Connection of the current thread
+_write_generation = 0  # Incremented whenever a write transaction of this process ends
+
+
+def get_db_path():
+    """
+    Get the path of the local DB.
+
+    :return: Path of the DB file
+    :rtype: str
+    """
+    global _db_path
+    if _db_path is None:
+        _db_path = dotenv_values('.env').get('DB_PATH') or DEFAULT_DB_PATH
+    return _db_path
+
+
+def set_db_path(db_path):
+    """
+    Use another DB file. Open connections are replaced the next time each thread asks for one.
+
+    :param db_path: Path of the DB file
+    :type db_path: str
+    """
+    global _db_path
+    _db_path = db_path
+
+
+def _connect(db_path):
+    """
+    Open a connection and tune it for this workload.
+
+    :param db_path: Path of the DB file
+    :type db_path: str
+    :return: Open connection in autocommit mode, transactions are opened by transaction()
+    :rtype: sqlite3.Connection
+    """
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    conn.execute("PRAGMA journal_mode=WAL")  # Readers never block the writer and commits append to the WAL
+    conn.execute("PRAGMA synchronous=NORMAL")  # Durable in WAL mode except for the last commits on power loss
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def get_connection():
+    """
+    Get the connection of the current thread, opening it on first use.
+    A connection inherited from a parent process (after a fork) is never reused.
+
+    :return: Open connection to the DB
+    :rtype: sqlite3.Connection
+    """
+    db_path = get_db_path()
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and (_local.db_path != db_path or _local.pid != os.getpid()):
+        if _local.pid == os.getpid():
+            conn.close()
+        conn = None
+    if conn is None:
+        conn = _connect(db_path)
+        _local.conn, _local.db_path, _local.pid = conn, db_path, os.getpid()
+    return conn
+
+
+def close_connection():
+    """
+    Close the connection of the current thread (if any).
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+    _local.conn = None
+
+
+@contextmanager
+def transaction():
+    """
+    Run a block of statements as one atomic write transaction on the connection of the current thread.
+    The transaction commits when the block exits and rolls back if it raises. Nested blocks join the outer transaction.
+
+    :return: Connection to run the statements on
+    :rtype: sqlite3.Connection
+    """
+    global _write_generation
+    conn = get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+
+    conn.execute("BEGIN IMMEDIATE")  # Take the write lock up front so the transaction cannot fail half-way on a lock
+    _local.after_commit = []
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+        for callback in _local.after_commit:
+            callback()
+    finally:
+        _local.after_commit = []
+        _write_generation += 1
+
+
+def call_after_commit(callback):
+    """
+    Run a callback once the current transaction committed, e.g. to update in-memory state derived from the DB.
+    The callback is dropped if the transaction rolls back and runs immediately outside of a transaction.
+
+    :param callback: Function called without arguments
+    :type callback: callable
+    """
+    conn = get_connection()
+    if conn.in_transaction:
+        _local.after_commit.append(callback)
+    else:
+        callback()
+
+
+def get_write_generation():
+    """
+    Get a counter that changes whenever a write transaction of this process ends. Together with `PRAGMA data_version`,
+    which only changes for commits made by other connections, it tells whether the DB may have changed.
+
+    :return: Write generation
+    :rtype: int
+    """
+    return _write_generation
@@ -0,0 +1,89 @@
+"""
+Storage precision of the facial encodings in the local DB and the migration between precisions.
+Running this file rewrites every FACE_ENCODING row at the requested precision:
+`python3 -m src.encoding_precision <float64|float32|float16|int8>`
+"""
+
+import os
+import sqlite3
+import sys
+
+import numpy as np
+
+from src import conversions
+from src import database
+from src import gallery
+
+__all__ = ['get_encoding_precision', 'migrate_precision', 'DEFAULT_PRECISION']
+
+
+DEFAULT_PRECISION = 'float64'
+
+
+def get_encoding_precision(conn):
+    """
+    Get the precision the DB stores its encodings at.
+
+    :param conn: Open connection to the DB
+    :type conn: sqlite3.Connection
+    :return: Precision (one of conversions.ENCODING_PRECISIONS) and the int8 quantization scale (None unless int8)
+    :rtype: str, ndarray(128,) or None
+    """
+    try:
+        row = conn.execute("SELECT PRECISION, SCALE FROM ENCODING_PRECISION").fetchone()
+    except sqlite3.OperationalError:
+        # DB created before configurable precision existed
+        return DEFAULT_PRECISION, None
+    if row is None:
+        return DEFAULT_PRECISION, None
+    precision, scale = row
+    if scale is not None:
+        scale = np.frombuffer(scale, dtype=np.float64)
+    return precision, scale
+
+
+def migrate_precision(precision, debug=False):
+    """
+    Rewrite every encoding of the DB at a new precision.
+    Converting to a lower precision is lossy: converting back to float64 afterwards does not restore the original
+    values.
+
+    :param precision: Target precision, one of conversions.ENCODING_PRECISIONS
+    :type precision: str
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Number of rewritten encodings
+    :rtype: int
+    """
+    conversions.get_encoding_precision_dtype(precision)  # Validate the precision before touching the DB
+    with database.transaction() as conn:
+        # Single transaction so a failed migration leaves the DB untouched
+        old_precision, old_scale = get_encoding_precision(conn)
+        rows = conn.execute("SELECT ENCODING_ID, ENCODING FROM FACE_ENCODING ORDER BY ENCODING_ID").fetchall()
+        encodings = np.array([conversions.decode_memoryview_to_ndarray(row[1], scale=old_scale) for row in rows],
+                             dtype=np.float64).reshape((-1,) + conversions.ndarray_shape)
+        scale = conversions.compute_quantization_scale(encodings) if precision == 'int8' else None
+
+        conn.executemany("UPDATE FACE_ENCODING SET ENCODING = ? WHERE ENCODING_ID = ?",
+                         ((conversions.encode_ndarray_to_memoryview(encoding, precision, scale).tobytes(), row[0])
+                          for encoding, row in zip(encodings, rows)))
+        conn.execute("CREATE TABLE IF NOT EXISTS ENCODING_PRECISION (PRECISION TEXT NOT NULL, SCALE BLOB)")
+        conn.execute("DELETE FROM ENCODING_PRECISION")
+        conn.execute("INSERT INTO ENCODING_PRECISION (PRECISION, SCALE) VALUES (?, ?)",
+                     (precision, None if scale is None else scale.tobytes()))
+    conn.execute("VACUUM")  # Give the space freed by smaller encodings back to the file system
+
+    gallery.invalidate_gallery()
+    if os.path.exists(gallery.get_gallery_file_path()):
+        gallery.export_gallery_file(debug=debug)
+    if debug:
+        print(f'Migrated {len(rows)} encodings from {old_precision} to {precision}.')
+    return len(rows)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print(f'Usage: python3 -m src.encoding_precision <{"|".join(conversions.ENCODING_PRECISIONS)}>')
+        sys.exit(1)
+    migrated = migrate_precision(sys.argv[1], debug=True)
+    print(f'Rewrote {migrated} encodings at {sys.argv[1]} precision.')
@@ -4,16 +4,25 @@ File providing entity search functionality for the R-IBES system.
 
 import json
 import os
+import re
 from collections import namedtuple
-from SPARQLWrapper import SPARQLWrapper, JSON, SPARQLExceptions
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
-import pygraphviz as pgv
 
 from src import conversions
+from src import knowledge_store
+from src import sparql_cache
+from src import sparql_client
+from src import tree_rendering
 
 # Namedtuple for storing a label, property pair
 LabelProperty = namedtuple('LabelProperty', ['label', 'property'])
 
+VALUES_CHUNK_SIZE = 100  # Resources asked about in a single batched query
+MAX_RESULT_ROWS = 10000  # Rows returned by DBpedia per query, larger results are silently truncated
+COMPILED_QUERY_TIMEOUT = 30  # Seconds before a compiled query is abandoned for per-hop queries
+IRI_PATTERN = re.compile(r'^[A-Za-z][A-Za-z0-9+.-]*:[^\s<>"{}|\\^`]*$')  # Resources that can be written as <IRI>
+
 
 class Node:
     """
@@ -111,48 +120,334 @@ def call_dbpedia(resource, question, resource_link=False, debug=False):
     :return: Result of the question asked by the resource/question pair.
     :rtype: list(str)
     """
-    sparql = SPARQLWrapper('http://dbpedia.org/sparql')
+    subject = resource if resource_link else f'http://dbpedia.org/resource/{resource}'
+    if knowledge_store.is_enabled():
+        if debug:
+            print(f'Local query: <{resource}> : <{question}>')
+        return knowledge_store.get_answers(subject, question)
+    cached_answers = sparql_cache.get_cached_answers(subject, question)
+    if cached_answers is not None:
+        if debug:
+            print(f'Cached query: <{resource}> : <{question}>')
+        return cached_answers
+
     if debug:
         print(f'Running query: <{resource}> : <{question}>')
     if resource_link:
         # Resource is a dbpedia link from a previous recursive call
-        sparql.setQuery(f"""
+        query = f"""
                     SELECT ?answer WHERE {{
                         <{resource}> <http://dbpedia.org/ontology/{question}> ?answer .
                     }}
-        """)
+        """
     else:
         # Resource is a string from the original query / not a dbpedia link
         # Some dbpedia "resource" redirect to "page". This is a safe redirect and doesn't inhibit the query ops
-        sparql.setQuery(f"""
+        query = f"""
             SELECT ?answer WHERE {{
                 <http://dbpedia.org/resource/{resource}> <http://dbpedia.org/ontology/{question}> ?answer .
             }}
-        """)
+        """
 
-    sparql.setReturnFormat(JSON)  # Set the return format to JSON
     try:
-        # Run the query and convert the results to JSON
-        results = sparql.query().convert()
+        # Run the query on the shared keep-alive client, which retries transient failures
+        results = sparql_client.get_sparql_client().select(query)
         answers = []
-        if results['results']['bindings']:
-            for result in results['results']['bindings']:
+        if results:
+            for result in results:
                 answer = result['answer']['value']
                 if answer != '':
                     answers.append(answer)
         else:
             answers.append('UNKNOWN')
+        sparql_cache.store_answers(subject, question, answers)
         if len(answers) == 0:
             return answers
         return answers
-    except SPARQLExceptions.SPARQLWrapperException as sparql_exception:
+    except sparql_client.SparqlError as sparql_exception:
         print(f'Sparql DBPedia ERROR: {sparql_exception}')
         return ['ERROR']
 
 
-def _run_query(resource, questions, root, resource_link=False, debug=False):
+def call_dbpedia_batch(resources, question, resource_link=False, debug=False):
+    """
+    Ask the same question about many resources with one SPARQL query per chunk of resources:
+    `SELECT ?s ?answer WHERE { VALUES ?s { ... } ?s dbo:<question> ?answer }`.
+    Every resource gets the answers call_dbpedia would have returned for it.
+
+    :param resources: Resources to search for
+    :type resources: list(str)
+    :param question: DBO/DBP (biographical) tag to search for on every entity page.
+    :type question: str
+    :param resource_link: Whether the provided resources are dbpedia links.
+    :type resource_link: bool
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Answers of every resource
+    :rtype: dict{str, list(str)}
+    """
+    if knowledge_store.is_enabled():
+        # Local lookups are cheaper than building a batched query
+        return {resource: call_dbpedia(resource, question, resource_link, debug) for resource in resources}
+
+    answers = {}
+    subjects = {}  # Subject URI -> resource, for the resources that have to be queried
+    for resource in dict.fromkeys(resources):
+        subject = resource if resource_link else f'http://dbpedia.org/resource/{resource}'
+        cached_answers = sparql_cache.get_cached_answers(subject, question)
+        if cached_answers is not None:
+            answers[resource] = cached_answers
+        elif IRI_PATTERN.match(subject):
+            subjects[subject] = resource
+        else:
+            # Not a valid IRI (e.g. a literal answer): asked on its own so it cannot break the query of a whole chunk
+            answers[resource] = call_dbpedia(resource, question, resource_link, debug)
+
+    subject_list = list(subjects)
+    for start in range(0, len(subject_list), VALUES_CHUNK_SIZE):
+        chunk_answers = _query_values_chunk(subject_list[start:start + VALUES_CHUNK_SIZE], question, debug)
+        for subject, subject_answers in chunk_answers.items():
+            answers[subjects[subject]] = subject_answers
+    return answers
+
+
+def _query_values_chunk(subjects, question, debug=False):
+    """
+    Run one batched query for a chunk of subjects. Chunks whose result may have been truncated are split in half.
+
+    :param subjects: Subject URIs to search for
+    :type subjects: list(str)
+    :param question: DBO/DBP (biographical) tag to search for on every entity page.
+    :type question: str
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Answers of every subject
+    :rtype: dict{str, list(str)}
+    """
+    if debug:
+        print(f'Running batched query: {len(subjects)} resources : <{question}>')
+    values = ' '.join(f'<{subject}>' for subject in subjects)
+    query = f"""
+        SELECT ?s ?answer WHERE {{
+            VALUES ?s {{ {values} }}
+            ?s <http://dbpedia.org/ontology/{question}> ?answer .
+        }}
+    """
+    try:
+        bindings = sparql_client.get_sparql_client().select(query)
+    except sparql_client.SparqlError as sparql_exception:
+        print(f'Sparql DBPedia ERROR: {sparql_exception}')
+        return {subject: ['ERROR'] for subject in subjects}
+
+    if len(bindings) >= MAX_RESULT_ROWS and len(subjects) > 1:
+        middle = len(subjects) // 2
+        answers = _query_values_chunk(subjects[:middle], question, debug)
+        answers.update(_query_values_chunk(subjects[middle:], question, debug))
+        return answers
+
+    answers = {}
+    for binding in bindings:
+        subject_answers = answers.setdefault(binding['s']['value'], [])
+        if binding['answer']['value'] != '':
+            subject_answers.append(binding['answer']['value'])
+    for subject in subjects:
+        if subject not in answers:
+            answers[subject] = ['UNKNOWN']
+        sparql_cache.store_answers(subject, question, answers[subject])
+    return answers
+
+
+def build_question_trie(question_lists):
+    """
+    Merge several chains of questions into a trie, so the hops shared by their prefixes (e.g. the `child` hop of
+    `child birthPlace` and `child spouse`) are only asked once.
+
+    :param question_lists: Chains of DBO/DBP (biographical) tags, one per query
+    :type question_lists: list(list(str))
+    :return: Trie of questions, each question mapping to the trie of the questions following it
+    :rtype: dict{str, dict}
+    """
+    trie = {}
+    for questions in question_lists:
+        node = trie
+        for question in questions:
+            node = node.setdefault(question, {})
+    return trie
+
+
+def _prefetch_answers(resource, questions, resource_link=False, batched=False, debug=False):
+    """
+    Run every query of a recursive search level by level, running the queries of a level concurrently.
+    The total latency is roughly one round trip per question instead of one per query.
+    In batched mode, the resources of a level are asked about with one query per VALUES_CHUNK_SIZE resources.
+
+    :param resource: Resource to search for (can be the original query's entity or a derived entity).
+    :type resource: str
+    :param questions: A list of DBO/DBP (biographical) tags to search for on a given entity page.
+    :type questions: list(str)
+    :param resource_link: Whether the provided resource is a dbpedia link.
+    :type resource_link: bool
+    :param batched: Whether the queries of a level are batched with call_dbpedia_batch
+    :type batched: bool
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Answers of every (resource, question, resource_link) query _run_query will ask for
+    :rtype: dict{tuple(str, str, bool), list(str)}
+    """
+    return _prefetch_trie_answers(resource, build_question_trie([questions]), resource_link, batched, debug)
+
+
+def _prefetch_trie_answers(resource, trie, resource_link=False, batched=False, debug=False):
+    """
+    Run every query of several recursive searches of the same resource level by level, following a trie built by
+    build_question_trie. The queries of a level, whatever their question, run concurrently.
+
+    :param resource: Resource to search for (can be the original query's entity or a derived entity).
+    :type resource: str
+    :param trie: Trie of the DBO/DBP (biographical) tags to search for
+    :type trie: dict{str, dict}
+    :param resource_link: Whether the provided resource is a dbpedia link.
+    :type resource_link: bool
+    :param batched: Whether the queries of a level are batched with call_dbpedia_batch
+    :type batched: bool
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Answers of every (resource, question, resource_link) query _run_query will ask for
+    :rtype: dict{tuple(str, str, bool), list(str)}
+    """
+    answers = {}
+    level = [(resource, resource_link, trie)]
+    with ThreadPoolExecutor(max_workers=sparql_client.get_sparql_client().max_concurrency) as executor:
+        while len(level) > 0:
+            # A resource appearing several times on a level (e.g. two children born in the same city) is asked once,
+            # its answers are then followed down every branch of the trie that reached it
+            branches = {}
+            for this_resource, link, node in level:
+                if this_resource == 'UNKNOWN':
+                    continue
+                for question, subtrie in node.items():
+                    branches.setdefault((this_resource, question, link), {})[id(subtrie)] = subtrie
+            queries = [query for query in branches if query not in answers]
+            if batched:
+                results = _run_batched_level(executor, queries, debug)
+            else:
+                results = executor.map(lambda query: call_dbpedia(query[0], query[1], query[2], debug), queries)
+            answers.update(zip(queries, results))
+            level = [(answer, True, subtrie)
+                     for query, subtries in branches.items() for subtrie in subtries.values() if len(subtrie) > 0
+                     for answer in answers[query]]
+    return answers
+
+
+def _run_batched_level(executor, queries, debug=False):
+    """
+    Ask the questions of a level with batched queries, one per question and VALUES_CHUNK_SIZE resources, running the
+    chunks concurrently.
+
+    :param executor: Thread pool running the chunks
+    :type executor: ThreadPoolExecutor
+    :param queries: (resource, question, resource_link) queries of the level
+    :type queries: list(tuple(str, str, bool))
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Answers of every query, in the order of `queries`
+    :rtype: list(list(str))
+    """
+    groups = {}
+    for resource, question, resource_link in queries:
+        groups.setdefault((question, resource_link), []).append(resource)
+    chunks = [(resources[start:start + VALUES_CHUNK_SIZE], question, resource_link)
+              for (question, resource_link), resources in groups.items()
+              for start in range(0, len(resources), VALUES_CHUNK_SIZE)]
+    answers = {}
+    for (_, question, resource_link), chunk_answers in zip(
+            chunks, executor.map(lambda chunk: call_dbpedia_batch(chunk[0], chunk[1], chunk[2], debug), chunks)):
+        answers.update({(resource, question, resource_link): result for resource, result in chunk_answers.items()})
+    return [answers[query] for query in queries]
+
+
+def compile_question_path(resource, questions):
+    """
+    Compile a chain of questions into a single SPARQL query following the property path from the resource.
+    Answer `?a<i>` is the answer to question `i` about answer `?a<i-1>`. Nested OPTIONALs keep the paths that stop
+    early, so resources without an answer (the 'UNKNOWN' leaves) appear as rows whose deeper variables are unbound.
+
+    :param resource: Resource from the original query (not a dbpedia link).
+    :type resource: str
+    :param questions: A list of DBO/DBP (biographical) tags to search for on a given entity page.
+    :type questions: list(str)
+    :return: SPARQL query
+    :rtype: str
+    """
+    pattern = ''
+    for depth in reversed(range(len(questions))):
+        subject = f'<http://dbpedia.org/resource/{resource}>' if depth == 0 else f'?a{depth - 1}'
+        pattern = f'OPTIONAL {{ {subject} <http://dbpedia.org/ontology/{questions[depth]}> ?a{depth} . {pattern}}} '
+    variables = ' '.join(f'?a{depth}' for depth in range(len(questions)))
+    return f'SELECT {variables} WHERE {{ {pattern}}}'
+
+
+def _fetch_compiled_answers(resource, questions, debug=False):
+    """
+    Answer a whole chain of questions with the single query built by compile_question_path and split the result set
+    into the per-hop answers _run_query asks for.
+
+    :param resource: Resource from the original query (not a dbpedia link).
+    :type resource: str
+    :param questions: A list of DBO/DBP (biographical) tags to search for on a given entity page.
+    :type questions: list(str)
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Answers of every (resource, question, resource_link) query _run_query will ask for, or None if the query
+             failed, timed out or its result was truncated
+    :rtype: dict{tuple(str, str, bool), list(str)} or None
+    """
+    if len(questions) == 0:
+        return {}
+    if debug:
+        print(f'Running compiled query: <{resource}> : <{"/".join(questions)}>')
+    try:
+        # A timed out compiled query is not retried, the per-hop fallback is faster
+        rows = sparql_client.get_sparql_client().select(compile_question_path(resource, questions),
+                                                 timeout=COMPILED_QUERY_TIMEOUT, retry_timeouts=False)
+    except sparql_client.SparqlError as exception:
+        print(f'Compiled DBPedia query failed, falling back to per-hop queries: {exception}')
+        return None
+    if len(rows) >= MAX_RESULT_ROWS:
+        if debug:
+            print('Compiled DBPedia query result was truncated, falling back to per-hop queries.')
+        return None
+
+    answers = {}
+    answered = set()  # Queries with at least one binding, even if its value is empty
+    for row in rows:
+        parent, resource_link = resource, False
+        for depth, question in enumerate(questions):
+            query = (parent, question, resource_link)
+            parent_answers = answers.setdefault(query, [])
+            if f'a{depth}' not in row:
+                break
+            answer = row[f'a{depth}']['value']
+            answered.add(query)
+            if answer == '':
+                break
+            if answer not in parent_answers:
+                parent_answers.append(answer)
+            parent, resource_link = answer, True
+
+    for (parent, question, resource_link), parent_answers in answers.items():
+        if (parent, question, resource_link) not in answered:
+            parent_answers.append('UNKNOWN')
+        subject = parent if resource_link else f'http://dbpedia.org/resource/{parent}'
+        sparql_cache.store_answers(subject, question, parent_answers)
+    return answers
+
+
+def _run_query(resource, questions, root, resource_link=False, prefetched=None, memo=None, debug=False):
     """
     Run a recursive SPARQL query on DBpedia.
+    With a memo, a resource reached several times with the same remaining questions (e.g. siblings born in the same
+    city) is expanded once and its subtree is shared, so the result is a DAG that tree_to_dict expands back into a tree.
 
     :param resource: Resource to search for (can be the original query's entity or a derived entity).
     :type resource: str
@@ -163,6 +458,10 @@ def _run_query(resource, questions, root, resource_link=False, debug=False):
     :type resource_link: bool
     :param root: Root node of the subtree being searched.
     :type root: Node
+    :param prefetched: Answers fetched ahead of time by _prefetch_answers. Queries missing from it are run directly.
+    :type prefetched: dict{tuple(str, str, bool), list(str)} or None
+    :param memo: Subtrees already expanded, shared by every call of a query (or of several queries)
+    :type memo: dict{tuple, Node} or None
     :param debug: Enable debug mode
     :type debug: bool
     :return: A node containing the resource and the question that was asked to get to that resource.
@@ -173,9 +472,16 @@ def _run_query(resource, questions, root, resource_link=False, debug=False):
         root.add_child(child)
         return child
 
+    # The incoming question is part of the key because it becomes the question of the returned node
+    memo_key = (resource, tuple(questions), resource_link, root.get_question())
+    if memo is not None and memo_key in memo:
+        return memo[memo_key]
+
     question = questions[0]
     questions.pop(0)
-    answers = call_dbpedia(resource, question, resource_link, debug)
+    answers = (prefetched or {}).get((resource, question, resource_link))
+    if answers is None:
+        answers = call_dbpedia(resource, question, resource_link, debug)
     if debug:
         print(answers)
 
@@ -184,15 +490,119 @@ def _run_query(resource, questions, root, resource_link=False, debug=False):
         if len(questions) > 0:
             # Needed to copy the list, not just the reference. Otherwise, the list gets emptied
             copied_questions = questions.copy()
-            child = _run_query(answer, copied_questions, this_node, resource_link=True, debug=debug)
+            child = _run_query(answer, copied_questions, this_node, resource_link=True, prefetched=prefetched,
+                               memo=memo, debug=debug)
             child.set_question(question)
             this_node.add_child(child)
         else:
             child = Node(answer, question)
             this_node.add_child(child)
+    if memo is not None:
+        memo[memo_key] = this_node
     return this_node
 
 
+def stream_edges(query, name, debug=False):
+    """
+    Run a query and yield each edge of its tree as soon as it is known, instead of building the whole tree first.
+    Like search, the query is answered by its compiled query if possible. Otherwise levels are searched one after
+    another with the batched queries of _run_batched_level, and the edges of a level are yielded as soon as it is
+    answered. Only the current level is kept in memory. Edges are yielded in a deterministic order: parents in the order
+    they were yielded, the answers of a parent in the order _run_query adds them.
+    Every event is a {'parent': id, 'predicate': question, 'child': id, 'resource': child resource} dictionary, the
+    first one introducing the root with a None parent and the 'root' predicate. An edge yielded twice with the same
+    child id means the child appears twice under its parent, as in the tree built by _run_query.
+
+    :param query: Query to run on the given entity. Query terms must be in the form of DBO/DBP tags.
+    :type query: str
+    :param name: Normalized name of the entity to search for.
+    :type name: str
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Generator of edge events, which assemble_tree turns back into the tree
+    :rtype: Generator[dict]
+    """
+    dbpedia_name = conversions.get_dbpedia_name(name)
+    questions = query.split()
+    yield {'parent': None, 'predicate': 'root', 'child': 0, 'resource': dbpedia_name}
+
+    prefetched = None  # The local knowledge store answers every query directly
+    if not knowledge_store.is_enabled():
+        prefetched = _fetch_compiled_answers(dbpedia_name, questions, debug=debug)
+    prefetched = prefetched or {}
+
+    next_id = 1
+    level = [(0, dbpedia_name, False)]  # (node id, resource, resource_link) of the nodes to ask the next question about
+    with ThreadPoolExecutor(max_workers=sparql_client.get_sparql_client().max_concurrency) as executor:
+        for depth, question in enumerate(questions):
+            last_question = depth == len(questions) - 1
+            # A resource appearing several times on a level is asked once, its answers are yielded under every parent
+            parents = {}
+            for node_id, resource, resource_link in level:
+                if resource != 'UNKNOWN':
+                    parents.setdefault((resource, question, resource_link), []).append(node_id)
+            missing = [query_key for query_key in parents if query_key not in prefetched]
+            fetched = dict(zip(missing, _run_batched_level(executor, missing, debug)))
+            level = []
+            for query_key, query_parents in parents.items():
+                answers = prefetched[query_key] if query_key in prefetched else fetched[query_key]
+                if debug:
+                    print(answers)
+                for parent in query_parents:
+                    for answer in answers:
+                        event = {'parent': parent, 'predicate': question, 'child': next_id, 'resource': answer}
+                        next_id += 1
+                        yield event
+                        if last_question:
+                            continue
+                        if answer == 'UNKNOWN':
+                            # _run_query adds an 'UNKNOWN' answer that still has questions left twice to its parent
+                            yield event
+                        else:
+                            level.append((event['child'], answer, True))
+
+
+def stream_ndjson(query, name, debug=False):
+    """
+    Run a query and yield each edge of its tree as a line of NDJSON as soon as it is known (see stream_edges).
+
+    :param query: Query to run on the given entity. Query terms must be in the form of DBO/DBP tags.
+    :type query: str
+    :param name: Normalized name of the entity to search for.
+    :type name: str
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Generator of JSON-encoded edge events, without line terminators
+    :rtype: Generator[str]
+    """
+    for event in stream_edges(query, name, debug):
+        yield json.dumps(event)
+
+
+def assemble_tree(events):
+    """
+    Build the tree of a query from its edge events.
+
+    :param events: Edge events from stream_edges, or their NDJSON lines from stream_ndjson
+    :type events: Iterable[dict or str]
+    :return: Root node of the tree, the same tree as _run_query's
+    :rtype: Node
+    """
+    nodes = {}
+    root = None
+    for event in events:
+        if isinstance(event, str):
+            event = json.loads(event)
+        child = nodes.get(event['child'])
+        if child is None:
+            child = nodes[event['child']] = Node(event['resource'], event['predicate'])
+        if event['parent'] is None:
+            root = child
+        else:
+            nodes[event['parent']].add_child(child)
+    return root
+
+
 def tree_to_dict(node):
     """
     Convert a tree to a dictionary recursively.
@@ -222,35 +632,6 @@ def print_tree_dict(tree):
     print(json.dumps(tree, indent=4))
 
 
-def add_edges(graph, node):
-    """
-    Add edges to the graph recursively.
-
-    :param graph: Graph representation of the tree.
-    :type graph: AGraph
-    :param node: Current node to add edges for.
-    :type node: Node
-    """
-    for child in node.get_children():
-        graph.add_edge(node.get_resource(), child.get_resource(), label=child.get_question())
-        add_edges(graph, child)
-
-
-def visualize_tree(root, image_name='tree.png'):
-    """
-    Visualize the tree using pygraphviz.
-
-    :param root: Root node of the tree to visualize.
-    :type root: Node
-    :param image_name: Name of the image to save the tree to.
-    :type image_name: str
-    """
-    graph = pgv.AGraph(directed=True)
-    add_edges(graph, root)
-    graph.layout(prog='dot')
-    graph.draw(image_name)
-
-
 def save_json(json_dict, file_name):
     """
     Save a JSON dictionary to a file.
@@ -264,7 +645,7 @@ def save_json(json_dict, file_name):
         json.dump(json_dict, json_file, indent=4)
 
 
-def generate_file_name(name, questions):
+def generate_file_name(name, questions, graph_format='png'):
     """
     Generate a file name for the tree visualization.
 
@@ -272,6 +653,8 @@ def generate_file_name(name, questions):
     :type name: str
     :param questions: A list of DBO/DBP (biographical) tags to search for on a given entity page.
     :type questions: list(str)
+    :param graph_format: Extension of the tree visualization.
+    :type graph_format: str
     :return: File name for the tree visualization and file name for JSON dump.
     :rtype: str, str
     """
@@ -280,39 +663,169 @@ def generate_file_name(name, questions):
         file_name += f'-{question}'
     if not os.path.exists('./results'):
         os.makedirs('./results')
-    return f'./results/{file_name}.png', f'./results/{file_name}.json'
+    return f'./results/{file_name}.{graph_format}', f'./results/{file_name}.json'
 
 
-def main(query, name, debug=False):
+def search(queries, name, debug=False, memo=None):
     """
-    Main method for the entity search module.
+    Run the SPARQL work of one or more queries about the same entity. Every hop is fetched before the trees are built:
+    a single query is answered by its compiled query if possible, several queries by per-level batched queries
+    following the trie of their questions, so the hops shared by their prefixes run once.
 
-    :param query: Query to run on the given entity. Query terms must be in the form of DBO/DBP tags.
-    :type query: str
+    :param queries: Queries to run on the given entity. Query terms must be in the form of DBO/DBP tags.
+    :type queries: list(str)
     :param name: Normalized name of the entity to search for.
     :type name: str
     :param debug: Enable debug mode
     :type debug: bool
+    :param memo: Subtrees expanded by previous queries, to reuse them across queries. Default is a new memo.
+    :type memo: dict{tuple, Node} or None
+    :return: Root node of the tree of every query, in the order of `queries`
+    :rtype: list(Node)
     """
     dbpedia_name = conversions.get_dbpedia_name(name)
-    questions = query.split()
-    root = Node(dbpedia_name, 'root')
+    question_lists = [query.split() for query in queries]
+    if memo is None:
+        memo = {}
+
+    prefetched = None  # The local knowledge store answers every query directly
+    if not knowledge_store.is_enabled():
+        if len(question_lists) == 1:
+            prefetched = _fetch_compiled_answers(dbpedia_name, question_lists[0], debug=debug)
+        if prefetched is None:
+            prefetched = _prefetch_trie_answers(dbpedia_name, build_question_trie(question_lists), batched=True,
+                                                debug=debug)
+
+    roots = []
+    for questions in question_lists:
+        root = _run_query(dbpedia_name, questions.copy(), Node(dbpedia_name, 'root'), prefetched=prefetched,
+                          memo=memo, debug=debug)
+        root.set_root()
+        roots.append(root)
+    if debug:
+        sparql_cache.print_cache_stats()
+    return roots
+
 
-    root = _run_query(dbpedia_name, questions.copy(), root, debug=debug)
-    root.set_root()
+def render_result(root, name, query, output_format=tree_rendering.DEFAULT_FORMAT, print_tree=True):
+    """
+    Print the tree of a query and save it in the requested output format. Graph images are laid out in the background.
 
+    :param root: Root node of the tree of the query.
+    :type root: Node
+    :param name: Normalized name of the entity searched for.
+    :type name: str
+    :param query: Query the tree answers.
+    :type query: str
+    :param output_format: 'none' (only print the tree), 'json' (also save it as JSON), or 'dot', 'svg' or 'png' (also
+                          save its graph)
+    :type output_format: str
+    :param print_tree: Whether the tree is printed (e.g. not when it was already streamed)
+    :type print_tree: bool
+    :return: Future of the graph image name, None if no image is drawn
+    :rtype: Future or None
+    """
+    if output_format not in tree_rendering.RENDER_FORMATS:
+        raise ValueError(f'Unknown output format "{output_format}". '
+                         f'Expected one of {", ".join(tree_rendering.RENDER_FORMATS)}.')
     jsonified_tree = tree_to_dict(root)
-    print_tree_dict(jsonified_tree)
+    if print_tree:
+        print_tree_dict(jsonified_tree)
+    if output_format == 'none':
+        return None
 
-    graph_file_name, json_file_name = generate_file_name(name, questions)
-    visualize_tree(root, graph_file_name)
+    graph_file_name, json_file_name = generate_file_name(name, query.split(), output_format)
     save_json(jsonified_tree, json_file_name)
-    img = Image.open(graph_file_name)
-    img.show(title=graph_file_name)
+    if output_format == 'json':
+        return None
+    return tree_rendering.render_graph(root, jsonified_tree, graph_file_name, output_format)
+
+
+def show_results(renders, output_format=tree_rendering.DEFAULT_FORMAT):
+    """
+    Wait for the graph images of queries to be drawn, then show them and wait for the user (PNG images only).
+
+    :param renders: Futures of the graph image names returned by render_result
+    :type renders: list(Future or None)
+    :param output_format: Output format the results were rendered in
+    :type output_format: str
+    """
+    graph_file_names = [render.result() for render in renders if render is not None]
+    if output_format != 'png':
+        for graph_file_name in graph_file_names:
+            print(f'Saved graph to {graph_file_name}')
+        return
+    for graph_file_name in graph_file_names:
+        img = Image.open(graph_file_name)
+        img.show(title=graph_file_name)
     while input('Press enter to continue...') != '':
         pass
 
 
+def run_queries(queries, name, debug=False, output_format=tree_rendering.DEFAULT_FORMAT):
+    """
+    Run several queries about the same entity. Their SPARQL work runs concurrently and shares the common hops, the
+    results are only shown once every query is answered.
+
+    :param queries: Queries to run on the given entity. Query terms must be in the form of DBO/DBP tags.
+    :type queries: list(str)
+    :param name: Normalized name of the entity to search for.
+    :type name: str
+    :param debug: Enable debug mode
+    :type debug: bool
+    :param output_format: One of tree_rendering.RENDER_FORMATS
+    :type output_format: str
+    """
+    roots = search(queries, name, debug)
+    renders = [render_result(root, name, query, output_format) for root, query in zip(roots, queries)]
+    show_results(renders, output_format)
+
+
+def stream_queries(queries, name, debug=False, output_format=tree_rendering.DEFAULT_FORMAT):
+    """
+    Run queries one after another, printing the edges of their trees as NDJSON as soon as they are known.
+    The trees are then saved in the requested output format and shown once every query is answered.
+
+    :param queries: Queries to run on the given entity. Query terms must be in the form of DBO/DBP tags.
+    :type queries: list(str)
+    :param name: Normalized name of the entity to search for.
+    :type name: str
+    :param debug: Enable debug mode
+    :type debug: bool
+    :param output_format: One of tree_rendering.RENDER_FORMATS
+    :type output_format: str
+    """
+    def print_lines(lines):
+        for line in lines:
+            print(line, flush=True)
+            yield line
+
+    renders = []
+    for query in queries:
+        root = assemble_tree(print_lines(stream_ndjson(query, name, debug)))
+        renders.append(render_result(root, name, query, output_format, print_tree=False))
+    show_results(renders, output_format)
+
+
+def main(query, name, debug=False, memo=None, output_format=tree_rendering.DEFAULT_FORMAT):
+    """
+    Main method for the entity search module.
+
+    :param query: Query to run on the given entity. Query terms must be in the form of DBO/DBP tags.
+    :type query: str
+    :param name: Normalized name of the entity to search for.
+    :type name: str
+    :param debug: Enable debug mode
+    :type debug: bool
+    :param memo: Subtrees expanded by previous queries, to reuse them across queries. Default is a new memo.
+    :type memo: dict{tuple, Node} or None
+    :param output_format: One of tree_rendering.RENDER_FORMATS
+    :type output_format: str
+    """
+    root = search([query], name, debug, memo)[0]
+    show_results([render_result(root, name, query, output_format)], output_format)
+
+
 if __name__ == '__main__':
     query = 'child birthPlace areaCode'
     name = 'George_W._Bush'
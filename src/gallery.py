@@ -0,0 +1,924 @@
+"""
+In-memory gallery of facial encodings used for vectorized matching against the local DB.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+
+import numpy as np
+
+from src import conversions
+from src import database
+from src import encoding_precision
+from src.ann_index import IVFIndex, DEFAULT_N_PROBE, DEFAULT_TOP_K
+
+__all__ = ['EncodingGallery', 'get_gallery', 'record_encoding', 'invalidate_gallery', 'set_gallery_backend',
+           'set_ann_search', 'export_gallery_file', 'load_gallery_file', 'import_gallery_file', 'delete_gallery_file',
+           'get_gallery_file_path', 'get_ann_index_path',
+           'MATCH_TOLERANCE', 'MATCH_RATE_THRESHOLD',
+           'MAX_INT', 'UNKNOWN_PERSON']
+
+
+MATCH_TOLERANCE = 0.4  # Maximum face distance for two encodings to be considered the same person
+MATCH_RATE_THRESHOLD = 0.6  # Minimum fraction of a person's encodings that must match
+MAX_INT = 99999999  # Match count reported for a person whose encodings contain the exact searched encoding
+PREFILTER_MARGIN = 1e-5  # Slack added to the centroid bounds so floating-point error can never prune a real match
+BATCH_QUERY_BLOCK = 256  # Searched encodings compared at once by identify_many()
+BATCH_GALLERY_BLOCK = 4096  # Gallery encodings compared at once by identify_many()
+RECHECK_BAND_EPS = 1e3  # Pairs within this many machine epsilons of a decision boundary get their distance recomputed
+UNKNOWN_PERSON = 'UNKNOWN PERSON'
+GALLERY_FILE_SUFFIX = '_gallery.npy'  # Memory-mapped encoding matrix derived from the DB (see export_gallery_file)
+GALLERY_BACKENDS = ('sqlite', 'memmap')
+ANN_INDEX_SUFFIX = '_ivf.npz'  # Approximate nearest-neighbour index derived from the DB (see set_ann_search)
+ANN_REBUILD_FACTOR = 2  # Retrain the ANN index once the gallery grew this many times past the size it was trained on
+ANN_SAVE_INTERVAL = 1024  # Rows added to the ANN index before it is saved again, the remainder is saved at exit
+
+_gallery = None  # Process-wide gallery shared by every lookup, loaded lazily by get_gallery()
+_gallery_snapshot = None  # DB state the gallery was last synced at, see get_gallery()
+_gallery_backend = 'sqlite'
+_ann_options = None  # {'n_probe': int, 'top_k': int} when lookups go through the ANN index
+
+
+class EncodingGallery:
+    """
+    All facial encodings of the local DB held in a single contiguous (N, 128) matrix with a parallel label array.
+    Label `i` of the label array corresponds to the name at index `i` of the name list.
+    """
+    def __init__(self, rows=(), precision='float64', scale=None):
+        """
+        Build a gallery from (rowid, name, encoding) rows as stored in the FACE_ENCODING table.
+
+        :param rows: Iterable of (rowid, normalized name, encoding memoryview/bytes) tuples, ordered by rowid
+        :type rows: iterable(tuple(int, str, memoryview))
+        :param precision: Precision the encodings are stored at, one of conversions.ENCODING_PRECISIONS
+        :type precision: str
+        :param scale: Per-dimension scale of int8 quantized encodings
+        :type scale: ndarray(128,) or None
+        """
+        self.precision = precision
+        self.scale = scale
+        self._names = []  # Label -> normalized name, in order of first appearance
+        self._label_ids = {}  # Normalized name -> label
+        self._size = 0
+        # Rows past `_size` are spare capacity
+        self._buffer = np.empty((0,) + conversions.ndarray_shape, dtype=conversions.get_compute_dtype(precision))
+        self._label_buffer = np.empty(0, dtype=np.intp)
+        self._totals = np.zeros(0, dtype=np.intp)
+        self._person_order = None  # Rows sorted by label, built lazily by _get_person_rows()
+        # Per-person centroid, max distance of an encoding to the centroid and distance of the encoding that decides
+        # whether a majority can be reached (see _update_person_bounds)
+        self._centroids = np.empty((0,) + conversions.ndarray_shape)
+        self._radii = np.empty(0)
+        self._majority_radii = np.empty(0)
+        self._stale_bound_labels = []  # Labels whose bounds must be recomputed before the next prefiltered lookup
+        self.last_rowid = 0  # Highest FACE_ENCODING rowid loaded into the gallery
+        self.fingerprint = None  # DB fingerprint the gallery was loaded at (see _get_db_fingerprint)
+        self.ann_index = None  # Optional IVFIndex kept in sync with the gallery rows
+        self.extend(rows)
+
+    @classmethod
+    def from_arrays(cls, encodings, labels, names, last_rowid, precision='float64', scale=None, fingerprint=None):
+        """
+        Build a gallery directly on top of an existing encoding matrix (e.g. a read-only np.memmap) without copying it.
+        The matrix is only copied into private memory if rows are later appended to the gallery.
+
+        :param encodings: Matrix of encodings
+        :type encodings: ndarray(N, 128)
+        :param labels: Label of the person each row of `encodings` belongs to
+        :type labels: list(int) or ndarray(N,)
+        :param names: Normalized names indexed by label
+        :type names: list(str)
+        :param last_rowid: Highest FACE_ENCODING rowid contained in `encodings`
+        :type last_rowid: int
+        :param precision: Precision the encodings are stored at in the DB
+        :type precision: str
+        :param scale: Per-dimension scale of int8 quantized encodings
+        :type scale: ndarray(128,) or None
+        :param fingerprint: DB fingerprint the arrays were read at
+        :type fingerprint: str or None
+        :return: Gallery backed by `encodings`
+        :rtype: EncodingGallery
+        """
+        gallery = cls(precision=precision, scale=scale)
+        gallery._names = list(names)
+        gallery._label_ids = {name: label for label, name in enumerate(gallery._names)}
+        gallery._buffer = encodings
+        gallery._label_buffer = np.asarray(labels, dtype=np.intp)
+        gallery._size = encodings.shape[0]
+        gallery._totals = np.bincount(gallery._label_buffer, minlength=len(gallery._names))
+        gallery._stale_bound_labels = [np.arange(len(gallery._names))]
+        gallery.last_rowid = last_rowid
+        gallery.fingerprint = fingerprint
+        return gallery
+
+    def _get_label(self, name):
+        """
+        Get the label of a person, registering them if they are not yet in the gallery.
+
+        :param name: Normalized name of the person
+        :type name: str
+        :return: Label of the person
+        :rtype: int
+        """
+        label = self._label_ids.get(name)
+        if label is None:
+            label = len(self._names)
+            self._label_ids[name] = label
+            self._names.append(name)
+        return label
+
+    def extend(self, rows):
+        """
+        Append (rowid, name, encoding) rows to the gallery.
+
+        :param rows: Iterable of (rowid, normalized name, encoding memoryview/bytes) tuples, ordered by rowid
+        :type rows: iterable(tuple(int, str, memoryview))
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        labels = np.array([self._get_label(name) for _, name, _ in rows], dtype=np.intp)
+        blobs = [bytes(row[2]) for row in rows]
+        if len({len(blob) for blob in blobs}) == 1:
+            # Decode every encoding in one go rather than building an ndarray per row
+            encodings = conversions.decode_memoryview_to_ndarray(b''.join(blobs), count=len(blobs), scale=self.scale)
+        else:
+            # Rows stored at different precisions have to be decoded one at a time
+            encodings = np.array([conversions.decode_memoryview_to_ndarray(blob, scale=self.scale) for blob in blobs])
+
+        new_size = self._size + len(rows)
+        if new_size > self._buffer.shape[0]:
+            # Grow geometrically so repeated single-row additions stay cheap
+            capacity = max(new_size, 2 * self._buffer.shape[0])
+            buffer = np.empty((capacity,) + conversions.ndarray_shape, dtype=self._buffer.dtype)
+            buffer[:self._size] = self._buffer[:self._size]
+            label_buffer = np.empty(capacity, dtype=np.intp)
+            label_buffer[:self._size] = self._label_buffer[:self._size]
+            self._buffer, self._label_buffer = buffer, label_buffer
+        self._buffer[self._size:new_size] = encodings
+        self._label_buffer[self._size:new_size] = labels
+        self._size = new_size
+
+        totals = np.zeros(len(self._names), dtype=np.intp)
+        totals[:self._totals.shape[0]] = self._totals
+        self._totals = totals + np.bincount(labels, minlength=len(self._names))
+        self._person_order = None
+        self._stale_bound_labels.append(labels)
+        self.last_rowid = max(self.last_rowid, rows[-1][0])
+        if self.ann_index is not None:
+            self.ann_index.add(self._buffer[self._size - len(rows):self._size], self.last_rowid)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def names(self):
+        """
+        Normalized names of every person in the gallery, indexed by label.
+
+        :rtype: list(str)
+        """
+        return self._names
+
+    @property
+    def encodings(self):
+        """
+        Matrix of all encodings in the gallery.
+
+        :rtype: ndarray(N, 128)
+        """
+        return self._buffer[:self._size]
+
+    @property
+    def labels(self):
+        """
+        Label of the person each row of `encodings` belongs to.
+
+        :rtype: ndarray(N,)
+        """
+        return self._label_buffer[:self._size]
+
+    def get_person_encodings(self, name):
+        """
+        Get every encoding of a person.
+
+        :param name: Normalized name of the person
+        :type name: str
+        :return: Encodings of the person (empty if the person is not in the gallery)
+        :rtype: list(ndarray(128,))
+        """
+        label = self._label_ids.get(name)
+        if label is None:
+            return []
+        return list(self.encodings[self.labels == label])
+
+    def round_trip(self, encoding):
+        """
+        Convert an encoding to the precision of the gallery. Comparisons must happen at the gallery's precision: mixing
+        dtypes would upcast the whole matrix, and an exact duplicate is only equal to a stored encoding once it went
+        through the same storage conversion.
+
+        :param encoding: Encoding to convert
+        :type encoding: ndarray(128,)
+        :return: Encoding as it is stored in the gallery
+        :rtype: ndarray(128,)
+        """
+        return conversions.round_trip_encoding(encoding, self.precision, self.scale).astype(self._buffer.dtype)
+
+    def _get_person_rows(self, person_labels):
+        """
+        Get the rows of every encoding belonging to a set of people.
+
+        :param person_labels: Labels of the people
+        :type person_labels: ndarray(K,)
+        :return: Rows of the people's encodings
+        :rtype: ndarray(R,)
+        """
+        if self._person_order is None:
+            self._person_order = np.argsort(self.labels, kind='stable')
+            self._person_starts = np.concatenate(([0], np.cumsum(self._totals)))
+        if len(person_labels) == 0:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate([self._person_order[self._person_starts[label]:self._person_starts[label + 1]]
+                               for label in person_labels])
+
+    def _update_person_bounds(self):
+        """
+        Recompute the centroid bounds of every person whose encodings changed since the last update.
+        For each person this stores the centroid of their encodings, the radius (largest distance of an encoding to the
+        centroid) and the majority radius: the m-th largest distance to the centroid, where m is the minimum number of
+        matches the person needs to be accepted by the voting.
+        """
+        if not self._stale_bound_labels:
+            return
+        person_labels = np.unique(np.concatenate(self._stale_bound_labels))
+        self._stale_bound_labels = []
+
+        n_people = len(self._names)
+        if self._centroids.shape[0] < n_people:
+            # New people were added, grow the bound tables
+            grown = [np.zeros((n_people,) + conversions.ndarray_shape), np.zeros(n_people), np.zeros(n_people)]
+            for new_table, old_table in zip(grown, (self._centroids, self._radii, self._majority_radii)):
+                new_table[:old_table.shape[0]] = old_table
+            self._centroids, self._radii, self._majority_radii = grown
+
+        # Rows of the people grouped by label (_get_person_rows keeps the order of `person_labels`)
+        counts = self._totals[person_labels]
+        rows = self._get_person_rows(person_labels)
+        encodings = np.asarray(self.encodings[rows], dtype=np.float64)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        centroids = np.add.reduceat(encodings, starts, axis=0) / counts[:, None]
+        member_distances = np.linalg.norm(encodings - np.repeat(centroids, counts, axis=0), axis=1)
+
+        # Minimum number of matches to be accepted: match rate >= 60% and more matches than not-matches
+        required = np.ceil(counts * MATCH_RATE_THRESHOLD)
+        required = np.where((required - 1) / counts >= MATCH_RATE_THRESHOLD, required - 1, required)
+        required = np.where(required / counts < MATCH_RATE_THRESHOLD, required + 1, required)
+        required = np.maximum(required, counts // 2 + 1).astype(np.intp)
+
+        # Sort every person's member distances in descending order to read the m-th largest one
+        segment_ids = np.repeat(np.arange(len(person_labels)), counts)
+        descending = member_distances[np.lexsort((-member_distances, segment_ids))]
+        self._centroids[person_labels] = centroids
+        self._radii[person_labels] = descending[starts]
+        self._majority_radii[person_labels] = descending[starts + required - 1]
+
+    def _get_prefilter_candidates(self, encoding):
+        """
+        Use the triangle inequality to rule out people who cannot be accepted by the voting.
+        Every encoding x of a person with centroid c satisfies d(q, x) >= d(q, c) - d(x, c). So when d(q, c) minus the
+        radius exceeds the tolerance, none of their encodings can match. When d(q, c) minus the majority radius exceeds
+        the tolerance, fewer encodings than the majority can match, and since d(q, c) is larger than the radius the
+        searched encoding cannot be an exact duplicate either.
+
+        :param encoding: Encoding at the gallery's precision
+        :type encoding: ndarray(128,)
+        :return: Labels of the people that may be accepted, in ascending order
+        :rtype: ndarray(K,)
+        """
+        self._update_person_bounds()
+        centroid_distances = np.linalg.norm(self._centroids - encoding, axis=1)
+        no_match = centroid_distances - self._radii > MATCH_TOLERANCE + PREFILTER_MARGIN
+        no_majority = ((centroid_distances - self._majority_radii > MATCH_TOLERANCE + PREFILTER_MARGIN)
+                       & (centroid_distances > self._radii + PREFILTER_MARGIN))
+        return np.flatnonzero(~(no_match | no_majority))
+
+    def _get_ann_candidates(self, encoding):
+        """
+        Use the ANN index to find the people owning the encodings closest to an encoding.
+
+        :param encoding: Encoding at the gallery's precision
+        :type encoding: ndarray(128,)
+        :return: Labels of at most `ann_index.top_k` candidate people, in ascending order
+        :rtype: ndarray(K,)
+        """
+        rows = self.ann_index.search(encoding)
+        distances = np.linalg.norm(self.encodings[rows] - encoding, axis=1)
+        nearest_labels = self.labels[rows[np.argsort(distances, kind='stable')]]
+        _, first_seen = np.unique(nearest_labels, return_index=True)
+        return np.sort(nearest_labels[np.sort(first_seen)][:self.ann_index.top_k])
+
+    def compare(self, encoding, candidate_labels=None):
+        """
+        Compare an encoding to every encoding in the gallery in a single pass and count, per person, how many of their
+        encodings match. A person owning the exact same encoding gets a match count of MAX_INT.
+
+        :param encoding: Encoding to compare against the gallery
+        :type encoding: ndarray(128,)
+        :param candidate_labels: If provided, only compare against the encodings of these people. Every other person
+                                 is reported with 0 matches.
+        :type candidate_labels: ndarray(K,) or None
+        :return: Per-label match counts and per-label not-match counts
+        :rtype: ndarray(P,), ndarray(P,)
+        """
+        encoding = self.round_trip(encoding)
+
+        # Same distance computation as face_recognition.face_distance so results are bit-for-bit identical
+        encodings = self.encodings
+        labels = self.labels
+        if candidate_labels is not None:
+            rows = self._get_person_rows(candidate_labels)
+            encodings = encodings[rows]
+            labels = labels[rows]
+        distances = np.linalg.norm(encodings - encoding, axis=1)
+        match_counts = np.bincount(labels[distances <= MATCH_TOLERANCE], minlength=len(self._names))
+        not_match_counts = self._totals - match_counts
+
+        # Identical encodings always have a distance of 0, so only those rows need an exact equality check
+        exact_rows = [row for row in np.flatnonzero(distances == 0)
+                      if np.array_equal(encoding, encodings[row])]
+        if exact_rows:
+            exact_labels = labels[exact_rows]
+            match_counts[exact_labels] = MAX_INT
+            not_match_counts[exact_labels] = 0
+        return match_counts, not_match_counts
+
+    def _select_best(self, match_counts, not_match_counts):
+        """
+        Apply the voting rules to per-person match counts.
+
+        :param match_counts: Per-label match counts, one row per searched encoding
+        :type match_counts: ndarray(M, P)
+        :param not_match_counts: Per-label not-match counts, one row per searched encoding
+        :type not_match_counts: ndarray(M, P)
+        :return: Label of the best match of every row and its match count (0 when nobody was accepted)
+        :rtype: ndarray(M,), ndarray(M,)
+        """
+        match_rates = match_counts / (match_counts + not_match_counts)
+        accepted = (match_rates >= MATCH_RATE_THRESHOLD) & (match_counts > not_match_counts)
+        scores = np.where(accepted, match_counts, 0)
+
+        # argmax returns the first maximum, so ties resolve to the person seen first in the DB (as before)
+        best = np.argmax(scores, axis=-1)
+        return best, np.take_along_axis(scores, np.expand_dims(best, -1), axis=-1).squeeze(-1)
+
+    def identify_many(self, encodings):
+        """
+        Identify many encodings at once with the same rules as `identify`. Distances are computed as blocked
+        matrix-matrix products (|q|^2 + |x|^2 - 2 q.x), so memory stays bounded by BATCH_QUERY_BLOCK x
+        BATCH_GALLERY_BLOCK distances. Pairs whose distance lands close to the tolerance or to 0 are recomputed the same
+        way as `identify`, so both always agree.
+
+        :param encodings: Encodings of the people to identify
+        :type encodings: ndarray(M, 128)
+        :return: Normalized name of the best match of every encoding (or UNKNOWN PERSON) and its match count
+        :rtype: list(str), ndarray(M,)
+        """
+        encodings = np.asarray(encodings).reshape((-1,) + conversions.ndarray_shape)
+        n_queries = encodings.shape[0]
+        n_people = len(self._names)
+        if n_people == 0 or n_queries == 0:
+            return [UNKNOWN_PERSON] * n_queries, np.zeros(n_queries, dtype=np.intp)
+
+        queries = self.round_trip(encodings)
+        gallery_encodings = self.encodings
+        labels = self.labels
+        gallery_norms = np.einsum('ij,ij->i', gallery_encodings, gallery_encodings)
+        squared_tolerance = MATCH_TOLERANCE ** 2
+        band = RECHECK_BAND_EPS * np.finfo(gallery_encodings.dtype).eps * 2 * max(gallery_norms.max(), 1)
+
+        best_names = []
+        best_counts = np.zeros(n_queries, dtype=np.intp)
+        for query_start in range(0, n_queries, BATCH_QUERY_BLOCK):
+            query_block = queries[query_start:query_start + BATCH_QUERY_BLOCK]
+            query_norms = np.einsum('ij,ij->i', query_block, query_block)
+            n_block = query_block.shape[0]
+            match_counts = np.zeros(n_block * n_people, dtype=np.intp)
+            exact_pairs = []
+
+            for gallery_start in range(0, gallery_encodings.shape[0], BATCH_GALLERY_BLOCK):
+                gallery_block = gallery_encodings[gallery_start:gallery_start + BATCH_GALLERY_BLOCK]
+                label_block = labels[gallery_start:gallery_start + BATCH_GALLERY_BLOCK]
+                norm_block = gallery_norms[gallery_start:gallery_start + BATCH_GALLERY_BLOCK]
+                squared_distances = query_norms[:, None] + norm_block[None, :] - 2 * query_block @ gallery_block.T
+                matches = squared_distances <= squared_tolerance
+
+                # Recompute borderline pairs exactly like face_recognition.face_distance
+                query_rows, gallery_rows = np.nonzero(np.abs(squared_distances - squared_tolerance) <= band)
+                if query_rows.size:
+                    distances = np.linalg.norm(gallery_block[gallery_rows] - query_block[query_rows], axis=1)
+                    matches[query_rows, gallery_rows] = distances <= MATCH_TOLERANCE
+
+                # Possible exact duplicates
+                for query_row, gallery_row in zip(*np.nonzero(squared_distances <= band)):
+                    if np.array_equal(query_block[query_row], gallery_block[gallery_row]):
+                        exact_pairs.append((query_row, label_block[gallery_row]))
+
+                # Grouped per-person count of matches for every searched encoding of the block
+                query_rows, gallery_rows = np.nonzero(matches)
+                match_counts += np.bincount(query_rows * n_people + label_block[gallery_rows],
+                                            minlength=n_block * n_people)
+
+            match_counts = match_counts.reshape(n_block, n_people)
+            not_match_counts = self._totals[None, :] - match_counts
+            for query_row, label in exact_pairs:
+                match_counts[query_row, label] = MAX_INT
+                not_match_counts[query_row, label] = 0
+
+            best, scores = self._select_best(match_counts, not_match_counts)
+            best_names.extend(self._names[label] if score else UNKNOWN_PERSON for label, score in zip(best, scores))
+            best_counts[query_start:query_start + n_block] = scores
+        return best_names, best_counts
+
+    def identify(self, encoding):
+        """
+        Find the person with the most matching encodings among those where at least 60% of their encodings match
+        (and there are more matches than not-matches).
+
+        :param encoding: Encoding of the person to identify
+        :type encoding: ndarray(128,)
+        :return: Normalized name of the best match (or UNKNOWN PERSON) and its match count
+        :rtype: str, int
+        """
+        if len(self._names) == 0:
+            return UNKNOWN_PERSON, 0
+
+        if self.ann_index is not None:
+            # Only vote over the people the ANN index considers close, trading recall for speed
+            candidate_labels = self._get_ann_candidates(self.round_trip(encoding))
+        else:
+            # Only vote over the people the centroid bounds could not rule out, this never changes the result
+            candidate_labels = self._get_prefilter_candidates(self.round_trip(encoding))
+            if len(candidate_labels) > len(self._names) // 2:
+                # Gathering the rows of most people costs more than comparing against the whole gallery
+                candidate_labels = None
+        match_counts, not_match_counts = self.compare(encoding, candidate_labels)
+        best, score = self._select_best(match_counts, not_match_counts)
+        if score == 0:
+            return UNKNOWN_PERSON, 0
+        return self._names[best], int(score)
+
+
+def get_gallery(debug=False):
+    """
+    Get the process-wide encoding gallery, loading it from the DB on first use.
+    The table is only inspected when `PRAGMA data_version` or the write generation of this process changed since the
+    last sync. Writes are then detected through the DB fingerprint, the FACE_ENCODING rowid and the row count: newly
+    appended rows are loaded incrementally, anything else (deletions, a cleared table) triggers a full reload.
+
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Gallery in sync with the FACE_ENCODING table
+    :rtype: EncodingGallery
+    """
+    global _gallery, _gallery_snapshot
+    conn = database.get_connection()
+    snapshot = (database.get_db_path(), id(conn), conn.execute("PRAGMA data_version").fetchone()[0],
+                database.get_write_generation())
+    if _gallery is None or snapshot != _gallery_snapshot:
+        _gallery = _refresh_gallery(conn, debug)
+        _gallery_snapshot = snapshot
+    if _ann_options is not None:
+        _sync_ann_index(_gallery, debug)
+    return _gallery
+
+
+def _refresh_gallery(conn, debug=False):
+    """
+    Bring the process-wide gallery in sync with the FACE_ENCODING table.
+
+    :param conn: Open connection to the DB
+    :type conn: sqlite3.Connection
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Gallery in sync with the FACE_ENCODING table
+    :rtype: EncodingGallery
+    """
+    encoding_gallery = _gallery
+    # Read before the rows, so a concurrent change can only make the gallery look older than it is
+    fingerprint = _get_db_fingerprint(conn)
+    max_rowid, row_count = conn.execute("SELECT MAX(ENCODING_ID), COUNT(*) FROM FACE_ENCODING").fetchone()
+    max_rowid = max_rowid or 0
+    precision, scale = encoding_precision.get_encoding_precision(conn)
+    if encoding_gallery is not None and (encoding_gallery.fingerprint != fingerprint
+                                         or not _has_precision(encoding_gallery, precision, scale)):
+        # Rows were deleted or rewritten (e.g. migrated to another precision), rowids cannot be trusted any more
+        encoding_gallery = None
+    if encoding_gallery is not None:
+        if len(encoding_gallery) == row_count and encoding_gallery.last_rowid == max_rowid:
+            return encoding_gallery
+        new_rows = conn.execute("SELECT ENCODING_ID, NAME, ENCODING FROM FACE_ENCODING JOIN PERSON USING (PERSON_ID) "
+                                "WHERE ENCODING_ID > ? ORDER BY ENCODING_ID", (encoding_gallery.last_rowid,)).fetchall()
+        if len(encoding_gallery) + len(new_rows) == row_count:
+            # Only appends happened since the last load
+            encoding_gallery.extend(new_rows)
+            if debug:
+                print(f'Loaded {len(new_rows)} new encodings into the gallery.')
+            return encoding_gallery
+
+    if _gallery_backend == 'memmap':
+        encoding_gallery = load_gallery_file()
+        if (encoding_gallery is None or fingerprint is None or encoding_gallery.fingerprint != fingerprint
+                or len(encoding_gallery) != row_count or encoding_gallery.last_rowid != max_rowid
+                or not _has_precision(encoding_gallery, precision, scale)):
+            # The gallery file is missing, was written for another DB state or the DB has no fingerprint to check it
+            # against, rebuild it from the DB
+            export_gallery_file(debug=debug)
+            encoding_gallery = load_gallery_file()
+    else:
+        encoding_gallery = EncodingGallery(_select_all_encodings(conn), precision, scale)
+        encoding_gallery.fingerprint = fingerprint
+    if debug:
+        print(f'Loaded {len(encoding_gallery)} encodings into the gallery ({_gallery_backend} backend).')
+    return encoding_gallery
+
+
+def _get_ann_identity(encoding_gallery):
+    """
+    Get the identity an ANN index built over a gallery is saved with: the DB path, the DB fingerprint and the precision
+    of the gallery.
+
+    :param encoding_gallery: Gallery the index is built over
+    :type encoding_gallery: EncodingGallery
+    :return: Hexadecimal SHA-256 of the identity, None if the DB has no fingerprint to identify the rows with
+    :rtype: str or None
+    """
+    if encoding_gallery.fingerprint is None:
+        return None
+    scale = None if encoding_gallery.scale is None else encoding_gallery.scale.tolist()
+    identity = json.dumps([os.path.abspath(database.get_db_path()), encoding_gallery.fingerprint,
+                           encoding_gallery.precision, scale])
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+
+def _sync_ann_index(encoding_gallery, debug=False):
+    """
+    Attach the ANN index to a gallery, loading it from get_ann_index_path(), catching it up with rows it does not cover
+    yet or rebuilding it when it was built over another gallery. A rebuilt index is saved immediately, rows added to an
+    index are saved every ANN_SAVE_INTERVAL rows and at exit.
+
+    :param encoding_gallery: Gallery to attach the index to
+    :type encoding_gallery: EncodingGallery
+    :param debug: Enable debug mode
+    :type debug: bool
+    """
+    index = encoding_gallery.ann_index
+    if index is None:
+        identity = _get_ann_identity(encoding_gallery)
+        index = IVFIndex.load(get_ann_index_path(), **_ann_options)
+        if (index is not None and identity is not None and index.identity == identity
+                and len(index) <= len(encoding_gallery) and index.last_rowid <= encoding_gallery.last_rowid):
+            # Same rows as when the index was saved, rows appended since only have to be assigned to their lists
+            index.add(encoding_gallery.encodings[len(index):], encoding_gallery.last_rowid)
+        else:
+            index = None
+    if (index is None or len(index) != len(encoding_gallery)
+            or len(encoding_gallery) > ANN_REBUILD_FACTOR * max(index.built_rows, 1)):
+        index = IVFIndex.build(encoding_gallery.encodings, encoding_gallery.last_rowid,
+                               identity=_get_ann_identity(encoding_gallery))
+        index.n_probe, index.top_k = _ann_options['n_probe'], _ann_options['top_k']
+        index.save(get_ann_index_path())
+        if debug:
+            print(f'Built an ANN index with {index.centroids.shape[0]} lists over {len(index)} encodings.')
+    encoding_gallery.ann_index = index
+    _save_ann_index()
+
+
+def _save_ann_index(at_exit=False):
+    """
+    Save the ANN index of the process-wide gallery once ANN_SAVE_INTERVAL rows were added to it, so single insertions
+    do not rewrite the whole file.
+
+    :param at_exit: Save any unsaved row, the process is exiting
+    :type at_exit: bool
+    """
+    index = None if _gallery is None else _gallery.ann_index
+    if index is None or not index.dirty or (not at_exit and index.unsaved_rows < ANN_SAVE_INTERVAL):
+        return
+    if index.identity is not None and index.identity == _get_ann_identity(_gallery):
+        # Never save over the index of another DB, e.g. after set_db_path() without a lookup since
+        index.save(get_ann_index_path())
+
+
+def _has_precision(encoding_gallery, precision, scale):
+    """
+    Check whether a gallery was decoded with a given precision and quantization scale.
+
+    :param encoding_gallery: Gallery to check
+    :type encoding_gallery: EncodingGallery
+    :param precision: Precision the DB stores its encodings at
+    :type precision: str
+    :param scale: Per-dimension scale of int8 quantized encodings
+    :type scale: ndarray(128,) or None
+    :return: True if the gallery matches the precision and scale
+    :rtype: bool
+    """
+    if encoding_gallery.precision != precision:
+        return False
+    if scale is None or encoding_gallery.scale is None:
+        return scale is None and encoding_gallery.scale is None
+    return np.array_equal(encoding_gallery.scale, scale)
+
+
+def _get_db_fingerprint(conn):
+    """
+    Get the fingerprint of the DB: its random id and the generation GALLERY_GENERATION's triggers bump whenever an
+    existing encoding is deleted or rewritten. Appending encodings keeps the fingerprint.
+
+    :param conn: Open connection to the DB
+    :type conn: sqlite3.Connection
+    :return: '<DB id>:<generation>', None for DBs created before schema v3
+    :rtype: str or None
+    """
+    try:
+        row = conn.execute("SELECT DB_ID, GENERATION FROM GALLERY_GENERATION").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    if row is None:
+        return None
+    return f'{row[0]}:{row[1]}'
+
+
+def _select_all_encodings(conn):
+    """
+    Read every row of the FACE_ENCODING table.
+
+    :param conn: Open connection to the DB
+    :type conn: sqlite3.Connection
+    :return: (rowid, name, encoding) rows ordered by rowid
+    :rtype: list(tuple(int, str, memoryview))
+    """
+    return conn.execute("SELECT ENCODING_ID, NAME, ENCODING FROM FACE_ENCODING JOIN PERSON USING (PERSON_ID) "
+                        "ORDER BY ENCODING_ID").fetchall()
+
+
+def record_encoding(rowid, name, encoding):
+    """
+    Add an encoding that was just inserted into FACE_ENCODING to the loaded gallery (if any).
+
+    :param rowid: Rowid of the inserted FACE_ENCODING row
+    :type rowid: int
+    :param name: Normalized name of the person
+    :type name: str
+    :param encoding: Encoding of the person
+    :type encoding: memoryview or bytes or ndarray(128,)
+    """
+    if _gallery is not None and rowid > _gallery.last_rowid:
+        _gallery.extend([(rowid, name, encoding)])
+        _save_ann_index()
+
+
+def invalidate_gallery():
+    """
+    Drop the loaded gallery so the next lookup reloads it from the DB (e.g. after the DB was cleared).
+    """
+    global _gallery
+    _gallery = None
+
+
+def set_gallery_backend(backend):
+    """
+    Select where the gallery loads its encoding matrix from.
+    'sqlite' decodes the FACE_ENCODING table into private memory.
+    'memmap' maps the gallery file at get_gallery_file_path(), so processes on the same machine share the same pages
+    through the OS page cache. The file is derived from the DB and rebuilt automatically whenever it is out of date.
+
+    :param backend: One of GALLERY_BACKENDS
+    :type backend: str
+    """
+    global _gallery_backend
+    if backend not in GALLERY_BACKENDS:
+        raise ValueError(f'Unknown gallery backend "{backend}". Supported backends: {list(GALLERY_BACKENDS)}')
+    if backend != _gallery_backend:
+        _gallery_backend = backend
+        invalidate_gallery()
+
+
+def set_ann_search(enabled=True, n_probe=DEFAULT_N_PROBE, top_k=DEFAULT_TOP_K):
+    """
+    Route lookups through the approximate nearest-neighbour index stored at get_ann_index_path(). Only the `top_k`
+    people owning the closest encodings found in the `n_probe` closest lists go through the exact voting, so raising
+    `n_probe` and `top_k` improves recall at the cost of latency.
+
+    :param enabled: Whether lookups use the ANN index
+    :type enabled: bool
+    :param n_probe: Number of index lists scanned per lookup
+    :type n_probe: int
+    :param top_k: Number of candidate people passed to the exact voting
+    :type top_k: int
+    """
+    global _ann_options
+    if enabled and _ann_options is None:
+        atexit.register(_save_ann_index, at_exit=True)
+    elif not enabled and _ann_options is not None:
+        atexit.unregister(_save_ann_index)
+    _ann_options = {'n_probe': n_probe, 'top_k': top_k} if enabled else None
+    if _gallery is not None:
+        if enabled and _gallery.ann_index is not None:
+            _gallery.ann_index.n_probe, _gallery.ann_index.top_k = n_probe, top_k
+        elif not enabled:
+            _gallery.ann_index = None
+
+
+def _get_derived_path(suffix):
+    """
+    Get the path of a file derived from the DB. It lives next to the DB file and is named after it, so every DB has
+    its own derived files.
+
+    :param suffix: Suffix appended to the DB path without its extension
+    :type suffix: str
+    :return: '<DB path without extension><suffix>', e.g. './hw2_gallery.npy' for './hw2.db'
+    :rtype: str
+    """
+    return f'{os.path.splitext(database.get_db_path())[0]}{suffix}'
+
+
+def get_gallery_file_path():
+    """
+    Get the path of the memory-mapped gallery file of the DB.
+
+    :return: Path of the .npy gallery file
+    :rtype: str
+    """
+    return _get_derived_path(GALLERY_FILE_SUFFIX)
+
+
+def get_ann_index_path():
+    """
+    Get the path of the saved ANN index of the DB.
+
+    :return: Path of the .npz index file
+    :rtype: str
+    """
+    return _get_derived_path(ANN_INDEX_SUFFIX)
+
+
+def _get_index_path(file_path):
+    """
+    Get the path of the sidecar index (names, rowid, precision and DB fingerprint) belonging to a gallery file.
+
+    :param file_path: Path of the gallery file
+    :type file_path: str
+    :return: Path of the sidecar index
+    :rtype: str
+    """
+    return f'{os.path.splitext(file_path)[0]}.json'
+
+
+def _get_labels_path(file_path):
+    """
+    Get the path of the .npy label array belonging to a gallery file.
+
+    :param file_path: Path of the gallery file
+    :type file_path: str
+    :return: Path of the label array
+    :rtype: str
+    """
+    return f'{os.path.splitext(file_path)[0]}_labels.npy'
+
+
+def export_gallery_file(file_path=None, debug=False):
+    """
+    Write every encoding of the DB into a flat .npy matrix, the label of every row into a parallel .npy array and a
+    sidecar JSON index holding the names, the last exported rowid, the storage precision and the DB fingerprint. Every
+    file is replaced atomically and the index last, so processes that already mapped the previous files keep a
+    consistent view.
+
+    :param file_path: Path of the .npy gallery file to write. Default is get_gallery_file_path().
+    :type file_path: str or None
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Number of exported encodings
+    :rtype: int
+    """
+    file_path = file_path or get_gallery_file_path()
+    conn = database.get_connection()
+    fingerprint = _get_db_fingerprint(conn)
+    precision, scale = encoding_precision.get_encoding_precision(conn)
+    exported = EncodingGallery(_select_all_encodings(conn), precision, scale)
+
+    labels_path = _get_labels_path(file_path)
+    index_path = _get_index_path(file_path)
+    with open(f'{file_path}.tmp', 'wb') as matrix_file:
+        np.save(matrix_file, exported.encodings)
+    with open(f'{labels_path}.tmp', 'wb') as labels_file:
+        np.save(labels_file, exported.labels)
+    with open(f'{index_path}.tmp', 'w') as index_file:
+        json.dump({'names': exported.names, 'rows': len(exported), 'last_rowid': exported.last_rowid,
+                   'precision': precision, 'scale': None if scale is None else scale.tolist(),
+                   'fingerprint': fingerprint}, index_file)
+    os.replace(f'{file_path}.tmp', file_path)
+    os.replace(f'{labels_path}.tmp', labels_path)
+    os.replace(f'{index_path}.tmp', index_path)
+    if debug:
+        print(f'Exported {len(exported)} encodings to "{file_path}".')
+    return len(exported)
+
+
+def load_gallery_file(file_path=None):
+    """
+    Memory-map a gallery file and its label array written by export_gallery_file. No encoding or label is parsed or
+    copied.
+
+    :param file_path: Path of the .npy gallery file. Default is get_gallery_file_path().
+    :type file_path: str or None
+    :return: Gallery backed by the mapped file or None if the file is missing or incomplete
+    :rtype: EncodingGallery or None
+    """
+    file_path = file_path or get_gallery_file_path()
+    labels_path = _get_labels_path(file_path)
+    index_path = _get_index_path(file_path)
+    if not all(os.path.exists(path) for path in (file_path, labels_path, index_path)):
+        return None
+    with open(index_path, 'r') as index_file:
+        index = json.load(index_file)
+    if 'rows' not in index:
+        # Written before the labels moved out of the index
+        return None
+    encodings = np.load(file_path, mmap_mode='r')
+    labels = np.load(labels_path, mmap_mode='r')
+    if encodings.shape[0] != index['rows'] or labels.shape[0] != index['rows']:
+        # The index, labels and matrix were written by different exports
+        return None
+    scale = index['scale']
+    return EncodingGallery.from_arrays(encodings, labels, index['names'], index['last_rowid'], index['precision'],
+                                       None if scale is None else np.array(scale, dtype=np.float64),
+                                       index['fingerprint'])
+
+
+def import_gallery_file(file_path, source='gallery', debug=False):
+    """
+    Add every encoding of a gallery file written by export_gallery_file (e.g. on another machine) to the DB, in a
+    single transaction. Encodings are converted to the precision of the DB, people missing from the DB are added.
+
+    :param file_path: Path of the .npy gallery file
+    :type file_path: str
+    :param source: Source recorded for the imported encodings
+    :type source: str
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Number of imported encodings
+    :rtype: int
+    """
+    imported = load_gallery_file(file_path)
+    if imported is None:
+        raise FileNotFoundError(f'No complete gallery file at "{file_path}".')
+    file_name = os.path.basename(file_path)
+    with database.transaction() as conn:
+        precision, scale = encoding_precision.get_encoding_precision(conn)
+        person_ids = []
+        for name in imported.names:
+            directory = f'./images/{name}'
+            os.makedirs(directory, exist_ok=True)
+            conn.execute("INSERT OR IGNORE INTO PERSON (NAME, DIRECTORY, ENCODING_COUNT) VALUES (?, ?, 0)",
+                         (name, directory))
+            person_ids.append(conn.execute("SELECT PERSON_ID FROM PERSON WHERE NAME = ?", (name,)).fetchone()[0])
+        encoding_rows = []
+        for row, (encoding, label) in enumerate(zip(imported.encodings, imported.labels)):
+            encoding = conversions.encode_ndarray_to_memoryview(encoding, precision, scale).tobytes()
+            # Gallery files do not keep the image names, the row of the encoding in the file identifies it instead
+            encoding_rows.append((person_ids[label], encoding, f'{file_name}:{row}', source))
+        conn.executemany("INSERT INTO FACE_ENCODING (PERSON_ID, ENCODING, FILE_NAME, SOURCE) VALUES (?, ?, ?, ?)",
+                         encoding_rows)
+        counts = np.bincount(imported.labels, minlength=len(imported.names))
+        conn.executemany("UPDATE PERSON SET ENCODING_COUNT = ENCODING_COUNT + ? WHERE PERSON_ID = ?",
+                         [(int(count), person_id) for person_id, count in zip(person_ids, counts) if count])
+    if debug:
+        print(f'Imported {len(imported)} encodings from "{file_path}".')
+    return len(imported)
+
+
+def delete_gallery_file(file_path=None):
+    """
+    Delete a gallery file, its label array and its sidecar index (e.g. after the DB was cleared).
+
+    :param file_path: Path of the .npy gallery file. Default is get_gallery_file_path().
+    :type file_path: str or None
+    """
+    file_path = file_path or get_gallery_file_path()
+    for path in (file_path, _get_labels_path(file_path), _get_index_path(file_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    # `python3 -m src.gallery [gallery_file]` rebuilds the memory-mapped gallery file from the DB,
+    # `python3 -m src.gallery import <gallery_file>` adds the encodings of a gallery file to the DB
+    if len(sys.argv) > 2 and sys.argv[1] == 'import':
+        import_gallery_file(sys.argv[2], debug=True)
+    else:
+        export_gallery_file(sys.argv[1] if len(sys.argv) > 1 else None, debug=True)
@@ -0,0 +1,132 @@
+"""
+Pre-processing stage of face detection and encoding. An image is decoded once, directly at a reduced scale when the
+format allows it (JPEG DCT scaling through PIL's draft mode), downscaled to a maximum dimension and converted in memory,
+so HOG detection never runs on full-resolution phone photos and no intermediate file is written to disk.
+Faces are still encoded in the full-resolution image (see downscale_image and scale_location), like the encodings
+already stored in the DB.
+"""
+
+from collections import namedtuple
+
+import numpy
+from PIL import Image
+
+__all__ = ['load_image', 'downscale_image', 'scale_location', 'set_max_dimension', 'PreprocessedImage', 'MAX_DIMENSION']
+
+MAX_DIMENSION = 1024  # Longest side of the images handed to face detection, in pixels
+
+# Image ready for face_recognition: array is an (height, width, 3) uint8 RGB array, original_size is (width, height)
+PreprocessedImage = namedtuple('PreprocessedImage', ['array', 'original_size'])
+
+_options = {'max_dimension': MAX_DIMENSION}
+
+
+def set_max_dimension(max_dimension=MAX_DIMENSION):
+    """
+    Set the longest side images are downscaled to before face detection.
+
+    :param max_dimension: Longest side of the pre-processed images in pixels, 0 to keep the full resolution
+    :type max_dimension: int
+    """
+    _options['max_dimension'] = max_dimension
+
+
+def load_image(file_path, max_dimension=None, grayscale=True):
+    """
+    Decode an image at reduced size and convert it in memory to the array face_recognition expects.
+
+    :param file_path: Path to the image
+    :type file_path: str
+    :param max_dimension: Longest side of the pre-processed image in pixels, 0 to keep the full resolution.
+                          Default is the value set with set_max_dimension.
+    :type max_dimension: int or None
+    :param grayscale: Whether the image is converted to grayscale (still as an RGB array)
+    :type grayscale: bool
+    :return: Pre-processed image
+    :rtype: PreprocessedImage
+    """
+    mode = 'L' if grayscale else 'RGB'
+    with Image.open(file_path) as img:
+        original_size = img.size
+        target_size = _get_target_size(original_size, max_dimension)
+        if target_size is not None:
+            # JPEG images are decoded at 1/2, 1/4 or 1/8 scale, never below the requested size
+            img.draft(mode, target_size)
+            img = _resize(img, target_size)
+        array = numpy.asarray(img.convert(mode).convert('RGB'))
+    return PreprocessedImage(array, original_size)
+
+
+def downscale_image(image, max_dimension=None):
+    """
+    Downscale an image that was loaded at full resolution, e.g. to find faces in it while encoding them in the
+    full-resolution image.
+
+    :param image: Image loaded by load_image with a max_dimension of 0
+    :type image: PreprocessedImage
+    :param max_dimension: Longest side of the downscaled image in pixels, 0 to keep the full resolution.
+                          Default is the value set with set_max_dimension.
+    :type max_dimension: int or None
+    :return: Downscaled image, `image` itself if it is already small enough
+    :rtype: PreprocessedImage
+    """
+    target_size = _get_target_size((image.array.shape[1], image.array.shape[0]), max_dimension)
+    if target_size is None:
+        return image
+    array = numpy.asarray(_resize(Image.fromarray(image.array), target_size))
+    return PreprocessedImage(array, image.original_size)
+
+
+def _get_target_size(size, max_dimension=None):
+    """
+    Compute the size an image is downscaled to.
+
+    :param size: (width, height) of the image
+    :type size: tuple(int, int)
+    :param max_dimension: Longest side of the downscaled image in pixels, 0 to keep the full resolution.
+                          Default is the value set with set_max_dimension.
+    :type max_dimension: int or None
+    :return: (width, height) of the downscaled image, None if the image is not downscaled
+    :rtype: tuple(int, int) or None
+    """
+    if max_dimension is None:
+        max_dimension = _options['max_dimension']
+    if not max_dimension or max(size) <= max_dimension:
+        return None
+    ratio = max_dimension / max(size)
+    return max(1, round(size[0] * ratio)), max(1, round(size[1] * ratio))
+
+
+def _resize(img, target_size):
+    """
+    Resize an image to a smaller size.
+
+    :param img: Image to resize
+    :type img: PIL.Image.Image
+    :param target_size: (width, height) to resize the image to
+    :type target_size: tuple(int, int)
+    :return: Resized image
+    :rtype: PIL.Image.Image
+    """
+    factor = min(img.size[0] // target_size[0], img.size[1] // target_size[1])
+    if factor > 1:
+        # Cheap box reduction by an integer factor before the final, higher quality resampling
+        img = img.reduce(factor)
+    return img.resize(target_size, Image.LANCZOS)
+
+
+def scale_location(location, image):
+    """
+    Scale a face location found in a pre-processed image back to the coordinates of the original image.
+
+    :param location: (top, right, bottom, left) location in the pre-processed image, as face_recognition returns it
+    :type location: tuple(int, int, int, int)
+    :param image: Pre-processed image the location was found in
+    :type image: PreprocessedImage
+    :return: (top, right, bottom, left) location in the original image
+    :rtype: tuple(int, int, int, int)
+    """
+    scale_x = image.original_size[0] / image.array.shape[1]
+    scale_y = image.original_size[1] / image.array.shape[0]
+    top, right, bottom, left = location
+    return round(top * scale_y), round(right * scale_x), round(bottom * scale_y), round(left * scale_x)
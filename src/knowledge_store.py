@@ -0,0 +1,254 @@
+"""
+Local copy of the DBpedia ontology properties for offline, low-latency entity search.
+A DBpedia dump in N-Triples format (optionally .bz2 or .gz compressed) is streamed into an SQLite triple table with a
+unique (subject, predicate, object) index, which call_dbpedia answers from instead of the SPARQL endpoint once the store
+is enabled. Importing the same dump again adds nothing:
+`python3 -m src.knowledge_store <mappingbased-objects.ttl.bz2> [more dumps...]`
+"""
+
+import bz2
+import gzip
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+__all__ = ['import_ntriples', 'get_answers', 'enable_knowledge_store', 'disable_knowledge_store', 'is_enabled',
+           'KNOWLEDGE_STORE_PATH']
+
+
+KNOWLEDGE_STORE_PATH = './dbpedia.db'
+ONTOLOGY_PREFIX = 'http://dbpedia.org/ontology/'
+IMPORT_BATCH_SIZE = 100000  # Triples staged per transaction during an import
+IMPORT_SUFFIX = '.import'  # Suffix of the scratch file triples are staged in during an import
+
+# <subject> <predicate> object .
+TRIPLE_PATTERN = re.compile(r'^<([^>]*)>\s+<([^>]*)>\s+(.*?)\s*\.\s*$')
+# "lexical form" optionally followed by @language or ^^<datatype>
+LITERAL_PATTERN = re.compile(r'^"(.*)"(?:@[A-Za-z0-9-]+|\^\^<[^>]*>)?$')
+ESCAPE_PATTERN = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+ESCAPES = {'t': '\t', 'b': '\b', 'n': '\n', 'r': '\r', 'f': '\f', '"': '"', "'": "'", '\\': '\\'}
+
+_store_path = None  # Path of the enabled store, None when answers come from the SPARQL endpoint
+_local = threading.local()  # Read-only connection of the current thread
+
+
+def _unescape(match):
+    """
+    Replace an N-Triples escape sequence by the character it stands for.
+
+    :param match: Match of ESCAPE_PATTERN
+    :type match: re.Match
+    :return: Unescaped character
+    :rtype: str
+    """
+    code_point = match.group(1) or match.group(2)
+    if code_point is not None:
+        return chr(int(code_point, 16))
+    return ESCAPES.get(match.group(3), match.group(3))
+
+
+def _parse_object(term):
+    """
+    Convert the object of a triple to the value the SPARQL endpoint returns for it.
+
+    :param term: IRI (`<...>`) or literal (`"..."`, optionally with a language tag or datatype) of the triple
+    :type term: str
+    :return: IRI or lexical form of the literal, None for blank nodes or malformed terms
+    :rtype: str or None
+    """
+    if term.startswith('<') and term.endswith('>'):
+        return term[1:-1]
+    literal = LITERAL_PATTERN.match(term)
+    if literal is None:
+        return None
+    return ESCAPE_PATTERN.sub(_unescape, literal.group(1))
+
+
+def _open_dump(file_path):
+    """
+    Open a dump for streaming, decompressing it on the fly.
+
+    :param file_path: Path of an .nt/.ttl file, optionally .bz2 or .gz compressed
+    :type file_path: str
+    :return: Text stream of the dump
+    :rtype: io.TextIOBase
+    """
+    if file_path.endswith('.bz2'):
+        return bz2.open(file_path, 'rt', encoding='utf-8')
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'rt', encoding='utf-8')
+    return open(file_path, 'r', encoding='utf-8')
+
+
+def import_ntriples(file_path, store_path=KNOWLEDGE_STORE_PATH, debug=False):
+    """
+    Stream the DBpedia ontology triples of an N-Triples dump into the store. The dump is never loaded into memory as a
+    whole. Triples whose predicate is not a DBpedia ontology property are skipped, and so are triples already in the
+    store. Triples are staged unindexed in a scratch file, then merged into the store in a single transaction, so an
+    interrupted import leaves the store as it was.
+
+    :param file_path: Path of an .nt/.ttl file, optionally .bz2 or .gz compressed
+    :type file_path: str
+    :param store_path: Path of the store to add the triples to
+    :type store_path: str
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Number of triples added to the store
+    :rtype: int
+    """
+    import_path = f'{store_path}{IMPORT_SUFFIX}'
+    if os.path.exists(import_path):
+        os.remove(import_path)  # Left over by an interrupted import
+    conn = sqlite3.connect(store_path, isolation_level=None)
+    try:
+        conn.execute('''CREATE TABLE IF NOT EXISTS TRIPLE
+                        (SUBJECT      TEXT    NOT NULL,
+                         PREDICATE    TEXT    NOT NULL,
+                         OBJECT       TEXT    NOT NULL);''')
+        _create_unique_index(conn, debug)
+
+        # The scratch file is thrown away if anything fails, so it needs no journal and no fsync
+        conn.execute("ATTACH DATABASE ? AS STAGING", (import_path,))
+        conn.execute("PRAGMA STAGING.journal_mode=OFF")
+        conn.execute("PRAGMA STAGING.synchronous=OFF")
+        conn.execute('''CREATE TABLE STAGING.TRIPLE
+                        (SUBJECT      TEXT    NOT NULL,
+                         PREDICATE    TEXT    NOT NULL,
+                         OBJECT       TEXT    NOT NULL);''')
+
+        staged = 0
+        batch = []
+        with _open_dump(file_path) as dump:
+            for line in dump:
+                triple = TRIPLE_PATTERN.match(line)
+                if triple is None or not triple.group(2).startswith(ONTOLOGY_PREFIX):
+                    continue
+                answer = _parse_object(triple.group(3))
+                if answer is None:
+                    continue
+                batch.append((triple.group(1), triple.group(2)[len(ONTOLOGY_PREFIX):], answer))
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    staged += _insert_triples(conn, batch)
+                    batch = []
+                    if debug:
+                        print(f'Read {staged} triples...', end='\r')
+        staged += _insert_triples(conn, batch)
+
+        if debug:
+            print(f'\nMerging {staged} triples into the store...')
+        conn.execute("BEGIN")
+        # In dump order, so answers keep the order of the dump
+        imported = conn.execute("INSERT OR IGNORE INTO main.TRIPLE (SUBJECT, PREDICATE, OBJECT) "
+                                "SELECT SUBJECT, PREDICATE, OBJECT FROM STAGING.TRIPLE ORDER BY rowid").rowcount
+        conn.execute("COMMIT")
+        conn.execute("DETACH DATABASE STAGING")
+    finally:
+        conn.close()
+        if os.path.exists(import_path):
+            os.remove(import_path)
+    print(f'Imported {imported} new triples from "{file_path}" into "{store_path}" '
+          f'({staged - imported} already in the store).')
+    return imported
+
+
+def _create_unique_index(conn, debug=False):
+    """
+    Create the unique (subject, predicate, object) index of the store. Stores written before the index existed are
+    deduplicated first and lose their (subject, predicate) index, which the unique index replaces.
+
+    :param conn: Open connection to the store
+    :type conn: sqlite3.Connection
+    :param debug: Enable debug mode
+    :type debug: bool
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'TRIPLE_UNIQUE'").fetchone()
+    if exists is not None:
+        return
+    conn.execute("BEGIN")
+    removed = conn.execute("DELETE FROM TRIPLE WHERE rowid NOT IN "
+                           "(SELECT MIN(rowid) FROM TRIPLE GROUP BY SUBJECT, PREDICATE, OBJECT)").rowcount
+    conn.execute("DROP INDEX IF EXISTS TRIPLE_SUBJECT_PREDICATE")
+    conn.execute("CREATE UNIQUE INDEX TRIPLE_UNIQUE ON TRIPLE (SUBJECT, PREDICATE, OBJECT)")
+    conn.execute("COMMIT")
+    if debug and removed:
+        print(f'Removed {removed} duplicate triples from the store.')
+
+
+def _insert_triples(conn, triples):
+    """
+    Stage a batch of triples in a single transaction.
+
+    :param conn: Open connection to the store, with the scratch file attached as STAGING
+    :type conn: sqlite3.Connection
+    :param triples: (subject, ontology property, answer) triples
+    :type triples: list(tuple(str, str, str))
+    :return: Number of staged triples
+    :rtype: int
+    """
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO STAGING.TRIPLE (SUBJECT, PREDICATE, OBJECT) VALUES (?, ?, ?)", triples)
+    conn.execute("COMMIT")
+    return len(triples)
+
+
+def enable_knowledge_store(store_path=KNOWLEDGE_STORE_PATH):
+    """
+    Answer DBpedia questions from a local store instead of the SPARQL endpoint.
+
+    :param store_path: Path of a store written by import_ntriples
+    :type store_path: str
+    """
+    global _store_path
+    if not os.path.exists(store_path):
+        raise FileNotFoundError(f'Knowledge store "{store_path}" does not exist. Import a DBpedia dump first.')
+    _store_path = store_path
+
+
+def disable_knowledge_store():
+    """
+    Answer DBpedia questions from the SPARQL endpoint again.
+    """
+    global _store_path
+    _store_path = None
+
+
+def is_enabled():
+    """
+    Check whether DBpedia questions are answered from the local store.
+
+    :return: True if the local store is enabled
+    :rtype: bool
+    """
+    return _store_path is not None
+
+
+def get_answers(subject, question):
+    """
+    Answer a question about a subject from the local store, the same way the SPARQL endpoint would.
+
+    :param subject: Full URI of the subject resource
+    :type subject: str
+    :param question: DBO (biographical) tag
+    :type question: str
+    :return: Answers of the question, ['UNKNOWN'] if the store has none
+    :rtype: list(str)
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.store_path != _store_path:
+        conn = sqlite3.connect(f'file:{_store_path}?mode=ro', uri=True)
+        _local.conn, _local.store_path = conn, _store_path
+    rows = conn.execute("SELECT OBJECT FROM TRIPLE WHERE SUBJECT = ? AND PREDICATE = ? ORDER BY rowid",
+                        (subject, question)).fetchall()
+    if len(rows) == 0:
+        return ['UNKNOWN']
+    return [row[0] for row in rows if row[0] != '']
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python3 -m src.knowledge_store <dump.nt[.bz2|.gz]> [more dumps...]')
+        sys.exit(1)
+    for dump_path in sys.argv[1:]:
+        import_ntriples(dump_path, debug=True)
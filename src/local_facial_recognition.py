@@ -4,7 +4,6 @@ This file handles all the local facial recognition functionality.
 
 import time
 import os
-import sqlite3
 from shutil import copyfile
 from collections import namedtuple
 from numpy import array_equal
@@ -12,13 +11,17 @@ from numpy import array_equal
 import face_recognition
 
 from src import conversions
+from src import database
+from src import encoding_precision
+from src import gallery
+from src import image_preprocessing
+from src.gallery import MATCH_TOLERANCE, MAX_INT, UNKNOWN_PERSON
 
 CompareResult = namedtuple('CompareResult', ['matchCount', 'notMatchCount'])
 __all__ = ['get_person_db_encodings', 'save_image', 'save_face_encoding', 'generate_face_encoding',
-           'get_person_directory', 'compare_encoding_to_person', 'identify_person_from_encoding', 'CompareResult']
-
-
-MAX_INT = 99999999
+           'get_person_directory', 'compare_encoding_to_person', 'identify_person_from_encoding',
+           'identify_people_from_encodings', 'get_or_add_person_id', 'generate_face_encodings',
+           'locate_and_encode_faces', 'CompareResult']
 
 
 def get_person_db_encodings(name, debug=False):
@@ -33,24 +36,12 @@ def get_person_db_encodings(name, debug=False):
     :rtype: list(nd_array)
     """
 
-    conn = sqlite3.connect('./hw2.db')
-    cursor = conn.cursor()
-    if conn:
-        # Collect all encodings for the person
-        normalized_name = conversions.get_normalized_name(name)
-        query = f"SELECT ENCODING FROM NAME_ENCODING WHERE NAME = '{normalized_name}'"
-        cursor.execute(query)
-        conn.commit()
-
-        # Convert the encodings from strings to ndarrays and return them
-        rows = cursor.fetchall()
-        encodings = [conversions.decode_memoryview_to_ndarray(row[0]) for row in rows]
-        if debug:
-            print(f'Found {len(encodings)} encodings for {name}')
-        return encodings
+    # Collect all encodings for the person from the in-memory gallery rather than re-reading the table
+    normalized_name = conversions.get_normalized_name(name)
+    encodings = gallery.get_gallery(debug).get_person_encodings(normalized_name)
     if debug:
-        print("Failed to connect to database.")
-    return []
+        print(f'Found {len(encodings)} encodings for {name}')
+    return encodings
 
 
 def add_to_db(file_location, encoding, name, source='user'):
@@ -70,8 +61,10 @@ def add_to_db(file_location, encoding, name, source='user'):
     :rtype: bool
     """
     new_file_name, _ = generate_file_name_strenc(file_location, encoding)
-    save_image(file_location, name, new_file_name)
-    result = save_face_encoding(encoding, name, file_location, source)
+    with database.transaction():
+        # The person, the encoding and the encoding count are committed together
+        save_image(file_location, name, new_file_name)
+        result = save_face_encoding(encoding, name, new_file_name, source)
     return result
 
 
@@ -88,40 +81,50 @@ def save_image(file_location, name, new_file_name):
     """
 
     normalized_name = conversions.get_normalized_name(name)
-    output_directory = f'./images/{normalized_name}'
-    conn = sqlite3.connect('./hw2.db')
-    cursor = conn.cursor()
-    if conn:
-        # Check if the person exists in the database
-        query = f"SELECT NAME FROM NAME_DIRECTORY WHERE NAME = '{normalized_name}'"
-        cursor.execute(query)
-        conn.commit()
-        row = cursor.fetchone()
-        if row is None:
-            # Person is not in the database
-            # If name not in NAME_DIRECTORY create a directory and add it to the table
-            if not os.path.exists('./images'):
-                os.mkdir('./images')
-            if not os.path.exists(output_directory):
-                # Create the directory if it doesn't exist -- It shouldn't!
-                os.mkdir(output_directory)
-
-            # Add initial reference to person
-            conn.execute("INSERT INTO NAME_DIRECTORY (NAME, DIRECTORY, ENCODING_COUNT) VALUES (?, ?, ?)",
-                         (normalized_name, output_directory, 0))
-            conn.commit()
-        conn.close()
-    out_file = f'{output_directory}/{new_file_name}'
+    with database.transaction() as conn:
+        get_or_add_person_id(conn, normalized_name)
+    out_file = f'./images/{normalized_name}/{new_file_name}'
     copyfile(file_location, out_file)
 
 
+def get_or_add_person_id(conn, normalized_name):
+    """
+    Get the PERSON_ID of a person, adding the person and creating their image directory if they are not in the DB yet
+
+    :param conn: Connection with an open transaction
+    :type conn: sqlite3.Connection
+    :param normalized_name: Normalized name of the person
+    :type normalized_name: str
+    :return: PERSON_ID of the person
+    :rtype: int
+    """
+    # Check if the person exists in the database
+    row = conn.execute("SELECT PERSON_ID FROM PERSON WHERE NAME = ?", (normalized_name,)).fetchone()
+    if row is not None:
+        return row[0]
+
+    # Person is not in the database
+    # If name not in PERSON create a directory and add it to the table
+    output_directory = f'./images/{normalized_name}'
+    if not os.path.exists('./images'):
+        os.mkdir('./images')
+    if not os.path.exists(output_directory):
+        # Create the directory if it doesn't exist -- It shouldn't!
+        os.mkdir(output_directory)
+
+    # Add initial reference to person
+    cursor = conn.execute("INSERT INTO PERSON (NAME, DIRECTORY, ENCODING_COUNT) VALUES (?, ?, ?)",
+                          (normalized_name, output_directory, 0))
+    return cursor.lastrowid
+
+
 def save_face_encoding(encoding, name, file_name, source='user'):
     """
     Provided a face encoding and the name of the person in the image, save the encoding to that corresponding person's
     encoding set
 
     :param encoding: Face encoding generated by face_recognition.face_encodings()
-    :type encoding: memoryview
+    :type encoding: memoryview or ndarray(128,)
     :param name: Name of the person in the image
     :type name: str
     :param file_name: Name of the file the encoding was generated from (Example: George_W_Bush_0525.jpg)
@@ -134,27 +137,22 @@ def save_face_encoding(encoding, name, file_name, source='user'):
     """
 
     normalized_name = conversions.get_normalized_name(name)
-    conn = sqlite3.connect('./hw2.db')
-    if conn:
-        cursor = conn.cursor()
-        encoding = encoding.tobytes()  # Convert memoryview to a byte string
+    with database.transaction() as conn:
+        # Convert the encoding to a byte string at the precision the DB stores its encodings at
+        precision, scale = encoding_precision.get_encoding_precision(conn)
+        encoding = conversions.decode_memoryview_to_ndarray(encoding)
+        encoding = conversions.encode_ndarray_to_memoryview(encoding, precision, scale).tobytes()
 
         # Add the encoding to the database
-        cursor.execute("INSERT INTO NAME_ENCODING (NAME, ENCODING, FILE_NAME, SOURCE) VALUES (?, ?, ?, ?)",
-                       (normalized_name, encoding, file_name, source))
-        conn.commit()
+        person_id = get_or_add_person_id(conn, normalized_name)
+        cursor = conn.execute("INSERT INTO FACE_ENCODING (PERSON_ID, ENCODING, FILE_NAME, SOURCE) VALUES (?, ?, ?, ?)",
+                              (person_id, encoding, file_name, source))
 
         # Increment the encoding count for the person
-        cursor.execute("SELECT ENCODING_COUNT FROM NAME_DIRECTORY WHERE NAME=?", (normalized_name,))
-        row = cursor.fetchone()
-        if row is not None:
-            encoding_count = row[0] + 1
-            cursor.execute("UPDATE NAME_DIRECTORY SET ENCODING_COUNT=? WHERE NAME=?",
-                           (encoding_count, normalized_name))
-            conn.commit()
-        conn.close()
-        return True
-    return False
+        conn.execute("UPDATE PERSON SET ENCODING_COUNT = ENCODING_COUNT + 1 WHERE PERSON_ID = ?", (person_id,))
+        # Only show the encoding to lookups once it is committed
+        database.call_after_commit(lambda: gallery.record_encoding(cursor.lastrowid, normalized_name, encoding))
+    return True
 
 
 def generate_file_name_strenc(file_location, encoding):
@@ -193,24 +191,63 @@ def generate_face_encoding(file_location, name='', source='user', debug=False):
     :rtype: list(float)
     """
 
-    image = face_recognition.load_image_file(file_location)
-
-    try:
-        encoding = face_recognition.face_encodings(image)[0]
-    except IndexError:
+    _, encodings = locate_and_encode_faces(file_location)
+    if len(encodings) == 0:
         return []
+    encoding = encodings[0]
 
     if name != '':
         # If a name is provided, save the encoding into the DB
         file_name, str_encoding = generate_file_name_strenc(file_location, encoding)
-        save_image(file_location, name, file_name)
-        save_result = save_face_encoding(str_encoding, name, file_name, source)
+        with database.transaction():
+            save_image(file_location, name, file_name)
+            save_result = save_face_encoding(str_encoding, name, file_name, source)
         if debug:
             print(f'Encoding for "{name}" saved successfully: {save_result}')
 
     return encoding
 
 
+def generate_face_encodings(file_location, debug=False):
+    """
+    Provided the path to an image, find every face in it and generate their facial encodings in one pass.
+
+    :param file_location: Path of a file (including file name) to generate facial encodings
+    :type file_location: str
+    :param debug: If True, print debug statements
+    :type debug: bool
+    :return: Location of every face as (top, right, bottom, left) pixels of the original image and their
+             128-dimensional face encodings
+    :rtype: list(tuple(int, int, int, int)), list(ndarray(128,))
+    """
+    locations, encodings = locate_and_encode_faces(file_location)
+    if debug:
+        print(f'Found {len(locations)} faces in "{file_location}".')
+    return locations, encodings
+
+
+def locate_and_encode_faces(file_location, grayscale=True):
+    """
+    Find every face of an image in its pre-processed (downscaled) copy, then encode the faces in the full-resolution
+    image. Encodings of a downscaled face are farther from the encodings stored in the DB, which were all generated at
+    full resolution.
+
+    :param file_location: Path of a file (including file name) to generate facial encodings
+    :type file_location: str
+    :param grayscale: Whether the image is converted to grayscale before detection and encoding
+    :type grayscale: bool
+    :return: Location of every face as (top, right, bottom, left) pixels of the original image and their
+             128-dimensional face encodings
+    :rtype: list(tuple(int, int, int, int)), list(ndarray(128,))
+    """
+    image = image_preprocessing.load_image(file_location, max_dimension=0, grayscale=grayscale)
+    detection_image = image_preprocessing.downscale_image(image)
+    locations = [image_preprocessing.scale_location(location, detection_image)
+                 for location in face_recognition.face_locations(detection_image.array)]
+    encodings = face_recognition.face_encodings(image.array, known_face_locations=locations)
+    return locations, encodings
+
+
 def get_person_directory(name):
     """
     Given a name, retrieve the directory of that person
@@ -220,17 +257,10 @@ def get_person_directory(name):
     :return: Directory of the person
     :rtype: str or None
     """
-    conn = sqlite3.connect('./hw2.db')
-    cursor = conn.cursor()
-    if conn:
-        # Check if the person exists in the database
-        query = f"SELECT DIRECTORY FROM NAME_DIRECTORY WHERE NAME = '{name}'"
-        cursor.execute(query)
-        conn.commit()
-        row = cursor.fetchone()
-        if row is not None:
-            return row[0]
-        conn.close()
+    # Check if the person exists in the database
+    row = database.get_connection().execute("SELECT DIRECTORY FROM PERSON WHERE NAME = ?", (name,)).fetchone()
+    if row is not None:
+        return row[0]
     return None
 
 
@@ -251,7 +281,7 @@ def compare_encoding_to_person(encoding, name, compare_encodings):
         print(f'No encodings found for {name}')
         return None
 
-    comparison_result = face_recognition.compare_faces(compare_encodings, encoding, tolerance=0.4)
+    comparison_result = face_recognition.compare_faces(compare_encodings, encoding, tolerance=MATCH_TOLERANCE)
     comparison_result = CompareResult(matchCount=comparison_result.count(True),
                                       notMatchCount=comparison_result.count(False))
 
@@ -277,53 +307,42 @@ def identify_person_from_encoding(encoding, debug=False):
     """
     start_time = time.time()
 
-    conn = sqlite3.connect('./hw2.db')
-    cursor = conn.cursor()
-    if conn:
-        # Get all encodings from the database
-        query = "SELECT NAME, ENCODING FROM NAME_ENCODING"
-        cursor.execute(query)
-        conn.commit()
-        rows = cursor.fetchall()
-        conn.close()
-
-        encodings = {}
-        for row in rows:
-            this_name = row[0]
-            this_encoding = conversions.decode_memoryview_to_ndarray(row[1])
-            if this_name in encodings:
-                encodings[this_name].append(this_encoding)
-            else:
-                encodings[this_name] = [this_encoding]
-
-        possible_people = {}
-        for this_name, compare_encodings in encodings.items():
-            comparison_result = compare_encoding_to_person(encoding, this_name, compare_encodings)
-            match_rate = comparison_result.matchCount / (comparison_result.matchCount + comparison_result.notMatchCount)
-            if match_rate >= 0.6 and comparison_result.matchCount > comparison_result.notMatchCount:
-                # If the match rate is greater than 50% and there are more matches than not matches
-                possible_people[this_name] = comparison_result
-
-        max_match = 0
-        max_match_name = ''
-        for person, comparison_result in possible_people.items():
-            if comparison_result.matchCount > max_match:
-                max_match = comparison_result.matchCount
-                max_match_name = person
-
-        if max_match_name == '':
-            max_match_name = 'UNKNOWN PERSON'
+    encoding_gallery = gallery.get_gallery(debug)
+    max_match_name, max_match = encoding_gallery.identify(encoding)
 
-        if debug:
-            if max_match_name == 'UNKNOWN PERSON':
-                print('No matches found!')
-            else:
-                print(f'Max match: {conversions.get_normalized_name(max_match_name)} @ {max_match} matches!')
-            compare_time = time.time() - start_time
-            print(f'Compared {len(rows)} encodings in {compare_time} seconds.')
-
-        return max_match_name
-    return 'UNKNOWN PERSON'
+    if debug:
+        if max_match_name == UNKNOWN_PERSON:
+            print('No matches found!')
+        else:
+            print(f'Max match: {conversions.get_normalized_name(max_match_name)} @ {max_match} matches!')
+        compare_time = time.time() - start_time
+        print(f'Compared {len(encoding_gallery)} encodings in {compare_time} seconds.')
+
+    return max_match_name
+
+
+def identify_people_from_encodings(encodings, debug=False):
+    """
+    Given many encodings, identify each of them against all encodings in the database in one batched job.
+    Every encoding is identified with the same rules as identify_person_from_encoding.
+
+    :param encodings: Encodings of the people to identify
+    :type encodings: ndarray(M, 128) or list(ndarray(128,))
+    :param debug: Enables debug mode
+    :type debug: bool
+    :return: Name of the person with the most matches (or UNKNOWN PERSON) for every encoding and their match counts
+    :rtype: list(str), ndarray(M,)
+    """
+    start_time = time.time()
+
+    encoding_gallery = gallery.get_gallery(debug)
+    names, match_counts = encoding_gallery.identify_many(encodings)
+
+    if debug:
+        compare_time = time.time() - start_time
+        print(f'Identified {len(names)} encodings against {len(encoding_gallery)} encodings in {compare_time} seconds.')
+
+    return names, match_counts
 
 
 if __name__ == '__main__':
@@ -0,0 +1,111 @@
+"""
+Forward migration of local DB files to the current schema, in place.
+Schema v1 stored people in NAME_DIRECTORY and encodings in NAME_ENCODING, both keyed by the name string and without
+indexes. Schema v2 stores people in PERSON (integer PERSON_ID, unique index on NAME) and encodings in FACE_ENCODING
+(indexed by PERSON_ID). Schema v3 adds GALLERY_GENERATION, a DB fingerprint bumped by triggers whenever an existing
+encoding changes, which files derived from the DB (gallery file, ANN index) are checked against.
+`python3 -m src.migrate_db`
+"""
+
+from src import create_db
+from src import database
+from src import gallery
+
+__all__ = ['get_schema_version', 'migrate']
+
+
+def get_schema_version(conn):
+    """
+    Get the schema version of the DB.
+
+    :param conn: Open connection to the DB
+    :type conn: sqlite3.Connection
+    :return: Schema version, 0 for a DB without tables
+    :rtype: int
+    """
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'SCHEMA_VERSION' in tables:
+        return conn.execute("SELECT MAX(VERSION) FROM SCHEMA_VERSION").fetchone()[0]
+    if 'NAME_ENCODING' in tables:
+        return 1
+    return 0
+
+
+def _migrate_v1_to_v2(conn):
+    """
+    Move the people and encodings of a v1 DB into the v2 tables and drop the v1 tables.
+
+    :param conn: Connection with an open transaction
+    :type conn: sqlite3.Connection
+    """
+    conn.execute(create_db.CREATE_PERSON)
+    conn.execute(create_db.CREATE_PERSON_NAME_INDEX)
+    conn.execute(create_db.CREATE_FACE_ENCODING)
+    conn.execute(create_db.CREATE_FACE_ENCODING_PERSON_INDEX)
+
+    # One person per name, in order of first appearance, taken from the first row of that name
+    conn.execute("""INSERT INTO PERSON (NAME, DIRECTORY, ENCODING_COUNT)
+                    SELECT NAME, DIRECTORY, ENCODING_COUNT FROM NAME_DIRECTORY
+                    WHERE rowid IN (SELECT MIN(rowid) FROM NAME_DIRECTORY GROUP BY NAME)
+                    ORDER BY rowid""")
+    # Encodings whose person is missing from NAME_DIRECTORY
+    conn.execute("""INSERT INTO PERSON (NAME, DIRECTORY, ENCODING_COUNT)
+                    SELECT NAME, './images/' || NAME, COUNT(*) FROM NAME_ENCODING
+                    WHERE NAME NOT IN (SELECT NAME FROM PERSON)
+                    GROUP BY NAME ORDER BY MIN(rowid)""")
+    conn.execute("""INSERT INTO FACE_ENCODING (ENCODING_ID, PERSON_ID, ENCODING, FILE_NAME, SOURCE)
+                    SELECT NAME_ENCODING.rowid, PERSON.PERSON_ID, ENCODING, FILE_NAME, SOURCE
+                    FROM NAME_ENCODING JOIN PERSON ON PERSON.NAME = NAME_ENCODING.NAME
+                    ORDER BY NAME_ENCODING.rowid""")
+    conn.execute("DROP TABLE NAME_ENCODING")
+    conn.execute("DROP TABLE NAME_DIRECTORY")
+    conn.execute(create_db.CREATE_SCHEMA_VERSION)
+    conn.execute("INSERT INTO SCHEMA_VERSION (VERSION) VALUES (2)")
+
+
+def _migrate_v2_to_v3(conn):
+    """
+    Add the DB fingerprint of a v2 DB. Gallery files and ANN indexes saved before have no fingerprint and are rebuilt.
+
+    :param conn: Connection with an open transaction
+    :type conn: sqlite3.Connection
+    """
+    conn.execute(create_db.CREATE_GALLERY_GENERATION)
+    conn.execute(create_db.INSERT_GALLERY_GENERATION)
+    for create_trigger in create_db.CREATE_GALLERY_GENERATION_TRIGGERS:
+        conn.execute(create_trigger)
+
+
+def migrate(debug=False):
+    """
+    Migrate the DB to create_db.SCHEMA_VERSION. The migration runs in a single transaction, so a failed migration leaves
+    the DB untouched. DBs that are empty or already up to date are left alone.
+
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: True if the DB was migrated
+    :rtype: bool
+    """
+    conn = database.get_connection()
+    version = get_schema_version(conn)
+    if version == 0 or version >= create_db.SCHEMA_VERSION:
+        if debug:
+            print(f'DB schema is at version {version}, nothing to migrate.')
+        return False
+
+    with database.transaction():
+        if version < 2:
+            _migrate_v1_to_v2(conn)
+        if version < 3:
+            _migrate_v2_to_v3(conn)
+        conn.execute("UPDATE SCHEMA_VERSION SET VERSION = ?", (create_db.SCHEMA_VERSION,))
+    if version < 2:
+        conn.execute("VACUUM")  # Give the space of the repeated name strings back to the file system
+
+    gallery.invalidate_gallery()
+    print(f'Migrated the DB schema from version {version} to {create_db.SCHEMA_VERSION}.')
+    return True
+
+
+if __name__ == '__main__':
+    migrate(debug=True)
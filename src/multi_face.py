@@ -0,0 +1,133 @@
+"""
+Multi-face mode for group photos. Every face of the image is located and encoded in one pass and identified against
+the local database in one batched match. Only the faces the database does not know are sent to AWS Rekognition, in a
+single call whose recognized celebrities are matched back to the local faces by bounding box.
+"""
+
+from collections import namedtuple
+
+from PIL import Image
+
+from src import aws_rekognition
+from src import conversions
+from src import local_facial_recognition as lfr
+from src.gallery import UNKNOWN_PERSON
+
+__all__ = ['identify_faces', 'print_identities', 'box_iou', 'match_boxes', 'FaceIdentity']
+
+# Identity of a face: location is (top, right, bottom, left) pixels, source is 'local', 'aws' or None if unidentified
+FaceIdentity = namedtuple('FaceIdentity', ['location', 'name', 'source', 'match_confidence'])
+
+MIN_BOX_IOU = 0.3  # Overlap below which a Rekognition face and a local face are considered different faces
+
+
+def box_iou(box_a, box_b):
+    """
+    Compute the intersection over union of two boxes.
+
+    :param box_a: (left, top, right, bottom) box
+    :type box_a: tuple(float, float, float, float)
+    :param box_b: (left, top, right, bottom) box
+    :type box_b: tuple(float, float, float, float)
+    :return: Area of the intersection of the boxes divided by the area of their union, from 0 to 1
+    :rtype: float
+    """
+    width = min(box_a[2], box_b[2]) - max(box_a[0], box_b[0])
+    height = min(box_a[3], box_b[3]) - max(box_a[1], box_b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = ((box_a[2] - box_a[0]) * (box_a[3] - box_a[1]) + (box_b[2] - box_b[0]) * (box_b[3] - box_b[1])
+             - intersection)
+    return intersection / union
+
+
+def match_boxes(boxes_a, boxes_b, min_iou=MIN_BOX_IOU):
+    """
+    Pair the boxes of two detections of the same faces, most overlapping pairs first. Each box is paired at most once.
+
+    :param boxes_a: (left, top, right, bottom) boxes of the first detection
+    :type boxes_a: list(tuple(float, float, float, float))
+    :param boxes_b: (left, top, right, bottom) boxes of the second detection, in the same coordinates
+    :type boxes_b: list(tuple(float, float, float, float))
+    :param min_iou: Overlap below which two boxes are never paired
+    :type min_iou: float
+    :return: Index in `boxes_b` of the box paired with each paired box of `boxes_a`
+    :rtype: dict{int, int}
+    """
+    pairs = sorted(((box_iou(box_a, box_b), index_a, index_b)
+                    for index_a, box_a in enumerate(boxes_a) for index_b, box_b in enumerate(boxes_b)), reverse=True)
+    matches = {}
+    paired_b = set()
+    for iou, index_a, index_b in pairs:
+        if iou < min_iou:
+            break
+        if index_a not in matches and index_b not in paired_b:
+            matches[index_a] = index_b
+            paired_b.add(index_b)
+    return matches
+
+
+def identify_faces(file_location, online=True, debug=False):
+    """
+    Identify every face of an image, e.g. a group photo.
+
+    :param file_location: Path of the image
+    :type file_location: str
+    :param online: Whether the faces unknown to the local database are sent to AWS Rekognition
+    :type online: bool
+    :param debug: Enable debug mode
+    :type debug: bool
+    :return: Identity of every face found in the image
+    :rtype: list(FaceIdentity)
+    """
+    locations, encodings = lfr.generate_face_encodings(file_location, debug=debug)
+    if len(locations) == 0:
+        return []
+    names, _ = lfr.identify_people_from_encodings(encodings, debug=debug)
+    identities = [FaceIdentity(location, name, 'local', None) if name != UNKNOWN_PERSON
+                  else FaceIdentity(location, None, None, None) for location, name in zip(locations, names)]
+
+    unresolved = [index for index, identity in enumerate(identities) if identity.source is None]
+    if len(unresolved) == 0 or not online:
+        return identities
+
+    image_bytes = aws_rekognition.encode_image(file_location)
+    celebrities = aws_rekognition.detect_celebrities_from_bytes(image_bytes, debug=debug)
+    if not celebrities:
+        return identities
+
+    # Rekognition boxes are ratios of the image size, local locations are pixels of the original image
+    with Image.open(file_location) as img:
+        width, height = img.size
+    local_boxes = [(left / width, top / height, right / width, bottom / height)
+                   for top, right, bottom, left in (identities[index].location for index in unresolved)]
+    aws_boxes = [(box['Left'], box['Top'], box['Left'] + box['Width'], box['Top'] + box['Height'])
+                 for box in (celebrity.bounding_box for celebrity in celebrities)]
+    for local_index, aws_index in match_boxes(local_boxes, aws_boxes).items():
+        celebrity = celebrities[aws_index]
+        identities[unresolved[local_index]] = FaceIdentity(identities[unresolved[local_index]].location,
+                                                           conversions.get_normalized_name(celebrity.name), 'aws',
+                                                           celebrity.match_confidence)
+    return identities
+
+
+def print_identities(identities):
+    """
+    Print the identity of every face of an image.
+
+    :param identities: Identities returned by identify_faces
+    :type identities: list(FaceIdentity)
+    """
+    if len(identities) == 0:
+        print('No faces found in the image.')
+    for number, identity in enumerate(identities, start=1):
+        top, right, bottom, left = identity.location
+        if identity.source is None:
+            print(f'Face {number} at (left={left}, top={top}, right={right}, bottom={bottom}): unknown')
+        elif identity.source == 'aws':
+            print(f'Face {number} at (left={left}, top={top}, right={right}, bottom={bottom}): <{identity.name}> '
+                  f'(AWS, {identity.match_confidence:.1f}% confidence)')
+        else:
+            print(f'Face {number} at (left={left}, top={top}, right={right}, bottom={bottom}): <{identity.name}> '
+                  f'(local DB)')
@@ -0,0 +1,193 @@
+"""
+Persistent cache of AWS Rekognition celebrity lookups, keyed by a hash of the grayscale pixels sent to Rekognition,
+so the same image (or an exact duplicate saved under another name or format) is never sent to AWS twice.
+Images Rekognition did not recognize are cached too, for a shorter time.
+`python3 -m src.rekognition_cache [stats|clear]`
+"""
+
+import hashlib
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy
+
+from src import image_preprocessing
+
+__all__ = ['hash_image', 'hash_pixels', 'get_cached_result', 'store_result', 'configure_rekognition_cache',
+           'clear_rekognition_cache', 'get_rekognition_cache_stats', 'print_rekognition_cache_stats']
+
+
+CACHE_PATH = './rekognition_cache.db'
+DEFAULT_TTL = 30 * 24 * 3600  # Seconds a recognized celebrity is reused
+NEGATIVE_TTL = 24 * 3600  # Seconds an unrecognized image is reused
+
+_options = {'enabled': True, 'path': CACHE_PATH, 'ttl': DEFAULT_TTL, 'negative_ttl': NEGATIVE_TTL}
+_stats = {'hits': 0, 'misses': 0, 'expired': 0}
+_conn = None  # Opened lazily by _get_connection()
+_lock = threading.Lock()
+
+
+def configure_rekognition_cache(enabled=True, path=CACHE_PATH, ttl=DEFAULT_TTL, negative_ttl=NEGATIVE_TTL):
+    """
+    Configure the Rekognition result cache.
+
+    :param enabled: Whether results are read from and written to the cache
+    :type enabled: bool
+    :param path: Path of the cache file
+    :type path: str
+    :param ttl: Seconds a recognized celebrity is reused
+    :type ttl: int
+    :param negative_ttl: Seconds an unrecognized image is reused
+    :type negative_ttl: int
+    """
+    global _conn
+    with _lock:
+        if _conn is not None and path != _options['path']:
+            _conn.close()
+            _conn = None
+        _options.update(enabled=enabled, path=path, ttl=ttl, negative_ttl=negative_ttl)
+
+
+def _get_connection():
+    """
+    Get the connection to the cache file, creating the cache table on first use. Must be called with `_lock` held.
+
+    :return: Open connection to the cache
+    :rtype: sqlite3.Connection
+    """
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(_options['path'], isolation_level=None, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute('''CREATE TABLE IF NOT EXISTS REKOGNITION_CACHE
+                         (IMAGE_HASH          TEXT    PRIMARY KEY,
+                          NAME                TEXT,
+                          MATCH_CONFIDENCE    REAL,
+                          EXPIRES             REAL    NOT NULL);''')
+    return _conn
+
+
+def hash_pixels(pixels):
+    """
+    Hash the grayscale pixels of an already decoded image. Re-encoding the same pixels (e.g. saving them as PNG instead
+    of JPEG, or under another name) gives the same hash.
+
+    :param pixels: Grayscale pixels, as a (height, width) array or the (height, width, 3) array of
+                   image_preprocessing.load_image(grayscale=True)
+    :type pixels: ndarray
+    :return: Hexadecimal SHA-256 of the image size and grayscale pixels
+    :rtype: str
+    """
+    if pixels.ndim == 3:
+        pixels = pixels[:, :, 0]  # The three channels of a grayscale image are identical
+    height, width = pixels.shape
+    digest = hashlib.sha256(f'{width}x{height}:'.encode('utf-8'))
+    digest.update(numpy.ascontiguousarray(pixels, dtype=numpy.uint8).tobytes())
+    return digest.hexdigest()
+
+
+def hash_image(file_path, max_dimension=0):
+    """
+    Decode an image and hash its grayscale pixels (see hash_pixels).
+
+    :param file_path: Path to the image
+    :type file_path: str
+    :param max_dimension: Longest side the image is downscaled to before hashing, 0 to hash the full resolution.
+                          Use the size the image is sent to Rekognition at so the hash matches hash_pixels of it.
+    :type max_dimension: int
+    :return: Hexadecimal SHA-256 of the image size and grayscale pixels
+    :rtype: str
+    """
+    return hash_pixels(image_preprocessing.load_image(file_path, max_dimension=max_dimension).array)
+
+
+def get_cached_result(image_hash):
+    """
+    Get the cached Rekognition result of an image.
+
+    :param image_hash: Hash of the image from hash_image
+    :type image_hash: str
+    :return: (Celebrity name, Match confidence), False if Rekognition did not recognize the image, or None if the
+             image is not cached or its result expired
+    :rtype: tuple(str, float) or bool or None
+    """
+    if not _options['enabled']:
+        return None
+    with _lock:
+        conn = _get_connection()
+        row = conn.execute("SELECT NAME, MATCH_CONFIDENCE, EXPIRES FROM REKOGNITION_CACHE WHERE IMAGE_HASH = ?",
+                           (image_hash,)).fetchone()
+        if row is None:
+            _stats['misses'] += 1
+            return None
+        if row[2] < time.time():
+            conn.execute("DELETE FROM REKOGNITION_CACHE WHERE IMAGE_HASH = ?", (image_hash,))
+            _stats['misses'] += 1
+            _stats['expired'] += 1
+            return None
+        _stats['hits'] += 1
+    if row[0] is None:
+        return False
+    return row[0], row[1]
+
+
+def store_result(image_hash, name=None, match_confidence=None):
+    """
+    Cache the Rekognition result of an image. Only results of successful calls should be cached, never errors.
+
+    :param image_hash: Hash of the image from hash_image
+    :type image_hash: str
+    :param name: Name of the recognized celebrity, None if Rekognition did not recognize the image
+    :type name: str or None
+    :param match_confidence: Match confidence of the recognized celebrity
+    :type match_confidence: float or None
+    """
+    if not _options['enabled']:
+        return
+    ttl = _options['negative_ttl'] if name is None else _options['ttl']
+    with _lock:
+        _get_connection().execute("INSERT OR REPLACE INTO REKOGNITION_CACHE (IMAGE_HASH, NAME, MATCH_CONFIDENCE, "
+                                  "EXPIRES) VALUES (?, ?, ?, ?)",
+                                  (image_hash, name, match_confidence, time.time() + ttl))
+
+
+def clear_rekognition_cache():
+    """
+    Delete every cached result.
+    """
+    with _lock:
+        _get_connection().execute("DELETE FROM REKOGNITION_CACHE")
+
+
+def get_rekognition_cache_stats():
+    """
+    Get the cache statistics of this process. Every hit is a Rekognition call saved.
+
+    :return: Number of hits, misses, expired results and the hit rate
+    :rtype: dict{str, int or float}
+    """
+    lookups = _stats['hits'] + _stats['misses']
+    return dict(_stats, hit_rate=_stats['hits'] / lookups if lookups > 0 else 0.0)
+
+
+def print_rekognition_cache_stats():
+    """
+    Print the cache statistics of this process.
+    """
+    stats = get_rekognition_cache_stats()
+    print(f'Rekognition cache: {stats["hits"]} hits, {stats["misses"]} misses '
+          f'({stats["hit_rate"]*100:.1f}% hit rate), {stats["expired"]} expired')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'clear':
+        clear_rekognition_cache()
+        print(f'Cleared the Rekognition cache "{_options["path"]}".')
+    else:
+        with _lock:
+            count, unrecognized = _get_connection().execute("SELECT COUNT(*), COUNT(*) - COUNT(NAME) "
+                                                            "FROM REKOGNITION_CACHE").fetchone()
+        print(f'Rekognition cache "{_options["path"]}": {count} images, {unrecognized} of them unrecognized.')
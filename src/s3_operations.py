@@ -3,29 +3,20 @@ This file contains functions for uploading, downloading, and deleting files from
 """
 
 import os
-import boto3
-from PIL import Image
-from dotenv import dotenv_values
 from botocore.exceptions import NoCredentialsError, ClientError
 
+from src import aws_clients
 
-def get_env_vars():
-    """
-    Get the environment variables for the AWS S3 bucket.
 
-    :return: S3 access key, S3 secret key, and S3 bucket name
-    :rtype: str, str, str
-    """
-    config = dotenv_values(".env")
-    access_key = config['S3_ACCESS_KEY']
-    secret_key = config['S3_SECRET_KEY']
-    bucket_name = config['S3_BUCKET']
-    return access_key, secret_key, bucket_name
+# Same function as aws_clients.get_env_vars, so both modules export the same object
+get_env_vars = aws_clients.get_env_vars
 
 
 def get_file_from_user():
     """
     Get an image file from the user and check that it exists.
+    The image is not modified: the grayscale conversion happens in memory when it is searched
+    (see image_preprocessing.load_image).
 
     :return: Path to the file
     :rtype: str
@@ -40,12 +31,6 @@ def get_file_from_user():
         if os.path.exists(file_path):
             break
         print(f'The file "{file_path}" does not exist. Please try again!', end='\n\n')
-
-    # Convert image to grayscale
-    img = Image.open(file_path).convert('L')
-    file_format = file_path.split('.')[-1]
-    file_path = file_path.split('.')[0] + f'_grayscale.{file_format}'
-    img.save(file_path)
     return file_path
 
 
@@ -80,8 +65,8 @@ def upload_to_aws(local_file, s3_file, debug=False):
     :return: Success state of the upload -- True if successful, False otherwise
     :rtype: bool
     """
-    access_key, secret_key, bucket_name = get_env_vars()
-    s3_connection = boto3.client('s3', aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+    _, _, bucket_name = get_env_vars()
+    s3_connection = aws_clients.get_client('s3')
     try:
         s3_connection.upload_file(local_file, bucket_name, s3_file)
         if debug:
@@ -115,8 +100,8 @@ def download_from_aws(file_name, debug=False):
     :return: Success state of the download -- True if successful, False otherwise
     :rtype: bool
     """
-    access_key, secret_key, bucket_name = get_env_vars()
-    s3_connection = boto3.client('s3', aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+    _, _, bucket_name = get_env_vars()
+    s3_connection = aws_clients.get_client('s3')
     try:
         temp_path = os.path.join(os.getcwd(), 'tmp')
         if not os.path.exists(temp_path):
@@ -151,11 +136,11 @@ def cleanup(file_name, debug=False):
     :return: Success state of the deletion -- True if successful, False otherwise
     :rtype: bool
     """
-    access_key, secret_key, bucket_name = get_env_vars()
+    _, _, bucket_name = get_env_vars()
     if isinstance(file_name, list):
         for file in file_name:
             cleanup(file)
-    s3_connection = boto3.client('s3', aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+    s3_connection = aws_clients.get_client('s3')
     try:
         s3_connection.delete_object(Bucket=bucket_name, Key=file_name)
         if debug:
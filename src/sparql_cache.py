@@ -0,0 +1,222 @@
+"""
+Persistent cache of DBpedia SPARQL answers, keyed by subject resource and question.
+Answers expire after a TTL (shorter for 'UNKNOWN' answers, which are more likely to change) and the least recently used
+answers are evicted once the cache grows past its size limit.
+`python3 -m src.sparql_cache [stats|clear]`
+"""
+
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+__all__ = ['get_cached_answers', 'store_answers', 'configure_cache', 'clear_cache', 'get_cache_stats',
+           'print_cache_stats']
+
+
+CACHE_PATH = './sparql_cache.db'
+DEFAULT_TTL = 7 * 24 * 3600  # Seconds an answer is reused
+NEGATIVE_TTL = 24 * 3600  # Seconds an 'UNKNOWN' answer is reused
+MAX_CACHE_BYTES = 64 * 1024 * 1024  # Size of the cached answers past which the least recently used ones are evicted
+EVICT_BATCH_SIZE = 256  # Least recently used answers read at once while evicting
+
+_options = {'enabled': True, 'path': CACHE_PATH, 'ttl': DEFAULT_TTL, 'negative_ttl': NEGATIVE_TTL,
+            'max_bytes': MAX_CACHE_BYTES}
+_stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+_conn = None  # Opened lazily by _get_connection()
+_lock = threading.Lock()  # The cache is shared by every thread running queries
+
+
+def configure_cache(enabled=True, path=CACHE_PATH, ttl=DEFAULT_TTL, negative_ttl=NEGATIVE_TTL,
+                    max_bytes=MAX_CACHE_BYTES):
+    """
+    Configure the SPARQL answer cache.
+
+    :param enabled: Whether answers are read from and written to the cache
+    :type enabled: bool
+    :param path: Path of the cache file
+    :type path: str
+    :param ttl: Seconds an answer is reused
+    :type ttl: int
+    :param negative_ttl: Seconds an 'UNKNOWN' answer is reused
+    :type negative_ttl: int
+    :param max_bytes: Size of the cached answers past which the least recently used ones are evicted
+    :type max_bytes: int
+    """
+    global _conn
+    with _lock:
+        if _conn is not None and path != _options['path']:
+            _conn.close()
+            _conn = None
+        _options.update(enabled=enabled, path=path, ttl=ttl, negative_ttl=negative_ttl, max_bytes=max_bytes)
+
+
+def _get_connection():
+    """
+    Get the connection to the cache file, creating the cache table on first use. Must be called with `_lock` held.
+
+    :return: Open connection to the cache
+    :rtype: sqlite3.Connection
+    """
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(_options['path'], isolation_level=None, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute('''CREATE TABLE IF NOT EXISTS SPARQL_CACHE
+                         (SUBJECT      TEXT    NOT NULL,
+                          QUESTION     TEXT    NOT NULL,
+                          ANSWERS      TEXT    NOT NULL,
+                          SIZE         INT     NOT NULL,
+                          EXPIRES      REAL    NOT NULL,
+                          LAST_USED    REAL    NOT NULL,
+                          PRIMARY KEY (SUBJECT, QUESTION));''')
+        _conn.execute("CREATE INDEX IF NOT EXISTS SPARQL_CACHE_LAST_USED ON SPARQL_CACHE (LAST_USED)")
+        # Running total of SIZE kept by triggers, so a write never has to sum the whole table. Set up in one
+        # transaction so another process cannot write between the initial sum and the triggers.
+        _conn.execute("BEGIN IMMEDIATE")
+        _conn.execute("CREATE TABLE IF NOT EXISTS SPARQL_CACHE_SIZE (TOTAL INT NOT NULL)")
+        _conn.execute("INSERT INTO SPARQL_CACHE_SIZE (TOTAL) SELECT COALESCE(SUM(SIZE), 0) FROM SPARQL_CACHE "
+                      "WHERE NOT EXISTS (SELECT 1 FROM SPARQL_CACHE_SIZE)")
+        _conn.execute("""CREATE TRIGGER IF NOT EXISTS SPARQL_CACHE_INSERTED AFTER INSERT ON SPARQL_CACHE
+                         BEGIN UPDATE SPARQL_CACHE_SIZE SET TOTAL = TOTAL + NEW.SIZE; END;""")
+        _conn.execute("""CREATE TRIGGER IF NOT EXISTS SPARQL_CACHE_UPDATED AFTER UPDATE OF SIZE ON SPARQL_CACHE
+                         BEGIN UPDATE SPARQL_CACHE_SIZE SET TOTAL = TOTAL + NEW.SIZE - OLD.SIZE; END;""")
+        _conn.execute("""CREATE TRIGGER IF NOT EXISTS SPARQL_CACHE_DELETED AFTER DELETE ON SPARQL_CACHE
+                         BEGIN UPDATE SPARQL_CACHE_SIZE SET TOTAL = TOTAL - OLD.SIZE; END;""")
+        _conn.execute("COMMIT")
+    return _conn
+
+
+def get_cached_answers(subject, question):
+    """
+    Get the cached answers of a question about a subject.
+
+    :param subject: Full URI of the subject resource
+    :type subject: str
+    :param question: DBO (biographical) tag
+    :type question: str
+    :return: Cached answers or None if the question is not cached or its answers expired
+    :rtype: list(str) or None
+    """
+    if not _options['enabled']:
+        return None
+    now = time.time()
+    with _lock:
+        conn = _get_connection()
+        row = conn.execute("SELECT ANSWERS, EXPIRES FROM SPARQL_CACHE WHERE SUBJECT = ? AND QUESTION = ?",
+                           (subject, question)).fetchone()
+        if row is None:
+            _stats['misses'] += 1
+            return None
+        if row[1] < now:
+            conn.execute("DELETE FROM SPARQL_CACHE WHERE SUBJECT = ? AND QUESTION = ?", (subject, question))
+            _stats['misses'] += 1
+            _stats['expired'] += 1
+            return None
+        conn.execute("UPDATE SPARQL_CACHE SET LAST_USED = ? WHERE SUBJECT = ? AND QUESTION = ?",
+                     (now, subject, question))
+        _stats['hits'] += 1
+    return json.loads(row[0])
+
+
+def store_answers(subject, question, answers):
+    """
+    Cache the answers of a question about a subject. Failed queries ('ERROR') are never cached.
+
+    :param subject: Full URI of the subject resource
+    :type subject: str
+    :param question: DBO (biographical) tag
+    :type question: str
+    :param answers: Answers returned by DBpedia
+    :type answers: list(str)
+    """
+    if not _options['enabled'] or 'ERROR' in answers:
+        return
+    now = time.time()
+    ttl = _options['negative_ttl'] if answers == ['UNKNOWN'] else _options['ttl']
+    serialized = json.dumps(answers)
+    size = len(subject) + len(question) + len(serialized)
+    with _lock:
+        conn = _get_connection()
+        # An upsert rather than INSERT OR REPLACE, whose implicit deletion does not fire the size triggers
+        conn.execute("INSERT INTO SPARQL_CACHE (SUBJECT, QUESTION, ANSWERS, SIZE, EXPIRES, LAST_USED) "
+                     "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (SUBJECT, QUESTION) DO UPDATE SET "
+                     "ANSWERS = excluded.ANSWERS, SIZE = excluded.SIZE, EXPIRES = excluded.EXPIRES, "
+                     "LAST_USED = excluded.LAST_USED",
+                     (subject, question, serialized, size, now + ttl, now))
+        _evict(conn)
+
+
+def _evict(conn):
+    """
+    Delete the least recently used answers until the cache fits in its size limit. Must be called with `_lock` held.
+    Only the running total is read while the cache fits, the answers are only walked once it is over the limit.
+
+    :param conn: Open connection to the cache
+    :type conn: sqlite3.Connection
+    """
+    excess = _get_total_size(conn) - _options['max_bytes']
+    while excess > 0:
+        oldest = conn.execute("SELECT SUBJECT, QUESTION, SIZE FROM SPARQL_CACHE ORDER BY LAST_USED LIMIT ?",
+                              (EVICT_BATCH_SIZE,)).fetchall()
+        if not oldest:
+            break
+        for subject, question, size in oldest:
+            if excess <= 0:
+                break
+            conn.execute("DELETE FROM SPARQL_CACHE WHERE SUBJECT = ? AND QUESTION = ?", (subject, question))
+            excess -= size
+            _stats['evicted'] += 1
+
+
+def _get_total_size(conn):
+    """
+    Get the size of every cached answer from the running total. Must be called with `_lock` held.
+
+    :param conn: Open connection to the cache
+    :type conn: sqlite3.Connection
+    :return: Sum of the SIZE column
+    :rtype: int
+    """
+    return conn.execute("SELECT TOTAL FROM SPARQL_CACHE_SIZE").fetchone()[0]
+
+
+def clear_cache():
+    """
+    Delete every cached answer.
+    """
+    with _lock:
+        _get_connection().execute("DELETE FROM SPARQL_CACHE")
+
+
+def get_cache_stats():
+    """
+    Get the cache statistics of this process.
+
+    :return: Number of hits, misses, expired answers, evicted answers and the hit rate
+    :rtype: dict{str, int or float}
+    """
+    lookups = _stats['hits'] + _stats['misses']
+    return dict(_stats, hit_rate=_stats['hits'] / lookups if lookups > 0 else 0.0)
+
+
+def print_cache_stats():
+    """
+    Print the cache statistics of this process.
+    """
+    stats = get_cache_stats()
+    print(f'SPARQL cache: {stats["hits"]} hits, {stats["misses"]} misses ({stats["hit_rate"]*100:.1f}% hit rate), '
+          f'{stats["expired"]} expired, {stats["evicted"]} evicted')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'clear':
+        clear_cache()
+        print(f'Cleared the SPARQL cache "{_options["path"]}".')
+    else:
+        with _lock:
+            conn = _get_connection()
+            count, size = conn.execute("SELECT COUNT(*) FROM SPARQL_CACHE").fetchone()[0], _get_total_size(conn)
+        print(f'SPARQL cache "{_options["path"]}": {count} answers, {size} bytes.')
@@ -0,0 +1,132 @@
+"""
+Shared SPARQL client keeping persistent (keep-alive) connections to the endpoint, so successive queries skip the TCP
+and TLS handshakes. Transient failures (connection errors, 429 and 5xx responses) are retried with exponential backoff.
+The endpoint defaults to DBpedia and can be changed with `SPARQL_ENDPOINT` in the .env file or with
+configure_sparql_client(), e.g. to use a local Fuseki server.
+"""
+
+import json
+import threading
+
+from dotenv import dotenv_values
+import urllib3
+from urllib3.util import Retry, Timeout
+
+__all__ = ['SparqlClient', 'SparqlError', 'get_sparql_client', 'configure_sparql_client', 'DEFAULT_ENDPOINT']
+
+
+DEFAULT_ENDPOINT = 'http://dbpedia.org/sparql'
+CONNECT_TIMEOUT = 5  # Seconds to open a connection
+READ_TIMEOUT = 60  # Seconds to wait for a query result
+MAX_RETRIES = 3  # Retries of a query failing with a transient error
+BACKOFF_FACTOR = 0.5  # Retries wait 0.5s, 1s, 2s, ... (or the endpoint's Retry-After)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_CONCURRENT_QUERIES = 8  # Queries running at once against the endpoint, also the size of the connection pool
+
+_client = None  # Process-wide client, created lazily by get_sparql_client()
+_client_lock = threading.Lock()
+
+
+class SparqlError(Exception):
+    """
+    A SPARQL query failed after all of its retries.
+    """
+
+
+class SparqlClient:
+    """
+    Client of a single SPARQL endpoint backed by a pool of keep-alive connections. Safe to share between threads.
+    """
+    def __init__(self, endpoint=DEFAULT_ENDPOINT, timeout=READ_TIMEOUT, max_retries=MAX_RETRIES,
+                 backoff_factor=BACKOFF_FACTOR, max_concurrency=MAX_CONCURRENT_QUERIES):
+        """
+        Create a client of a SPARQL endpoint.
+
+        :param endpoint: URL of the SPARQL endpoint
+        :type endpoint: str
+        :param timeout: Default seconds to wait for a query result
+        :type timeout: float
+        :param max_retries: Retries of a query failing with a transient error
+        :type max_retries: int
+        :param backoff_factor: Base of the exponential wait between retries, in seconds
+        :type backoff_factor: float
+        :param max_concurrency: Maximum number of queries running at once against the endpoint
+        :type max_concurrency: int
+        """
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        # SELECT queries are idempotent, so POST requests are retried too
+        self._retries = Retry(total=max_retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUSES,
+                              allowed_methods=None, respect_retry_after_header=True, raise_on_status=False)
+        self._pool = urllib3.PoolManager(maxsize=max_concurrency, block=True,
+                                         headers={'Accept': 'application/sparql-results+json'})
+        self._limit = threading.BoundedSemaphore(max_concurrency)
+
+    def select(self, query, timeout=None, retry_timeouts=True):
+        """
+        Run a SELECT query.
+
+        :param query: SPARQL query
+        :type query: str
+        :param timeout: Seconds to wait for the result. Default is the client's timeout.
+        :type timeout: float or None
+        :param retry_timeouts: Whether a query that timed out is retried
+        :type retry_timeouts: bool
+        :return: Result bindings, one {variable: {'value': str, ...}} dictionary per row
+        :rtype: list(dict)
+        :raises SparqlError: If the query still fails after all of its retries
+        """
+        retries = self._retries if retry_timeouts else self._retries.new(read=0)
+        with self._limit:
+            try:
+                # Sent as a form so long queries (e.g. large VALUES lists) do not hit URL length limits
+                response = self._pool.request('POST', self.endpoint, fields={'query': query}, encode_multipart=False,
+                                              timeout=Timeout(connect=CONNECT_TIMEOUT, read=timeout or self.timeout),
+                                              retries=retries)
+            except urllib3.exceptions.HTTPError as exception:
+                raise SparqlError(f'{self.endpoint} unreachable: {exception}') from exception
+        if response.status != 200:
+            raise SparqlError(f'{self.endpoint} returned HTTP {response.status}: {response.data[:200]!r}')
+        try:
+            return json.loads(response.data)['results']['bindings']
+        except (ValueError, KeyError, TypeError) as exception:
+            raise SparqlError(f'{self.endpoint} returned an invalid result: {exception}') from exception
+
+
+def get_sparql_client():
+    """
+    Get the process-wide SPARQL client, creating it on first use.
+
+    :return: Shared SPARQL client
+    :rtype: SparqlClient
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = SparqlClient(dotenv_values('.env').get('SPARQL_ENDPOINT') or DEFAULT_ENDPOINT)
+        return _client
+
+
+def configure_sparql_client(endpoint=DEFAULT_ENDPOINT, timeout=READ_TIMEOUT, max_retries=MAX_RETRIES,
+                     backoff_factor=BACKOFF_FACTOR, max_concurrency=MAX_CONCURRENT_QUERIES):
+    """
+    Replace the process-wide SPARQL client.
+
+    :param endpoint: URL of the SPARQL endpoint
+    :type endpoint: str
+    :param timeout: Default seconds to wait for a query result
+    :type timeout: float
+    :param max_retries: Retries of a query failing with a transient error
+    :type max_retries: int
+    :param backoff_factor: Base of the exponential wait between retries, in seconds
+    :type backoff_factor: float
+    :param max_concurrency: Maximum number of queries running at once against the endpoint
+    :type max_concurrency: int
+    :return: New shared SPARQL client
+    :rtype: SparqlClient
+    """
+    global _client
+    with _client_lock:
+        _client = SparqlClient(endpoint, timeout, max_retries, backoff_factor, max_concurrency)
+        return _client
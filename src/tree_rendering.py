@@ -0,0 +1,155 @@
+"""
+Graph output stage of entity search: draws the result tree of a query as DOT text, an SVG image or a PNG image.
+Layouts run in a background worker so the JSON answer is available immediately, and are cached by a hash of the tree so
+an identical result is never laid out twice. The layout itself runs in a `dot` subprocess: Graphviz's parser and layout
+libraries keep global state and must not run on several threads of this process at once.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pygraphviz as pgv
+
+__all__ = ['add_edges', 'tree_to_graph', 'tree_hash', 'render_graph', 'RENDER_FORMATS', 'GRAPH_FORMATS',
+           'DEFAULT_FORMAT']
+
+
+RENDER_FORMATS = ('none', 'json', 'dot', 'svg', 'png')  # Outputs of a query, from cheapest to most expensive
+GRAPH_FORMATS = ('dot', 'svg', 'png')  # Outputs drawn by this module
+DEFAULT_FORMAT = 'png'
+RENDER_CACHE_DIRECTORY = './results/.render_cache'
+LAYOUT_WORKERS = 2  # Layouts running at once, each in its own `dot` process
+
+_executor = None  # Created lazily by _get_executor()
+_locks = {}  # Lock of every render in progress, so identical trees rendered at once are laid out once
+_lock = threading.Lock()
+
+
+def add_edges(graph, node, visited=None):
+    """
+    Add edges to the graph recursively.
+
+    :param graph: Graph representation of the tree.
+    :type graph: AGraph
+    :param node: Current node to add edges for.
+    :type node: Node
+    :param visited: Ids of the nodes whose edges were already added (shared subtrees are only walked once).
+    :type visited: set(int) or None
+    """
+    if visited is None:
+        visited = set()
+    if id(node) in visited:
+        return
+    visited.add(id(node))
+    for child in node.get_children():
+        graph.add_edge(node.get_resource(), child.get_resource(), label=child.get_question())
+        add_edges(graph, child, visited)
+
+
+def tree_to_graph(root):
+    """
+    Convert a tree to a graph, without laying it out.
+
+    :param root: Root node of the tree.
+    :type root: Node
+    :return: Graph representation of the tree.
+    :rtype: AGraph
+    """
+    graph = pgv.AGraph(directed=True)
+    add_edges(graph, root)
+    return graph
+
+
+def tree_hash(json_tree):
+    """
+    Hash the content of a tree, identical results giving identical hashes.
+
+    :param json_tree: Dictionary representation of the tree (see entity_search.tree_to_dict).
+    :type json_tree: dict
+    :return: Hexadecimal SHA-256 of the tree
+    :rtype: str
+    """
+    serialized = json.dumps(json_tree, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def _get_executor():
+    """
+    Get the thread pool running the layouts, creating it on first use.
+
+    :return: Thread pool running the layouts
+    :rtype: ThreadPoolExecutor
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=LAYOUT_WORKERS, thread_name_prefix='layout')
+        return _executor
+
+
+def _draw(dot_text, cache_path, file_name, output_format):
+    """
+    Lay out and draw a graph unless it is already cached, then copy the cached image to its file.
+
+    :param dot_text: Graph in the DOT language
+    :type dot_text: str
+    :param cache_path: Path of the cached image of the graph
+    :type cache_path: str
+    :param file_name: Name of the image to save the graph to
+    :type file_name: str
+    :param output_format: 'svg' or 'png'
+    :type output_format: str
+    :return: Name of the image
+    :rtype: str
+    """
+    with _lock:
+        cache_lock = _locks.setdefault(cache_path, threading.Lock())
+    try:
+        with cache_lock:
+            if not os.path.exists(cache_path):
+                # Written under a temporary name so an interrupted draw never leaves a broken image in the cache
+                temporary_path = f'{cache_path}.{threading.get_ident()}.tmp'
+                subprocess.run(['dot', f'-T{output_format}', '-o', temporary_path], input=dot_text.encode('utf-8'),
+                               check=True, capture_output=True)
+                os.replace(temporary_path, cache_path)
+    finally:
+        with _lock:
+            # Renders of this tree starting from now find the cached image and need no lock
+            if _locks.get(cache_path) is cache_lock:
+                del _locks[cache_path]
+    shutil.copyfile(cache_path, file_name)
+    return file_name
+
+
+def render_graph(root, json_tree, file_name, output_format=DEFAULT_FORMAT):
+    """
+    Draw the graph of a tree. DOT text is written immediately, images are laid out in the background.
+
+    :param root: Root node of the tree.
+    :type root: Node
+    :param json_tree: Dictionary representation of the tree, used as the cache key of the image.
+    :type json_tree: dict
+    :param file_name: Name of the file to save the graph to.
+    :type file_name: str
+    :param output_format: One of GRAPH_FORMATS
+    :type output_format: str
+    :return: Future of the image name, None for DOT text
+    :rtype: Future or None
+    """
+    if output_format not in GRAPH_FORMATS:
+        raise ValueError(f'Unknown graph format "{output_format}". Expected one of {", ".join(GRAPH_FORMATS)}.')
+    dot_text = tree_to_graph(root).to_string()
+    if output_format == 'dot':
+        with open(file_name, 'w') as dot_file:
+            dot_file.write(dot_text)
+        return None
+
+    if not os.path.exists(RENDER_CACHE_DIRECTORY):
+        os.makedirs(RENDER_CACHE_DIRECTORY, exist_ok=True)
+    cache_path = os.path.join(RENDER_CACHE_DIRECTORY, f'{tree_hash(json_tree)}.{output_format}')
+    return _get_executor().submit(_draw, dot_text, cache_path, file_name, output_format)
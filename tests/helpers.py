@@ -0,0 +1,56 @@
+"""
+Shared fixtures of the tests: a temporary local DB filled with synthetic encodings.
+"""
+
+import os
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+
+from src import conversions
+from src import create_db
+from src import database
+from src import gallery
+
+
+def use_temporary_db(test_case, people=None):
+    """
+    Point the local DB at a new, empty DB in a temporary directory for the duration of a test.
+
+    :param test_case: Test the DB is created for, its cleanups restore the previous DB
+    :type test_case: unittest.TestCase
+    :param people: Encodings to insert, by normalized name
+    :type people: dict{str, list(ndarray(128,))} or None
+    :return: Temporary directory holding the DB
+    :rtype: str
+    """
+    directory = tempfile.TemporaryDirectory()
+    test_case.addCleanup(directory.cleanup)
+    previous_db_path = database.get_db_path()
+    test_case.addCleanup(database.set_db_path, previous_db_path)
+    test_case.addCleanup(database.close_connection)
+    test_case.addCleanup(gallery.invalidate_gallery)
+    database.set_db_path(os.path.join(directory.name, 'test.db'))
+    gallery.invalidate_gallery()
+    with redirect_stdout(StringIO()):
+        create_db.main()
+    if people:
+        insert_people(people)
+    return directory.name
+
+
+def insert_people(people):
+    """
+    Insert people and their float64 encodings into the local DB.
+
+    :param people: Encodings to insert, by normalized name
+    :type people: dict{str, list(ndarray(128,))}
+    """
+    with database.transaction() as conn:
+        for name, person_encodings in people.items():
+            person_id = conn.execute("INSERT INTO PERSON (NAME, DIRECTORY, ENCODING_COUNT) VALUES (?, ?, ?)",
+                                     (name, f'./images/{name}', len(person_encodings))).lastrowid
+            conn.executemany("INSERT INTO FACE_ENCODING (PERSON_ID, ENCODING, FILE_NAME, SOURCE) "
+                             "VALUES (?, ?, ?, 'test')",
+                             [(person_id, conversions.encode_ndarray_to_memoryview(encoding).tobytes(), f'{i}.jpg')
+                              for i, encoding in enumerate(person_encodings)])
@@ -0,0 +1,124 @@
+"""
+Tests of the IVF index: exhaustive probing equals the exact search, and the saved `<db>_ivf.npz` is only reused for the
+gallery it was built over.
+"""
+
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from src import database
+from src import encoding_precision
+from src import gallery
+from src.ann_index import IVFIndex
+from tests.helpers import use_temporary_db
+from tests.test_gallery import build_gallery, make_people
+
+
+class IVFIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.people, self.queries = make_people()
+        self.encoding_gallery = build_gallery(self.people)
+
+    def test_probing_every_list_returns_every_row(self):
+        index = IVFIndex.build(self.encoding_gallery.encodings, self.encoding_gallery.last_rowid)
+        index.n_probe = index.centroids.shape[0]
+        for query in self.queries:
+            np.testing.assert_array_equal(np.sort(index.search(query)), np.arange(len(self.encoding_gallery)))
+
+    def test_probing_every_list_matches_the_exact_search(self):
+        exact = [self.encoding_gallery.identify(query) for query in self.queries]
+        index = IVFIndex.build(self.encoding_gallery.encodings, self.encoding_gallery.last_rowid)
+        index.n_probe, index.top_k = index.centroids.shape[0], len(self.encoding_gallery.names)
+        self.encoding_gallery.ann_index = index
+        self.assertEqual([self.encoding_gallery.identify(query) for query in self.queries], exact)
+
+    def test_added_rows_are_searched(self):
+        half = len(self.encoding_gallery) // 2
+        index = IVFIndex.build(self.encoding_gallery.encodings[:half], half)
+        index.add(self.encoding_gallery.encodings[half:], len(self.encoding_gallery))
+        index.n_probe = index.centroids.shape[0]
+        self.assertEqual(len(index), len(self.encoding_gallery))
+        np.testing.assert_array_equal(np.sort(index.search(self.queries[0])), np.arange(len(self.encoding_gallery)))
+
+
+class SavedIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.people, self.queries = make_people()
+        self.directory = use_temporary_db(self, self.people)
+        gallery.set_ann_search(True)
+        self.addCleanup(gallery.set_ann_search, False)
+
+    def _load_gallery(self):
+        """
+        Drop the loaded gallery and load it again, as a new process would.
+        """
+        gallery.invalidate_gallery()
+        return gallery.get_gallery()
+
+    def _saved_identity(self):
+        return IVFIndex.load(gallery.get_ann_index_path()).identity
+
+    def test_index_is_saved_next_to_the_db(self):
+        encoding_gallery = gallery.get_gallery()
+        self.assertEqual(gallery.get_ann_index_path(), os.path.join(self.directory, 'test_ivf.npz'))
+        self.assertEqual(self._saved_identity(), gallery._get_ann_identity(encoding_gallery))
+        self.assertEqual(len(IVFIndex.load(gallery.get_ann_index_path())), len(encoding_gallery))
+
+    def test_matching_index_is_reused(self):
+        gallery.get_gallery()
+        with mock.patch.object(IVFIndex, 'build', wraps=IVFIndex.build) as build:
+            self._load_gallery()
+        build.assert_not_called()
+
+    def test_index_is_rebuilt_when_the_identity_changes(self):
+        old_identity = gallery._get_ann_identity(gallery.get_gallery())
+        with database.transaction() as conn:
+            # Rowids are reused after a deletion, only the DB fingerprint tells the rows apart
+            conn.execute("DELETE FROM FACE_ENCODING WHERE ENCODING_ID = (SELECT MAX(ENCODING_ID) FROM FACE_ENCODING)")
+        encoding_gallery = self._load_gallery()
+        new_identity = gallery._get_ann_identity(encoding_gallery)
+        self.assertNotEqual(new_identity, old_identity)
+        self.assertEqual(encoding_gallery.ann_index.identity, new_identity)
+        self.assertEqual(self._saved_identity(), new_identity)
+        self.assertEqual(len(IVFIndex.load(gallery.get_ann_index_path())), len(encoding_gallery))
+
+    def test_index_is_rebuilt_when_the_precision_changes(self):
+        old_identity = gallery._get_ann_identity(gallery.get_gallery())
+        encoding_precision.migrate_precision('float32')
+        encoding_gallery = gallery.get_gallery()
+        self.assertEqual(encoding_gallery.precision, 'float32')
+        self.assertNotEqual(encoding_gallery.ann_index.identity, old_identity)
+        self.assertEqual(self._saved_identity(), gallery._get_ann_identity(encoding_gallery))
+
+    def test_stale_index_is_never_loaded(self):
+        encoding_gallery = gallery.get_gallery()
+        # Indexes over the same number of rows: one of another gallery, one saved before identities were recorded
+        for identity in ('another gallery', None):
+            with self.subTest(identity=identity):
+                stale = IVFIndex.build(np.zeros_like(encoding_gallery.encodings), encoding_gallery.last_rowid,
+                                       identity=identity)
+                stale.save(gallery.get_ann_index_path())
+                encoding_gallery = self._load_gallery()
+                self.assertEqual(encoding_gallery.ann_index.identity, gallery._get_ann_identity(encoding_gallery))
+                self.assertFalse(np.array_equal(encoding_gallery.ann_index.centroids, stale.centroids))
+                self.assertEqual(self._saved_identity(), gallery._get_ann_identity(encoding_gallery))
+
+    def test_index_of_another_db_is_never_loaded(self):
+        gallery.get_gallery()
+        other_db_path = os.path.join(self.directory, 'other.db')
+        database.close_connection()  # Checkpoints the WAL into the DB file
+        os.rename(database.get_db_path(), other_db_path)
+        database.set_db_path(other_db_path)
+        # Same rows and fingerprint, but the index file belongs to the DB's old path
+        os.rename(os.path.join(self.directory, 'test_ivf.npz'), gallery.get_ann_index_path())
+        with mock.patch.object(IVFIndex, 'build', wraps=IVFIndex.build) as build:
+            encoding_gallery = self._load_gallery()
+        build.assert_called_once()
+        self.assertEqual(encoding_gallery.ann_index.identity, gallery._get_ann_identity(encoding_gallery))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+Tests of the inline Rekognition path: images are re-encoded under Rekognition's inline size limit and sent as Bytes,
+with the AWS client stubbed by botocore's Stubber.
+"""
+
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from botocore.stub import Stubber
+from PIL import Image
+
+from src import aws_clients
+from src import aws_rekognition
+from src import rekognition_cache
+
+CELEBRITY_RESPONSE = {
+    'CelebrityFaces': [{'Name': 'Tom Hanks', 'Id': '1', 'MatchConfidence': 99.5,
+                        'Face': {'BoundingBox': {'Width': 0.5, 'Height': 0.5, 'Left': 0.25, 'Top': 0.25}}}],
+    'UnrecognizedFaces': [],
+}
+
+
+class AWSRekognitionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        rekognition_cache.configure_rekognition_cache(path=os.path.join(self.directory.name, 'rekognition_cache.db'))
+        patcher = mock.patch.object(aws_clients, 'get_env_vars', return_value=('access', 'secret', 'bucket'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        aws_clients.clear_clients()
+        self.addCleanup(aws_clients.clear_clients)
+
+        client = aws_clients.get_client('rekognition', aws_clients.REKOGNITION_REGION)
+        self.stubber = Stubber(client)
+        self.stubber.activate()
+        self.addCleanup(self.stubber.deactivate)
+
+    def tearDown(self):
+        rekognition_cache.configure_rekognition_cache()  # Closes the connection to the temporary cache
+        self.directory.cleanup()
+
+    def _write_image(self, size, noise=False):
+        """
+        Write an RGB image, random noise (which JPEG compresses poorly) or a flat color, to the temporary directory.
+        """
+        if noise:
+            pixels = np.random.default_rng(0).integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+            img = Image.fromarray(pixels)
+        else:
+            img = Image.new('RGB', size, (120, 80, 40))
+        path = os.path.join(self.directory.name, 'image.png')
+        img.save(path)
+        return path
+
+    def test_inline_detection(self):
+        path = self._write_image((64, 48))
+        image_hash = rekognition_cache.hash_image(path)
+        image_bytes = aws_rekognition.encode_image(path)
+        self.stubber.add_response('recognize_celebrities', CELEBRITY_RESPONSE, {'Image': {'Bytes': image_bytes}})
+
+        detected = aws_rekognition.detect_labels_from_bytes(image_bytes, image_hash=image_hash)
+        self.assertEqual(detected, aws_rekognition.AWSPersonTup('Tom Hanks', 99.5))
+        self.stubber.assert_no_pending_responses()
+        # Looked up again from the cache, without calling Rekognition
+        self.assertEqual(aws_rekognition.get_cached_detection(image_hash), detected)
+
+    def test_inline_detection_error(self):
+        path = self._write_image((64, 48))
+        image_bytes = aws_rekognition.encode_image(path)
+        self.stubber.add_client_error('recognize_celebrities', 'InvalidImageFormatException',
+                                      expected_params={'Image': {'Bytes': image_bytes}})
+
+        self.assertFalse(aws_rekognition.detect_labels_from_bytes(image_bytes, image_hash='hash'))
+        self.stubber.assert_no_pending_responses()
+        self.assertIsNone(aws_rekognition.get_cached_detection('hash'))  # Errors are not cached
+
+    def test_downscaled_to_max_dimension(self):
+        path = self._write_image((4000, 3000))
+        with Image.open(io.BytesIO(aws_rekognition.encode_image(path))) as img:
+            self.assertEqual(img.size, (aws_rekognition.MAX_IMAGE_DIMENSION, 1440))
+            self.assertEqual(img.mode, 'L')
+
+    def test_single_decode_matches_file_helpers(self):
+        path = self._write_image((4000, 3000), noise=True)
+        image = aws_rekognition.decode_image(path)
+        self.assertEqual(rekognition_cache.hash_pixels(image.array),
+                         rekognition_cache.hash_image(path, max_dimension=aws_rekognition.MAX_IMAGE_DIMENSION))
+        self.assertEqual(aws_rekognition.encode_pixels(image.array), aws_rekognition.encode_image(path))
+
+    def test_full_resolution_hash_is_unchanged(self):
+        path = self._write_image((64, 48), noise=True)
+        with Image.open(path) as img:
+            grayscale = img.convert('L')
+        self.assertEqual(rekognition_cache.hash_image(path), rekognition_cache.hash_pixels(np.asarray(grayscale)))
+
+    def test_oversized_image_is_reencoded_at_lower_quality(self):
+        path = self._write_image((800, 600), noise=True)
+        full_quality = aws_rekognition.encode_image(path)
+        max_bytes = len(full_quality) - 1
+        image_bytes = aws_rekognition.encode_image(path, max_bytes=max_bytes)
+        self.assertLessEqual(len(image_bytes), max_bytes)
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            self.assertEqual(img.size, (800, 600))
+
+        # Still sent inline rather than through S3
+        self.stubber.add_response('recognize_celebrities', CELEBRITY_RESPONSE, {'Image': {'Bytes': image_bytes}})
+        self.assertEqual(aws_rekognition.detect_labels_from_bytes(image_bytes).name, 'Tom Hanks')
+        self.stubber.assert_no_pending_responses()
+
+    def test_oversized_image_is_downscaled(self):
+        path = self._write_image((800, 600), noise=True)
+        lowest_quality = aws_rekognition.encode_image(path, quality=aws_rekognition.FALLBACK_JPEG_QUALITIES[-1])
+        max_bytes = len(lowest_quality) // 2
+        image_bytes = aws_rekognition.encode_image(path, max_bytes=max_bytes)
+        self.assertLessEqual(len(image_bytes), max_bytes)
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            self.assertLess(img.size[0], 800)
+
+        self.stubber.add_response('recognize_celebrities', CELEBRITY_RESPONSE, {'Image': {'Bytes': image_bytes}})
+        self.assertEqual(aws_rekognition.detect_labels_from_bytes(image_bytes).name, 'Tom Hanks')
+        self.stubber.assert_no_pending_responses()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+"""
+Tests of the encoding storage precisions: the precision a blob was stored at is inferred from its size, and migrating a
+float64 DB to float32, float16 or int8 keeps identifications the same.
+"""
+
+import unittest
+import warnings
+
+import numpy as np
+
+from src import conversions
+from src import database
+from src import encoding_precision
+from src import gallery
+from tests.helpers import use_temporary_db
+
+REDUCED_PRECISIONS = ('float32', 'float16', 'int8')
+# Largest error of a decoded value, int8 errors are bounded by half a quantization step instead
+DECODE_TOLERANCES = {'float64': 0, 'float32': 1e-7, 'float16': 1e-3}
+
+
+def make_clear_people(seed=13):
+    """
+    Build clusters of encodings with a query near every cluster, all of them clear of the tolerance so a lossy
+    precision cannot change the identification.
+
+    :return: Encodings of every person and the queries
+    :rtype: dict{str, list(ndarray(128,))}, list(ndarray(128,))
+    """
+    rng = np.random.default_rng(seed)
+    people = {}
+    queries = []
+    for index in range(20):
+        center = rng.normal(0, 0.1, conversions.ndarray_shape)
+        people[f'person_{index}'] = list(center + rng.normal(0, 0.015, (2 + index % 4,) + conversions.ndarray_shape))
+        queries.append(center + rng.normal(0, 0.01, conversions.ndarray_shape))
+    # Exact duplicates of stored encodings and a query matching nobody
+    queries += [people['person_3'][1].copy(), people['person_8'][0].copy()]
+    queries.append(rng.normal(0, 0.1, conversions.ndarray_shape))
+    return people, queries
+
+
+class DecodeTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.encodings = rng.normal(0, 0.1, (3,) + conversions.ndarray_shape)
+        self.scale = conversions.compute_quantization_scale(self.encodings)
+
+    def test_precision_is_inferred_from_the_blob_size(self):
+        for precision, item_size in (('float64', 8), ('float32', 4), ('float16', 2), ('int8', 1)):
+            with self.subTest(precision=precision):
+                blob = conversions.encode_ndarray_to_memoryview(self.encodings[0], precision, self.scale).tobytes()
+                self.assertEqual(len(blob), 128 * item_size)
+                decoded = conversions.decode_memoryview_to_ndarray(blob, scale=self.scale)
+                self.assertEqual(decoded.shape, conversions.ndarray_shape)
+                self.assertEqual(decoded.dtype, np.float64 if precision == 'float64' else np.float32)
+                tolerance = self.scale.max() / 2 + 1e-7 if precision == 'int8' else DECODE_TOLERANCES[precision]
+                np.testing.assert_allclose(decoded, self.encodings[0], rtol=0, atol=tolerance)
+
+    def test_concatenated_blobs(self):
+        for precision in conversions.ENCODING_PRECISIONS:
+            with self.subTest(precision=precision):
+                blob = b''.join(conversions.encode_ndarray_to_memoryview(encoding, precision, self.scale).tobytes()
+                                for encoding in self.encodings)
+                decoded = conversions.decode_memoryview_to_ndarray(blob, count=3, scale=self.scale)
+                np.testing.assert_array_equal(decoded, conversions.round_trip_encoding(self.encodings, precision,
+                                                                                       self.scale))
+
+    def test_invalid_blobs(self):
+        with self.assertRaises(ValueError):
+            conversions.decode_memoryview_to_ndarray(b'\0' * 128 * 3)  # 3 bytes per value
+        with self.assertRaises(ValueError):
+            conversions.decode_memoryview_to_ndarray(b'\0' * 128)  # int8 without a scale
+
+    def test_values_outside_the_int8_scale_are_clipped(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            blob = conversions.encode_ndarray_to_memoryview(self.encodings[0] * 2, 'int8', self.scale)
+        self.assertEqual(len(caught), 1)
+        decoded = conversions.decode_memoryview_to_ndarray(blob, scale=self.scale)
+        self.assertLessEqual(np.abs(decoded).max(), (self.scale * 127).max() + 1e-6)
+
+
+class MigrateTest(unittest.TestCase):
+    def setUp(self):
+        self.people, self.queries = make_clear_people()
+        use_temporary_db(self, self.people)
+        self.float64_results = [gallery.get_gallery().identify(query) for query in self.queries]
+
+    def _stored_blob_sizes(self):
+        rows = database.get_connection().execute("SELECT DISTINCT LENGTH(ENCODING) FROM FACE_ENCODING").fetchall()
+        return {row[0] for row in rows}
+
+    def test_float64_results(self):
+        # The queries exercise accepted people, exact duplicates and no match
+        names = [name for name, _ in self.float64_results]
+        self.assertIn(gallery.UNKNOWN_PERSON, names)
+        self.assertIn(('person_3', gallery.MAX_INT), self.float64_results)
+        self.assertEqual(names[:20], list(self.people))
+
+    def test_migrate_to_reduced_precision(self):
+        for precision in REDUCED_PRECISIONS:
+            with self.subTest(precision=precision):
+                use_temporary_db(self, self.people)
+                self.assertEqual(encoding_precision.migrate_precision(precision), sum(map(len, self.people.values())))
+
+                conn = database.get_connection()
+                stored_precision, scale = encoding_precision.get_encoding_precision(conn)
+                self.assertEqual(stored_precision, precision)
+                self.assertEqual(scale is None, precision != 'int8')
+                item_size = np.dtype(conversions.get_encoding_precision_dtype(precision)).itemsize
+                self.assertEqual(self._stored_blob_sizes(), {128 * item_size})
+
+                encoding_gallery = gallery.get_gallery()
+                self.assertEqual(encoding_gallery.precision, precision)
+                self.assertEqual([encoding_gallery.identify(query) for query in self.queries], self.float64_results)
+                names, counts = encoding_gallery.identify_many(np.array(self.queries))
+                self.assertEqual(list(zip(names, counts.tolist())), self.float64_results)
+
+    def test_migrate_back_to_float64(self):
+        encoding_precision.migrate_precision('int8')
+        encoding_precision.migrate_precision('float64')
+        self.assertEqual(self._stored_blob_sizes(), {128 * 8})
+        self.assertEqual(encoding_precision.get_encoding_precision(database.get_connection()), ('float64', None))
+        # Converting back does not restore the original values, so former exact duplicates are ordinary matches now
+        self.assertEqual([gallery.get_gallery().identify(query)[0] for query in self.queries],
+                         [name for name, _ in self.float64_results])
+
+
+if __name__ == '__main__':
+    unittest.main()
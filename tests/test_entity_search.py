@@ -0,0 +1,263 @@
+"""
+Tests of the entity search trees against the original per-hop search, with a fake SPARQL client answering from a
+random graph: every hop asked with its own call_dbpedia query, no prefetching and no memo.
+"""
+
+import os
+import random
+import re
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest import mock
+
+from src import entity_search
+from src import knowledge_store
+from src import sparql_cache
+from src import sparql_client
+from src.entity_search import Node
+
+RESOURCE_PREFIX = 'http://dbpedia.org/resource/'
+NAME = 'george_w._bush'
+ROOT = f'{RESOURCE_PREFIX}George_W._Bush'
+QUESTIONS = ('child', 'spouse', 'birthPlace', 'areaCode')
+N_SEEDS = 20
+
+SINGLE_PATTERN = re.compile(r'<([^>]*)> <http://dbpedia\.org/ontology/(\w+)> \?answer')
+VALUES_PATTERN = re.compile(r'VALUES \?s \{(.*?)\}', re.S)
+QUESTION_PATTERN = re.compile(r'<http://dbpedia\.org/ontology/(\w+)>')
+
+
+def make_graph(seed):
+    """
+    Build a random graph over a small pool of resources, so resources are reached several times in a tree. Some
+    questions have no answer, a literal answer or an empty answer.
+
+    :return: Answers of every (subject URI, question) pair
+    :rtype: dict{tuple(str, str), list(str)}
+    """
+    rng = random.Random(seed)
+    pool = [f'{RESOURCE_PREFIX}Resource_{index}' for index in range(8)]
+    graph = {}
+    for subject in [ROOT] + pool:
+        for question in QUESTIONS:
+            draw = rng.random()
+            if draw < 0.2:
+                continue
+            if draw < 0.3:
+                graph[(subject, question)] = [f'{rng.randint(1900, 2000)}-01-01']
+            elif draw < 0.35:
+                graph[(subject, question)] = ['']
+            else:
+                graph[(subject, question)] = rng.sample(pool, rng.randint(1, 3))
+    return graph
+
+
+def write_ntriples(graph, file_path):
+    """
+    Write a graph as an N-Triples dump of DBpedia ontology properties.
+    """
+    with open(file_path, 'w', encoding='utf-8') as dump:
+        for (subject, question), answers in graph.items():
+            for answer in answers:
+                term = f'<{answer}>' if answer.startswith(RESOURCE_PREFIX) else f'"{answer}"'
+                dump.write(f'<{subject}> <{knowledge_store.ONTOLOGY_PREFIX}{question}> {term} .\n')
+
+
+def make_queries(seed):
+    """
+    Draw a query of one, two and three hops.
+    """
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(QUESTIONS) for _ in range(hops)) for hops in (1, 2, 3)]
+
+
+class FakeSparqlClient:
+    """
+    SPARQL client answering the per-hop, batched VALUES and compiled property-path queries of entity_search from a
+    graph, the way DBpedia would. Literals are never the subject of a triple.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        self.max_concurrency = 4
+        self.fail_compiled = False
+        self.query_kinds = []
+        self._lock = threading.Lock()
+
+    def select(self, query, timeout=None, retry_timeouts=True):
+        if 'OPTIONAL' in query:
+            kind = 'compiled'
+        else:
+            kind = 'batched' if 'VALUES' in query else 'single'
+        with self._lock:
+            self.query_kinds.append(kind)
+        if kind == 'compiled':
+            if self.fail_compiled:
+                raise sparql_client.SparqlError('Timed out')
+            root = re.search(r'<(http://dbpedia\.org/resource/[^>]*)>', query).group(1)
+            return self._compiled_rows(root, QUESTION_PATTERN.findall(query))
+        if kind == 'batched':
+            question = QUESTION_PATTERN.search(query).group(1)
+            subjects = re.findall(r'<([^>]*)>', VALUES_PATTERN.search(query).group(1))
+            return [{'s': {'value': subject}, 'answer': {'value': answer}}
+                    for subject in subjects for answer in self.graph.get((subject, question), [])]
+        subject, question = SINGLE_PATTERN.search(query).groups()
+        return [{'answer': {'value': answer}} for answer in self.graph.get((subject, question), [])]
+
+    def _compiled_rows(self, subject, questions, depth=0):
+        """
+        Evaluate the nested OPTIONALs of a compiled query: one row per path, deeper variables unbound where a path
+        stops early.
+        """
+        if depth == len(questions) or (subject, questions[depth]) not in self.graph:
+            return [{}]
+        rows = []
+        for answer in self.graph[(subject, questions[depth])]:
+            deeper_rows = self._compiled_rows(answer, questions, depth + 1) if answer else [{}]
+            rows += [{f'a{depth}': {'value': answer}, **row} for row in deeper_rows]
+        return rows
+
+
+def reference_tree(query):
+    """
+    Build the tree of a query the way entity search did before prefetching and memoization: one call_dbpedia query
+    per hop and resource.
+
+    :return: Dictionary representation of the tree
+    :rtype: dict
+    """
+    dbpedia_name = entity_search.conversions.get_dbpedia_name(NAME)
+    root = entity_search._run_query(dbpedia_name, query.split(), Node(dbpedia_name, 'root'))
+    root.set_root()
+    return entity_search.tree_to_dict(root)
+
+
+class EntitySearchTestCase(unittest.TestCase):
+    """
+    Answers every query from the graph of the test, with the SPARQL answer cache disabled.
+    """
+    def setUp(self):
+        sparql_cache.configure_cache(enabled=False)
+        self.addCleanup(sparql_cache.configure_cache)
+        patcher = mock.patch.object(sparql_client, 'get_sparql_client')
+        self.get_sparql_client = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use_graph(self, seed):
+        """
+        Answer the following queries from the random graph of a seed.
+
+        :return: Fake client answering the queries
+        :rtype: FakeSparqlClient
+        """
+        client = FakeSparqlClient(make_graph(seed))
+        self.get_sparql_client.return_value = client
+        return client
+
+    def assertTreeEqual(self, root, query):
+        self.assertEqual(entity_search.tree_to_dict(root), reference_tree(query))
+
+
+class MemoizedSearchTest(EntitySearchTestCase):
+    def test_search_matches_the_per_hop_reference(self):
+        for seed in range(N_SEEDS):
+            self.use_graph(seed)
+            for query in make_queries(seed):
+                with self.subTest(seed=seed, query=query):
+                    self.assertTreeEqual(entity_search.search([query], NAME)[0], query)
+
+    def test_memo_shared_by_several_queries(self):
+        for seed in range(N_SEEDS):
+            self.use_graph(seed)
+            queries = make_queries(seed)
+            with self.subTest(seed=seed):
+                # Queries run together, and queries run one after another sharing the memo as main() does
+                for root, query in zip(entity_search.search(queries, NAME), queries):
+                    self.assertTreeEqual(root, query)
+                memo = {}
+                for query in queries + queries:
+                    self.assertTreeEqual(entity_search.search([query], NAME, memo=memo)[0], query)
+
+    def test_memo_is_used(self):
+        # The graphs reach resources several times, otherwise the tests above would not exercise the memo
+        shared_subtrees = 0
+        for seed in range(N_SEEDS):
+            self.use_graph(seed)
+            for query in make_queries(seed):
+                # A memoized subtree is reached through several parents, so the tree has fewer distinct nodes than paths
+                paths, nodes = 0, set()
+                stack = [entity_search.search([query], NAME)[0]]
+                while stack:
+                    node = stack.pop()
+                    paths += 1
+                    nodes.add(id(node))
+                    stack += node.get_children()
+                shared_subtrees += len(nodes) < paths
+        self.assertGreater(shared_subtrees, 0)
+
+
+class StreamedSearchTest(EntitySearchTestCase):
+    def _stream_tree(self, query):
+        """
+        Run a query with stream_queries and assemble the tree from the NDJSON lines it prints, skipping the messages
+        printed between them (e.g. when the compiled query fails).
+        """
+        output = StringIO()
+        with redirect_stdout(output):
+            entity_search.stream_queries([query], NAME, output_format='none')
+        return entity_search.assemble_tree(line for line in output.getvalue().splitlines() if line.startswith('{'))
+
+    def test_compiled_query(self):
+        for seed in range(N_SEEDS):
+            client = self.use_graph(seed)
+            for query in make_queries(seed):
+                with self.subTest(seed=seed, query=query):
+                    reference = reference_tree(query)
+                    client.query_kinds.clear()
+                    self.assertEqual(entity_search.tree_to_dict(entity_search.search([query], NAME)[0]), reference)
+                    self.assertEqual(client.query_kinds, ['compiled'])
+                    client.query_kinds.clear()
+                    self.assertEqual(entity_search.tree_to_dict(self._stream_tree(query)), reference)
+                    self.assertEqual(client.query_kinds, ['compiled'])
+
+    def test_per_level_queries(self):
+        # A failed compiled query falls back to batched queries, one level after another
+        for seed in range(N_SEEDS):
+            client = self.use_graph(seed)
+            client.fail_compiled = True
+            for query in make_queries(seed):
+                with self.subTest(seed=seed, query=query), redirect_stdout(StringIO()):
+                    reference = reference_tree(query)
+                    client.query_kinds.clear()
+                    self.assertEqual(entity_search.tree_to_dict(entity_search.search([query], NAME)[0]), reference)
+                    self.assertEqual(client.query_kinds[0], 'compiled')
+                    self.assertIn('batched', client.query_kinds)
+                    self.assertEqual(entity_search.tree_to_dict(self._stream_tree(query)), reference)
+
+    def test_knowledge_store(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(knowledge_store.disable_knowledge_store)
+        for seed in range(N_SEEDS):
+            client = self.use_graph(seed)
+            queries = make_queries(seed)
+            references = [reference_tree(query) for query in queries]
+            dump_path = os.path.join(directory.name, f'dump_{seed}.nt')
+            store_path = os.path.join(directory.name, f'dbpedia_{seed}.db')
+            write_ntriples(client.graph, dump_path)
+            with redirect_stdout(StringIO()):
+                knowledge_store.import_ntriples(dump_path, store_path)
+            knowledge_store.enable_knowledge_store(store_path)
+            client.query_kinds.clear()
+            for query, reference in zip(queries, references):
+                with self.subTest(seed=seed, query=query):
+                    self.assertEqual(entity_search.tree_to_dict(entity_search.search([query], NAME)[0]), reference)
+                    self.assertEqual(entity_search.tree_to_dict(self._stream_tree(query)), reference)
+            self.assertEqual(client.query_kinds, [])
+            knowledge_store.disable_knowledge_store()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+"""
+Tests of the vectorized gallery lookups against a naive reference: the original per-person loop over
+face_recognition.compare_faces (tolerance 0.4, 60% majority, MAX_INT for an exact duplicate, ties to the person seen
+first).
+"""
+
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from src import conversions
+from src import gallery
+from src.gallery import EncodingGallery, MATCH_TOLERANCE, MAX_INT, UNKNOWN_PERSON
+
+N_PEOPLE = 40
+
+
+def reference_accepted(people, encoding):
+    """
+    Vote the way R-IBES did before the gallery existed: compare an encoding to every person's encodings with
+    face_recognition.compare_faces and accept the people with a 60% majority of matches.
+
+    :return: Match count of every accepted person, in insertion order
+    :rtype: dict{str, int}
+    """
+    accepted = {}
+    for name, person_encodings in people.items():
+        # face_recognition.compare_faces(person_encodings, encoding, tolerance=0.4)
+        matches = list(np.linalg.norm(np.array(person_encodings) - encoding, axis=1) <= MATCH_TOLERANCE)
+        match_count, not_match_count = matches.count(True), matches.count(False)
+        if any(np.array_equal(encoding, person_encoding) for person_encoding in person_encodings):
+            match_count, not_match_count = MAX_INT, 0
+        match_rate = match_count / (match_count + not_match_count)
+        if match_rate >= 0.6 and match_count > not_match_count:
+            accepted[name] = match_count
+    return accepted
+
+
+def reference_identify(people, encoding):
+    """
+    Identify an encoding like the original loop: the accepted person with the most matches, ties going to the person
+    seen first.
+    """
+    max_match = 0
+    max_match_name = UNKNOWN_PERSON
+    for name, match_count in reference_accepted(people, encoding).items():
+        if match_count > max_match:
+            max_match, max_match_name = match_count, name
+    return max_match_name, max_match
+
+
+def build_gallery(people):
+    """
+    Build a float64 gallery holding the encodings of `people` in insertion order.
+    """
+    rows = []
+    for name, person_encodings in people.items():
+        for encoding in person_encodings:
+            rows.append((len(rows) + 1, name, conversions.encode_ndarray_to_memoryview(encoding).tobytes()))
+    return EncodingGallery(rows)
+
+
+def random_directions(rng, count):
+    """
+    Draw unit vectors in random directions.
+    """
+    directions = rng.normal(size=(count,) + conversions.ndarray_shape)
+    return directions / np.linalg.norm(directions, axis=1, keepdims=True)
+
+
+def make_people(seed=7):
+    """
+    Build well separated clusters of encodings, with a query near every cluster whose distances to the cluster's
+    encodings straddle the tolerance, so the majority rule decides.
+
+    :return: Encodings of every person and the queries
+    :rtype: dict{str, list(ndarray(128,))}, list(ndarray(128,))
+    """
+    rng = np.random.default_rng(seed)
+    people = {}
+    queries = []
+    for index in range(N_PEOPLE):
+        center = rng.normal(0, 0.1, conversions.ndarray_shape)
+        people[f'person_{index}'] = list(center + rng.normal(0, 0.02, (1 + index % 6,) + conversions.ndarray_shape))
+        queries.append(center + rng.normal(0, 0.025, conversions.ndarray_shape))
+    return people, queries
+
+
+def add_boundary_people(people, seed=11):
+    """
+    Add people whose encodings sit at (or within a rounding error of) exactly the tolerance from a query.
+
+    :return: Queries at the tolerance boundary of the added people
+    :rtype: list(ndarray(128,))
+    """
+    rng = np.random.default_rng(seed)
+    queries = []
+    offsets = (-1e-9, -1e-15, 0.0, 1e-15, 1e-9)
+    for index in range(8):
+        query = rng.normal(0, 0.1, conversions.ndarray_shape)
+        # Rotating the offsets moves the vote across the 60% majority from one person to the next
+        person_offsets = offsets[index % len(offsets):] + offsets[:index % len(offsets)]
+        people[f'boundary_{index}'] = list(query + random_directions(rng, len(offsets))
+                                           * (MATCH_TOLERANCE + np.array(person_offsets))[:, None])
+        queries.append(query)
+    return queries
+
+
+class GalleryIdentifyTest(unittest.TestCase):
+    def setUp(self):
+        self.people, self.queries = make_people()
+
+    def assertMatchesReference(self, people, queries):
+        encoding_gallery = build_gallery(people)
+        for query in queries:
+            with self.subTest(query=query[:2]):
+                self.assertEqual(encoding_gallery.identify(query), reference_identify(people, query))
+
+    def test_clusters(self):
+        self.assertMatchesReference(self.people, self.queries)
+        results = [reference_identify(self.people, query)[0] for query in self.queries]
+        # The queries are built so that the majority rule accepts some people and rejects others
+        self.assertGreater(results.count(UNKNOWN_PERSON), 0)
+        self.assertLess(results.count(UNKNOWN_PERSON), len(results))
+
+    def test_exact_duplicate(self):
+        duplicate = self.people['person_5'][1].copy()
+        # The duplicate's person wins with MAX_INT even when their other encodings do not match
+        self.people['person_5'][0] = self.people['person_5'][0] + 1
+        self.assertMatchesReference(self.people, [duplicate])
+        self.assertEqual(build_gallery(self.people).identify(duplicate), ('person_5', MAX_INT))
+
+    def test_majority_rule(self):
+        rng = np.random.default_rng(2)
+        query = rng.normal(0, 0.1, conversions.ndarray_shape)
+        # 3 of 5 encodings match (60%): accepted; 2 of 5 match: rejected even though it has the most matches
+        self.people['majority'] = list(query + random_directions(rng, 5) * np.array([0.3, 0.3, 0.3, 0.6, 0.6])[:, None])
+        self.people['minority'] = list(query + random_directions(rng, 5) * np.array([0.1, 0.1, 0.6, 0.6, 0.6])[:, None])
+        self.assertMatchesReference(self.people, [query])
+        self.assertEqual(build_gallery(self.people).identify(query), ('majority', 3))
+
+        del self.people['majority']
+        self.assertMatchesReference(self.people, [query])
+        self.assertEqual(build_gallery(self.people).identify(query), (UNKNOWN_PERSON, 0))
+
+    def test_tie_goes_to_the_person_seen_first(self):
+        rng = np.random.default_rng(3)
+        query = rng.normal(0, 0.1, conversions.ndarray_shape)
+        self.people['tie_a'] = list(query + random_directions(rng, 3) * 0.2)
+        self.people['tie_b'] = list(query + random_directions(rng, 3) * 0.2)
+        self.assertMatchesReference(self.people, [query])
+        self.assertEqual(build_gallery(self.people).identify(query), ('tie_a', 3))
+
+    def test_no_match(self):
+        query = np.random.default_rng(5).normal(0, 0.1, conversions.ndarray_shape)
+        self.assertMatchesReference(self.people, [query])
+        self.assertEqual(build_gallery(self.people).identify(query), (UNKNOWN_PERSON, 0))
+
+    def test_empty_gallery(self):
+        self.assertEqual(EncodingGallery().identify(self.queries[0]), (UNKNOWN_PERSON, 0))
+
+
+class GalleryPrefilterTest(unittest.TestCase):
+    def setUp(self):
+        self.people, queries = make_people()
+        self.queries = queries + add_boundary_people(self.people)
+
+    def _prefiltered_identify(self, encoding_gallery, query):
+        """
+        Identify a query voting only over the prefilter's candidates, whatever their number.
+        """
+        candidate_labels = encoding_gallery._get_prefilter_candidates(encoding_gallery.round_trip(query))
+        best, score = encoding_gallery._select_best(*encoding_gallery.compare(query, candidate_labels))
+        return (encoding_gallery.names[best] if score else UNKNOWN_PERSON), int(score), candidate_labels
+
+    def test_prefilter_keeps_every_accepted_person(self):
+        encoding_gallery = build_gallery(self.people)
+        for query in self.queries:
+            with self.subTest(query=query[:2]):
+                name, score, candidate_labels = self._prefiltered_identify(encoding_gallery, query)
+                self.assertEqual((name, score), reference_identify(self.people, query))
+                candidates = {encoding_gallery.names[label] for label in candidate_labels}
+                self.assertLessEqual(set(reference_accepted(self.people, query)), candidates)
+                # The prefilter must actually prune, otherwise identify() falls back to the whole gallery
+                self.assertLessEqual(len(candidate_labels), len(encoding_gallery.names) // 2)
+                self.assertEqual(encoding_gallery.identify(query), reference_identify(self.people, query))
+
+    def test_prefilter_after_extend(self):
+        # Bounds of people who gain encodings after the gallery was built are recomputed before the next lookup
+        rows = list(build_gallery(self.people).encodings)
+        names = [name for name, person_encodings in self.people.items() for _ in person_encodings]
+        encoding_gallery = EncodingGallery()
+        for chunk in np.array_split(np.arange(len(rows)), 4):
+            encoding_gallery.extend([(int(row) + 1, names[row], conversions.encode_ndarray_to_memoryview(rows[row]))
+                                     for row in chunk])
+            encoding_gallery.identify(self.queries[0])  # Computes the bounds of the rows added so far
+        for query in self.queries:
+            with self.subTest(query=query[:2]):
+                self.assertEqual(self._prefiltered_identify(encoding_gallery, query)[:2],
+                                 reference_identify(self.people, query))
+
+    def test_boundary_queries_exercise_both_sides(self):
+        # Some boundary people are accepted and some rejected, so the tolerance comparison really decides
+        results = [reference_identify(self.people, query)[0] for query in self.queries[N_PEOPLE:]]
+        self.assertGreater(results.count(UNKNOWN_PERSON), 0)
+        self.assertLess(results.count(UNKNOWN_PERSON), len(results))
+
+
+class GalleryIdentifyManyTest(unittest.TestCase):
+    def setUp(self):
+        self.people, queries = make_people()
+        self.queries = queries + add_boundary_people(self.people)
+        # An exact duplicate and a query matching nobody
+        self.queries += [self.people['person_3'][2].copy(), np.random.default_rng(5).normal(0, 0.1, 128)]
+        self.encoding_gallery = build_gallery(self.people)
+
+    def assertMatchesReference(self, names, counts):
+        for query, name, count in zip(self.queries, names, counts):
+            with self.subTest(query=query[:2]):
+                self.assertEqual((name, int(count)), reference_identify(self.people, query))
+
+    def test_identify_many(self):
+        self.assertMatchesReference(*self.encoding_gallery.identify_many(np.array(self.queries)))
+
+    def test_identify_many_in_small_blocks(self):
+        # Several query and gallery blocks, with counts accumulated across gallery blocks
+        for query_block, gallery_block in ((1, 7), (5, 16), (64, 1)):
+            with self.subTest(query_block=query_block, gallery_block=gallery_block), \
+                    mock.patch.object(gallery, 'BATCH_QUERY_BLOCK', query_block), \
+                    mock.patch.object(gallery, 'BATCH_GALLERY_BLOCK', gallery_block):
+                self.assertMatchesReference(*self.encoding_gallery.identify_many(np.array(self.queries)))
+
+    def test_boundary_pairs_fall_in_the_recheck_band(self):
+        # The boundary queries put pairs where the matrix-product distance cannot be trusted, so the recheck decides
+        queries = np.array(self.queries)
+        encodings = self.encoding_gallery.encodings
+        gallery_norms = np.einsum('ij,ij->i', encodings, encodings)
+        squared_distances = (np.einsum('ij,ij->i', queries, queries)[:, None] + gallery_norms[None, :]
+                             - 2 * queries @ encodings.T)
+        band = gallery.RECHECK_BAND_EPS * np.finfo(encodings.dtype).eps * 2 * max(gallery_norms.max(), 1)
+        self.assertGreater(np.count_nonzero(np.abs(squared_distances - MATCH_TOLERANCE ** 2) <= band), 0)
+
+    def test_identify_many_agrees_with_identify(self):
+        names, counts = self.encoding_gallery.identify_many(np.array(self.queries))
+        self.assertEqual([self.encoding_gallery.identify(query) for query in self.queries],
+                         [(name, int(count)) for name, count in zip(names, counts)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Tests of the local DBpedia knowledge store: importing N-Triples dumps and answering questions from them.
+"""
+
+import gzip
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from src import knowledge_store
+
+SUBJECT = 'http://dbpedia.org/resource/Tom_Hanks'
+DUMP = f'''<{SUBJECT}> <http://dbpedia.org/ontology/spouse> <http://dbpedia.org/resource/Rita_Wilson> .
+<{SUBJECT}> <http://dbpedia.org/ontology/child> <http://dbpedia.org/resource/Colin_Hanks> .
+<{SUBJECT}> <http://dbpedia.org/ontology/child> <http://dbpedia.org/resource/Chet_Hanks> .
+<{SUBJECT}> <http://dbpedia.org/ontology/birthDate> "1956-07-09"^^<http://www.w3.org/2001/XMLSchema#date> .
+<{SUBJECT}> <http://dbpedia.org/ontology/alias> "Thomas \\"Tom\\" Hanks"@en .
+<{SUBJECT}> <http://xmlns.com/foaf/0.1/name> "Tom Hanks"@en .
+<{SUBJECT}> <http://dbpedia.org/ontology/child> <http://dbpedia.org/resource/Colin_Hanks> .
+'''
+
+
+class KnowledgeStoreTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(knowledge_store.disable_knowledge_store)
+        self.dump_path = os.path.join(directory.name, 'dump.nt')
+        self.store_path = os.path.join(directory.name, 'dbpedia.db')
+        with open(self.dump_path, 'w', encoding='utf-8') as dump:
+            dump.write(DUMP)
+
+    def _import(self, dump_path=None):
+        with redirect_stdout(StringIO()):
+            return knowledge_store.import_ntriples(dump_path or self.dump_path, self.store_path)
+
+    def _rows(self):
+        conn = sqlite3.connect(self.store_path)
+        try:
+            return conn.execute("SELECT SUBJECT, PREDICATE, OBJECT FROM TRIPLE ORDER BY rowid").fetchall()
+        finally:
+            conn.close()
+
+    def test_import(self):
+        # Ontology triples only, the repeated one once
+        self.assertEqual(self._import(), 5)
+        self.assertEqual(self._rows()[-1], (SUBJECT, 'alias', 'Thomas "Tom" Hanks'))
+        self.assertFalse(os.path.exists(self.store_path + knowledge_store.IMPORT_SUFFIX))
+
+    def test_importing_the_same_dump_again_adds_no_rows(self):
+        self._import()
+        rows = self._rows()
+        self.assertEqual(self._import(), 0)
+        self.assertEqual(self._rows(), rows)
+
+        # The same triples from a compressed copy of the dump
+        compressed_path = self.dump_path + '.gz'
+        with gzip.open(compressed_path, 'wt', encoding='utf-8') as dump:
+            dump.write(DUMP)
+        self.assertEqual(self._import(compressed_path), 0)
+        self.assertEqual(self._rows(), rows)
+
+    def test_get_answers(self):
+        self._import()
+        knowledge_store.enable_knowledge_store(self.store_path)
+        self.assertEqual(knowledge_store.get_answers(SUBJECT, 'child'),
+                         ['http://dbpedia.org/resource/Colin_Hanks', 'http://dbpedia.org/resource/Chet_Hanks'])
+        self.assertEqual(knowledge_store.get_answers(SUBJECT, 'birthDate'), ['1956-07-09'])
+        self.assertEqual(knowledge_store.get_answers(SUBJECT, 'deathDate'), ['UNKNOWN'])
+
+    def test_missing_store(self):
+        with self.assertRaises(FileNotFoundError):
+            knowledge_store.enable_knowledge_store(self.store_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
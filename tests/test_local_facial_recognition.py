@@ -0,0 +1,70 @@
+"""
+Tests of local face encoding: faces are found in the downscaled image but encoded at full resolution, like the
+encodings stored in the DB, and saved images are recorded under the name they are saved as.
+"""
+
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+from src import conversions
+from src import database
+from src import image_preprocessing
+from src import local_facial_recognition as lfr
+from tests.helpers import use_temporary_db
+
+IMAGE_SIZE = (2048, 1024)
+
+
+class EncodeFacesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = use_temporary_db(self)
+        self.image_path = os.path.join(self.directory, 'photo.png')
+        Image.new('RGB', IMAGE_SIZE, (200, 120, 80)).save(self.image_path)
+        self.encoding = np.random.default_rng(1).normal(0, 0.1, conversions.ndarray_shape)
+        image_preprocessing.set_max_dimension(1024)
+        self.addCleanup(image_preprocessing.set_max_dimension)
+
+    def _patch_face_recognition(self, locations):
+        patchers = [mock.patch.object(lfr.face_recognition, 'face_locations', return_value=locations),
+                    mock.patch.object(lfr.face_recognition, 'face_encodings',
+                                      return_value=[self.encoding] * len(locations))]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        return [patcher.start() for patcher in patchers]
+
+    def test_faces_are_encoded_at_full_resolution(self):
+        face_locations, face_encodings = self._patch_face_recognition([(100, 300, 200, 200)])
+        locations, encodings = lfr.generate_face_encodings(self.image_path)
+
+        self.assertEqual(face_locations.call_args.args[0].shape, (512, 1024, 3))
+        self.assertEqual(locations, [(200, 600, 400, 400)])
+        self.assertEqual(face_encodings.call_args.args[0].shape, (IMAGE_SIZE[1], IMAGE_SIZE[0], 3))
+        self.assertEqual(face_encodings.call_args.kwargs['known_face_locations'], locations)
+        np.testing.assert_array_equal(encodings[0], self.encoding)
+
+    def test_no_face(self):
+        self._patch_face_recognition([])
+        self.assertEqual(lfr.generate_face_encoding(self.image_path), [])
+
+    def test_saved_file_name_is_recorded(self):
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory)  # Images are saved under ./images
+        for save in (lambda: lfr.add_to_db(self.image_path, self.encoding, 'Jane Doe'),
+                     lambda: lfr.generate_face_encoding(self.image_path, 'Jane Doe')):
+            with self.subTest(save=save), mock.patch('sys.stdout'):
+                self._patch_face_recognition([(100, 300, 200, 200)])
+                with database.transaction() as conn:
+                    conn.execute("DELETE FROM FACE_ENCODING")
+                save()
+                file_name, = database.get_connection().execute("SELECT FILE_NAME FROM FACE_ENCODING").fetchone()
+                self.assertEqual(file_name, lfr.generate_file_name_strenc(self.image_path, self.encoding)[0])
+                normalized_name = conversions.get_normalized_name('Jane Doe')
+                self.assertTrue(os.path.exists(os.path.join('images', normalized_name, file_name)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+Tests of the forward migration of v1 (NAME_DIRECTORY/NAME_ENCODING) and v2 DB files to the current schema.
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+import numpy as np
+
+from src import conversions
+from src import create_db
+from src import database
+from src import gallery
+from src import migrate_db
+
+ENCODINGS = np.random.default_rng(4).normal(0, 0.1, (5,) + conversions.ndarray_shape)
+# (name, directory, encoding count) rows of a v1 DB, including a repeated name whose first row wins
+V1_DIRECTORY_ROWS = [('alice', './images/alice', 2), ('bob', './images/bob', 1), ('alice', './images/alice_2', 5)]
+# (name, encoding, file name, source) rows of a v1 DB; carol only appears in NAME_ENCODING
+V1_ENCODING_ROWS = [('alice', ENCODINGS[0], 'alice_0.jpg', 'user'), ('carol', ENCODINGS[1], 'carol_0.jpg', 'lfw'),
+                    ('bob', ENCODINGS[2], 'bob_0.jpg', 'aws'), ('alice', ENCODINGS[3], 'alice_1.jpg', 'user'),
+                    ('carol', ENCODINGS[4], 'carol_1.jpg', 'lfw')]
+
+
+def create_v1_db(db_path):
+    """
+    Write a DB the way create_db.py did before schema versions existed, and fill it.
+
+    :param db_path: Path of the DB file
+    :type db_path: str
+    """
+    conn = sqlite3.connect(db_path)
+    conn.execute('''CREATE TABLE NAME_DIRECTORY
+                    (NAME             TEXT    NOT NULL,
+                     DIRECTORY        TEXT    NOT NULL,
+                     ENCODING_COUNT   INT     NOT NULL);''')
+    conn.execute('''CREATE TABLE NAME_ENCODING
+                    (NAME         TEXT    NOT NULL,
+                     ENCODING     BLOB    NOT NULL,
+                     FILE_NAME    TEXT    NOT NULL,
+                     SOURCE       TEXT    NOT NULL);''')
+    conn.executemany("INSERT INTO NAME_DIRECTORY (NAME, DIRECTORY, ENCODING_COUNT) VALUES (?, ?, ?)",
+                     V1_DIRECTORY_ROWS)
+    conn.executemany("INSERT INTO NAME_ENCODING (NAME, ENCODING, FILE_NAME, SOURCE) VALUES (?, ?, ?, ?)",
+                     [(name, conversions.encode_ndarray_to_memoryview(encoding), file_name, source)
+                      for name, encoding, file_name, source in V1_ENCODING_ROWS])
+    conn.commit()
+    conn.close()
+
+
+class MigrateTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(database.set_db_path, database.get_db_path())
+        self.addCleanup(database.close_connection)
+        self.addCleanup(gallery.invalidate_gallery)
+        self.db_path = os.path.join(directory.name, 'test.db')
+        database.set_db_path(self.db_path)
+        gallery.invalidate_gallery()
+
+    def _migrate(self):
+        with redirect_stdout(StringIO()):
+            return migrate_db.migrate()
+
+    def _tables(self):
+        conn = database.get_connection()
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    def test_migrate_v1(self):
+        create_v1_db(self.db_path)
+        conn = database.get_connection()
+        self.assertEqual(migrate_db.get_schema_version(conn), 1)
+        self.assertTrue(self._migrate())
+
+        self.assertEqual(conn.execute("SELECT VERSION FROM SCHEMA_VERSION").fetchall(), [(create_db.SCHEMA_VERSION,)])
+        self.assertEqual(migrate_db.get_schema_version(conn), 3)
+        self.assertNotIn('NAME_DIRECTORY', self._tables())
+        self.assertNotIn('NAME_ENCODING', self._tables())
+        self.assertEqual(conn.execute("SELECT PERSON_ID, NAME, DIRECTORY, ENCODING_COUNT FROM PERSON "
+                                      "ORDER BY PERSON_ID").fetchall(),
+                         [(1, 'alice', './images/alice', 2), (2, 'bob', './images/bob', 1),
+                          (3, 'carol', './images/carol', 2)])
+
+        rows = conn.execute("SELECT ENCODING_ID, NAME, ENCODING, FILE_NAME, SOURCE FROM FACE_ENCODING "
+                            "JOIN PERSON USING (PERSON_ID) ORDER BY ENCODING_ID").fetchall()
+        self.assertEqual([row[0] for row in rows], [1, 2, 3, 4, 5])  # v1 rowids are kept
+        for row, (name, encoding, file_name, source) in zip(rows, V1_ENCODING_ROWS):
+            self.assertEqual((row[1], row[3], row[4]), (name, file_name, source))
+            np.testing.assert_array_equal(conversions.decode_memoryview_to_ndarray(row[2]), encoding)
+
+        self.assertEqual(gallery.get_gallery().identify(ENCODINGS[1]), ('carol', gallery.MAX_INT))
+
+    def test_fingerprint_triggers(self):
+        create_v1_db(self.db_path)
+        self._migrate()
+        conn = database.get_connection()
+        db_id, generation = conn.execute("SELECT DB_ID, GENERATION FROM GALLERY_GENERATION").fetchone()
+        self.assertEqual(generation, 0)
+        with database.transaction():
+            conn.execute("INSERT INTO FACE_ENCODING (PERSON_ID, ENCODING, FILE_NAME, SOURCE) VALUES (1, ?, 'a', 'b')",
+                         (conversions.encode_ndarray_to_memoryview(ENCODINGS[0]),))
+        self.assertEqual(conn.execute("SELECT GENERATION FROM GALLERY_GENERATION").fetchone()[0], 0)
+        with database.transaction():
+            conn.execute("DELETE FROM FACE_ENCODING WHERE ENCODING_ID = 1")
+        self.assertEqual(conn.execute("SELECT DB_ID, GENERATION FROM GALLERY_GENERATION").fetchone(), (db_id, 1))
+
+    def test_second_migration_does_nothing(self):
+        create_v1_db(self.db_path)
+        self._migrate()
+        conn = database.get_connection()
+        before = list(conn.iterdump())
+        self.assertFalse(self._migrate())
+        self.assertEqual(list(conn.iterdump()), before)
+
+    def test_migrate_v2(self):
+        with redirect_stdout(StringIO()):
+            create_db.main()
+        conn = database.get_connection()
+        # Turn the new DB into a v2 DB
+        for trigger in ('FACE_ENCODING_DELETED', 'FACE_ENCODING_UPDATED', 'PERSON_DELETED', 'PERSON_RENAMED'):
+            conn.execute(f"DROP TRIGGER {trigger}")
+        conn.execute("DROP TABLE GALLERY_GENERATION")
+        conn.execute("UPDATE SCHEMA_VERSION SET VERSION = 2")
+        self.assertIsNone(gallery._get_db_fingerprint(conn))
+
+        self.assertTrue(self._migrate())
+        self.assertEqual(conn.execute("SELECT VERSION FROM SCHEMA_VERSION").fetchall(), [(create_db.SCHEMA_VERSION,)])
+        self.assertIsNotNone(gallery._get_db_fingerprint(conn))
+        self.assertFalse(self._migrate())
+
+    def test_empty_and_current_dbs_are_left_alone(self):
+        self.assertFalse(self._migrate())
+        self.assertEqual(self._tables(), set())
+        with redirect_stdout(StringIO()):
+            create_db.main()
+        self.assertFalse(self._migrate())
+
+    def test_create_db_migrates_a_v1_db(self):
+        create_v1_db(self.db_path)
+        with redirect_stdout(StringIO()):
+            create_db.main()
+        conn = database.get_connection()
+        self.assertEqual(migrate_db.get_schema_version(conn), create_db.SCHEMA_VERSION)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM FACE_ENCODING").fetchone()[0], len(V1_ENCODING_ROWS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+Tests of multi-face mode: local face locations are matched to the relative Rekognition bounding boxes by IoU, with the
+local recognition and the Rekognition call stubbed.
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+from src import aws_rekognition
+from src import conversions
+from src import local_facial_recognition as lfr
+from src import multi_face
+from src.aws_rekognition import AWSFaceTup
+from src.gallery import UNKNOWN_PERSON
+from src.multi_face import FaceIdentity
+
+IMAGE_SIZE = (400, 200)  # Not square, so swapping the width and the height moves every box
+
+
+def relative_box(left, top, width, height):
+    return {'Left': left, 'Top': top, 'Width': width, 'Height': height}
+
+
+class BoxMatchingTest(unittest.TestCase):
+    def test_box_iou(self):
+        box = (0.1, 0.1, 0.3, 0.5)
+        self.assertEqual(multi_face.box_iou(box, box), 1)
+        self.assertEqual(multi_face.box_iou(box, (0.5, 0.1, 0.7, 0.5)), 0)
+        self.assertEqual(multi_face.box_iou(box, (0.3, 0.1, 0.5, 0.5)), 0)  # Touching edges
+        self.assertAlmostEqual(multi_face.box_iou(box, (0.2, 0.1, 0.4, 0.5)), 1 / 3)
+
+    def test_most_overlapping_pairs_first(self):
+        # The first box of boxes_a overlaps the first box of boxes_b most, but the second box of boxes_a overlaps it
+        # even more and overlaps nothing else
+        boxes_a = [(0, 0, 10, 10), (4, 0, 14, 10)]
+        boxes_b = [(3, 0, 13, 10), (-4, 0, 6, 10)]
+        self.assertEqual(multi_face.match_boxes(boxes_a, boxes_b), {1: 0, 0: 1})
+        self.assertEqual(multi_face.match_boxes(boxes_a, boxes_b, min_iou=0.5), {1: 0})
+        self.assertEqual(multi_face.match_boxes(boxes_a, boxes_b, min_iou=0.9), {})
+
+
+class IdentifyFacesTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.image_path = os.path.join(directory.name, 'group.png')
+        Image.new('RGB', IMAGE_SIZE).save(self.image_path)
+        self.encode_image = self._patch(aws_rekognition, 'encode_image', return_value=b'jpeg')
+
+    def _patch(self, target, attribute, **kwargs):
+        patcher = mock.patch.object(target, attribute, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def _identify(self, locations, local_names, celebrities, online=True):
+        """
+        Identify the faces found at `locations` (top, right, bottom, left), named `local_names` by the local DB, with
+        Rekognition finding `celebrities`.
+        """
+        encodings = np.zeros((len(locations),) + conversions.ndarray_shape)
+        self._patch(lfr, 'generate_face_encodings', return_value=(locations, encodings))
+        self._patch(lfr, 'identify_people_from_encodings', return_value=(local_names, [1] * len(local_names)))
+        self._patch(aws_rekognition, 'detect_celebrities_from_bytes', return_value=celebrities)
+        return multi_face.identify_faces(self.image_path, online=online)
+
+    def test_relative_boxes_are_matched_to_pixel_locations(self):
+        locations = [(20, 120, 100, 40), (20, 320, 100, 240), (100, 200, 180, 160)]
+        celebrities = [
+            # Exactly the second face once converted to pixels of the 400x200 image
+            AWSFaceTup('Tom Hanks', 99.5, relative_box(0.6, 0.1, 0.2, 0.4)),
+            # Overlaps the first face, with an IoU of 1/7 only
+            AWSFaceTup('Rita Wilson', 98.0, relative_box(0.25, 0.1, 0.2, 0.4)),
+        ]
+        identities = self._identify(locations, [UNKNOWN_PERSON, UNKNOWN_PERSON, 'alice'], celebrities)
+        self.assertEqual(identities, [
+            FaceIdentity(locations[0], None, None, None),
+            FaceIdentity(locations[1], conversions.get_normalized_name('Tom Hanks'), 'aws', 99.5),
+            FaceIdentity(locations[2], 'alice', 'local', None),
+        ])
+        self.encode_image.assert_called_once_with(self.image_path)
+
+    def test_local_faces_competing_for_one_box(self):
+        # Both faces overlap the Rekognition box, the one listed first less than the other
+        locations = [(20, 140, 100, 60), (20, 120, 100, 40)]
+        celebrities = [AWSFaceTup('Tom Hanks', 99.5, relative_box(0.1, 0.1, 0.2, 0.4))]
+        local_boxes = [(left / 400, top / 200, right / 400, bottom / 200) for top, right, bottom, left in locations]
+        self.assertGreater(multi_face.box_iou(local_boxes[0], (0.1, 0.1, 0.3, 0.5)), multi_face.MIN_BOX_IOU)
+        identities = self._identify(locations, [UNKNOWN_PERSON, UNKNOWN_PERSON], celebrities)
+        self.assertEqual([(identity.name, identity.source) for identity in identities],
+                         [(None, None), (conversions.get_normalized_name('Tom Hanks'), 'aws')])
+
+    def test_rekognition_is_only_called_for_unknown_faces(self):
+        locations = [(20, 120, 100, 40), (20, 320, 100, 240)]
+        identities = self._identify(locations, ['alice', 'bob'], [])
+        self.assertEqual([identity.source for identity in identities], ['local', 'local'])
+        self.encode_image.assert_not_called()
+
+        identities = self._identify(locations, ['alice', UNKNOWN_PERSON], [], online=False)
+        self.assertEqual(identities[1], FaceIdentity(locations[1], None, None, None))
+        self.encode_image.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
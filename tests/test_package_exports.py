@@ -0,0 +1,47 @@
+"""
+Tests of the names src/__init__.py star-imports: every public name must come from exactly one module, otherwise the
+module imported last silently shadows the others.
+"""
+
+import importlib
+import inspect
+import pkgutil
+import unittest
+from collections import defaultdict
+
+import src
+
+
+def _get_public_names(module):
+    """
+    Get the names a star import of a module exports and that the module itself defines: its `__all__`, or the
+    functions and classes defined in it for modules without one.
+    """
+    if hasattr(module, '__all__'):
+        return module.__all__
+    return [name for name, value in vars(module).items()
+            if not name.startswith('_') and (inspect.isfunction(value) or inspect.isclass(value))
+            and value.__module__ == module.__name__]
+
+
+class PackageExportsTest(unittest.TestCase):
+    def test_public_names_are_unique(self):
+        owners = defaultdict(list)
+        for module_info in pkgutil.iter_modules(src.__path__):
+            module = importlib.import_module(f'src.{module_info.name}')
+            for name in _get_public_names(module):
+                owners[name].append(module_info.name)
+        # main() is the command line entry point of several modules and is never exported through __all__
+        owners.pop('main', None)
+        self.assertEqual({name: modules for name, modules in owners.items() if len(modules) > 1}, {})
+
+    def test_cache_functions_resolve_to_their_module(self):
+        from src import rekognition_cache
+        from src import sparql_cache
+        self.assertIs(src.clear_cache, sparql_cache.clear_cache)
+        self.assertIs(src.clear_rekognition_cache, rekognition_cache.clear_rekognition_cache)
+        self.assertIs(src.get_rekognition_cache_stats, rekognition_cache.get_rekognition_cache_stats)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Tests of the persistent SPARQL answer cache: TTL expiry, the shorter TTL of 'UNKNOWN' answers and LRU eviction.
+"""
+
+import os
+import tempfile
+import unittest
+from itertools import count
+from unittest import mock
+
+from src import sparql_cache
+
+SUBJECT = 'http://dbpedia.org/resource/Tom_Hanks'
+
+
+class SparqlCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'sparql_cache.db')
+        sparql_cache.configure_cache(path=self.path)
+        # Every call to time.time() is one second after the previous one, so LRU order never depends on timing
+        clock = count(1_000_000)
+        patcher = mock.patch.object(sparql_cache.time, 'time', side_effect=lambda: float(next(clock)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        sparql_cache.configure_cache()  # Closes the connection to the temporary cache
+        self.directory.cleanup()
+
+    def _stats_delta(self, before):
+        after = sparql_cache.get_cache_stats()
+        return {key: after[key] - before[key] for key in ('hits', 'misses', 'expired', 'evicted')}
+
+    def _total_size(self):
+        with sparql_cache._lock:
+            conn = sparql_cache._get_connection()
+            summed = conn.execute("SELECT COALESCE(SUM(SIZE), 0) FROM SPARQL_CACHE").fetchone()[0]
+            return sparql_cache._get_total_size(conn), summed
+
+    def test_hit_and_miss(self):
+        before = sparql_cache.get_cache_stats()
+        self.assertIsNone(sparql_cache.get_cached_answers(SUBJECT, 'spouse'))
+        sparql_cache.store_answers(SUBJECT, 'spouse', ['Rita_Wilson'])
+        self.assertEqual(sparql_cache.get_cached_answers(SUBJECT, 'spouse'), ['Rita_Wilson'])
+        self.assertEqual(self._stats_delta(before), {'hits': 1, 'misses': 1, 'expired': 0, 'evicted': 0})
+
+    def test_errors_are_not_cached(self):
+        sparql_cache.store_answers(SUBJECT, 'spouse', ['ERROR'])
+        self.assertIsNone(sparql_cache.get_cached_answers(SUBJECT, 'spouse'))
+
+    def test_expired_answers_are_dropped(self):
+        sparql_cache.configure_cache(path=self.path, ttl=10)
+        sparql_cache.store_answers(SUBJECT, 'spouse', ['Rita_Wilson'])
+        self.assertEqual(sparql_cache.get_cached_answers(SUBJECT, 'spouse'), ['Rita_Wilson'])
+        with mock.patch.object(sparql_cache.time, 'time', return_value=2_000_000.0):
+            before = sparql_cache.get_cache_stats()
+            self.assertIsNone(sparql_cache.get_cached_answers(SUBJECT, 'spouse'))
+            self.assertEqual(self._stats_delta(before), {'hits': 0, 'misses': 1, 'expired': 1, 'evicted': 0})
+        self.assertEqual(self._total_size(), (0, 0))
+
+    def test_unknown_answers_use_the_negative_ttl(self):
+        sparql_cache.configure_cache(path=self.path, ttl=3600, negative_ttl=5)
+        sparql_cache.store_answers(SUBJECT, 'spouse', ['Rita_Wilson'])
+        sparql_cache.store_answers(SUBJECT, 'deathPlace', ['UNKNOWN'])
+        with mock.patch.object(sparql_cache.time, 'time', return_value=1_000_100.0):
+            self.assertEqual(sparql_cache.get_cached_answers(SUBJECT, 'spouse'), ['Rita_Wilson'])
+            self.assertIsNone(sparql_cache.get_cached_answers(SUBJECT, 'deathPlace'))
+
+    def test_least_recently_used_answers_are_evicted(self):
+        size = len(SUBJECT) + len('q0') + len('["answer"]')
+        sparql_cache.configure_cache(path=self.path, max_bytes=3 * size)
+        for question in ('q0', 'q1', 'q2'):
+            sparql_cache.store_answers(SUBJECT, question, ['answer'])
+        sparql_cache.get_cached_answers(SUBJECT, 'q0')  # q1 is now the least recently used answer
+
+        before = sparql_cache.get_cache_stats()
+        sparql_cache.store_answers(SUBJECT, 'q3', ['answer'])
+        self.assertEqual(self._stats_delta(before)['evicted'], 1)
+        self.assertIsNone(sparql_cache.get_cached_answers(SUBJECT, 'q1'))
+        for question in ('q0', 'q2', 'q3'):
+            self.assertEqual(sparql_cache.get_cached_answers(SUBJECT, question), ['answer'])
+
+    def test_running_total_follows_every_write(self):
+        sparql_cache.store_answers(SUBJECT, 'spouse', ['Rita_Wilson'])
+        sparql_cache.store_answers(SUBJECT, 'spouse', ['Rita_Wilson', 'Samantha_Lewes'])  # Replaces the answers
+        sparql_cache.store_answers(SUBJECT, 'child', ['Colin_Hanks'])
+        total, summed = self._total_size()
+        self.assertEqual(total, summed)
+        sparql_cache.clear_cache()
+        self.assertEqual(self._total_size(), (0, 0))
+
+    def test_running_total_is_seeded_from_an_existing_cache(self):
+        sparql_cache.store_answers(SUBJECT, 'spouse', ['Rita_Wilson'])
+        with sparql_cache._lock:
+            sparql_cache._get_connection().execute("DROP TABLE SPARQL_CACHE_SIZE")
+            sparql_cache._get_connection().execute("DROP TRIGGER SPARQL_CACHE_INSERTED")
+        sparql_cache.configure_cache()
+        sparql_cache.configure_cache(path=self.path)  # Reopened like a cache file written before the running total
+        total, summed = self._total_size()
+        self.assertEqual(total, summed)
+        self.assertGreater(total, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()